@@ -0,0 +1,156 @@
+"""
+Micro benchmarks of the generation pipeline.
+
+Usage: python benchmarks.py [benchmark ...]
+With no argument, every benchmark is run.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from PIL import Image
+
+from trdg import background_generator, distorsion_generator
+from trdg.data_generator import FakeTextDataGenerator, sample_rng
+from trdg.image_encoder import ImageEncoder
+
+
+def _timeit(func, count):
+    start = time.time()
+    for i in range(count):
+        func(i)
+    elapsed = time.time() - start
+    return count / elapsed
+
+
+def _generate(index, output_mask, **kwargs):
+    params = dict(
+        text="Lorem ipsum dolor sit amet",
+        font_en="tests/font.ttf",
+        font_ch="tests/font.ttf",
+        out_dir=None,
+        size=32,
+        extension="jpg",
+        skewing_angle=0,
+        random_skew=False,
+        blur=1,
+        random_blur=False,
+        background_type=0,
+        distorsion_type=0,
+        distorsion_orientation=0,
+        is_handwritten=False,
+        name_format=0,
+        width=-1,
+        alignment=1,
+        text_color="#282828",
+        orientation=0,
+        space_width=1.0,
+        character_spacing=0,
+        margins=(5, 5, 5, 5),
+        random_margins=False,
+        erosion_kernel_size=0,
+        erosion_iteration=0,
+        erosion_cap=0,
+        n_holes_pct=0,
+        hole_size_pct=0,
+        alpha_low=255,
+        invert=False,
+        border_prob=0,
+        border=(5, 5, 5, 5),
+        fit=False,
+        output_mask=output_mask,
+        # The same samples whatever is compared
+        rng=sample_rng(0, index),
+    )
+    params.update(kwargs)
+    return FakeTextDataGenerator.generate(index, **params)
+
+
+def bench_mask(count=300):
+    """
+        Samples per second with and without the mask pipeline
+    """
+
+    for label, kwargs in [
+        ("plain", {}),
+        ("skew + sine distorsion", dict(skewing_angle=5, distorsion_type=1)),
+        ("erosion + cutout", dict(erosion_kernel_size=2, erosion_iteration=1, erosion_cap=0.3,
+                                  n_holes_pct=1, hole_size_pct=0.2)),
+    ]:
+        with_mask = _timeit(lambda i: _generate(i, 1, **kwargs), count)
+        without_mask = _timeit(lambda i: _generate(i, 0, **kwargs), count)
+        print(
+            "mask | {:<24} | output_mask=1: {:7.1f} img/s | output_mask=0: {:7.1f} img/s | x{:.2f}".format(
+                label, with_mask, without_mask, without_mask / with_mask
+            )
+        )
+
+
+def bench_background(count=200):
+    """
+        Backgrounds per second of every background type
+    """
+
+    for label, func in [
+        ("gaussian noise", background_generator.gaussian_noise),
+        ("plain white", background_generator.plain_white),
+        ("quasicrystal", background_generator.quasicrystal),
+    ]:
+        rate = _timeit(lambda i: func(42, 400), count)
+        print("background | {:<16} | {:8.1f} img/s".format(label, rate))
+
+
+def bench_distorsion(count=300):
+    """
+        Distorsions per second of a 42x400 image and its mask
+    """
+
+    image = background_generator.gaussian_noise(42, 400)
+    mask = Image.new("RGB", image.size)
+    for label, func in [
+        ("sine", distorsion_generator.sin),
+        ("cosine", distorsion_generator.cos),
+        ("random", distorsion_generator.random),
+    ]:
+        rate = _timeit(lambda i: func(image, mask, vertical=True, horizontal=True), count)
+        print("distorsion | {:<8} | {:8.1f} img/s".format(label, rate))
+
+
+def bench_encoder(count=300):
+    """
+        Images per second and bytes per image of every format, backend and
+        setting of ImageEncoder, on a rendered sample
+    """
+
+    image = _generate(0, 0, background_type=0)
+    for label, extension, encoder in [
+        ("jpg q75 pil", "jpg", ImageEncoder("pil")),
+        ("jpg q75 cv2", "jpg", ImageEncoder("cv2")),
+        ("jpg q95 cv2", "jpg", ImageEncoder("cv2", jpeg_quality=95)),
+        ("png l6 pil", "png", ImageEncoder("pil")),
+        ("png l1 pil", "png", ImageEncoder("pil", png_compression=1)),
+        ("png l1 cv2", "png", ImageEncoder("cv2", png_compression=1)),
+        ("png l0 cv2", "png", ImageEncoder("cv2", png_compression=0)),
+        ("webp q80 pil", "webp", ImageEncoder("pil")),
+        ("webp q80 cv2", "webp", ImageEncoder("cv2")),
+        ("npy", "npy", ImageEncoder()),
+    ]:
+        size = len(encoder.encode(image, extension))
+        rate = _timeit(lambda i: encoder.encode(image, extension), count)
+        print("encoder | {:<12} | {:8.1f} img/s | {:7d} bytes".format(label, rate, size))
+
+
+BENCHMARKS = {
+    "background": bench_background,
+    "distorsion": bench_distorsion,
+    "encoder": bench_encoder,
+    "mask": bench_mask,
+}
+
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or sorted(BENCHMARKS):
+        BENCHMARKS[name]()
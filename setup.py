@@ -42,7 +42,7 @@ setup(
     include_package_data=True,
     install_requires=[
         "pillow==5.1.0",
-        "numpy>=1.15.1,<1.17",
+        "numpy>=1.17.0",
         "requests>=2.20.0",
         "opencv-python>=4.0.0.21",
         "tqdm>=4.23.0",
@@ -50,7 +50,9 @@ setup(
     ],
     entry_points={
         "console_scripts": [
-            "trdg=trdg.run:main"
+            "trdg=trdg.run:main",
+            "trdg-font-index=trdg.font_index:main",
+            "trdg-stroke-library=trdg.stroke_library:main",
         ],
     },
 )
@@ -1,9 +1,22 @@
+import io
+import json
 import os
 import sys
+import math
 import unittest
 import subprocess
 import hashlib
+import operator
+import shutil
+import threading
+import random
 import string
+import tempfile
+import multiprocessing
+
+import cv2
+import numpy as np
+from PIL import Image
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "./trdg")))
 
@@ -12,8 +25,38 @@ try:
 except:
     pass
 
-from trdg.data_generator import FakeTextDataGenerator
-from trdg import background_generator
+from trdg.data_generator import FakeTextDataGenerator, sample_rng, set_generation_config
+from trdg import background_generator, computer_text_generator, distorsion_generator
+from trdg.font_cache import FontCache
+from trdg.generation_config import GenerationConfig
+from trdg.stroke_library import StrokeLibrary, jitter
+from trdg.stroke_renderer import render_strokes
+from trdg.picture_cache import PictureCache, get_picture_cache
+from trdg import run
+from trdg.output_layout import part_name, read_labels, sample_dir, shard_part
+from trdg.tar_shards import ShardReader, write_shards
+from trdg.sample_writer import SampleWriter, get_sample_writer, set_sample_writer
+from trdg.resume import SampleJournal, find_done, read_shard_indexes
+from trdg.leases import LeaseQueue
+from trdg.image_encoder import ImageEncoder
+from trdg.tensor_output import LabelPacker, TensorDataset, TensorWriter, create_tensor_output
+from trdg.warmup import warm_up
+from trdg.font_cache import get_font_cache
+from trdg.text_layout import (
+    get_font_metrics,
+    layout_horizontal,
+    layout_vertical,
+    clear_font_metrics,
+    route_text,
+    MissingGlyphError,
+)
+from trdg.font_index import (
+    build_index,
+    load_metrics_index,
+    read_codepoints,
+    get_font_coverage,
+    MetricsIndex,
+)
 from trdg.generators import (
     GeneratorFromDict,
     GeneratorFromRandom,
@@ -25,6 +68,7 @@ from trdg.string_generator import (
     create_strings_from_dict,
     create_strings_from_wikipedia,
     create_strings_randomly,
+    iter_strings_from_file,
 )
 
 
@@ -118,6 +162,12 @@ class DataGenerator(unittest.TestCase):
             len(strings) == 6 and strings[0] != strings[1] and strings[0] == strings[3]
         )
 
+    def test_iter_strings_from_file(self):
+        self.assertTrue(
+            list(iter_strings_from_file("tests/test.txt", 7))
+            == create_strings_from_file("tests/test.txt", 7)
+        )
+
     def test_create_strings_from_dict(self):
         strings = create_strings_from_dict(
             3, False, 2, ["TEST", "TEST", "TEST", "TEST"]
@@ -849,6 +899,840 @@ class DataGenerator(unittest.TestCase):
         self.assertTrue(len(bkgd.histogram()) > 20 and bkgd.size == (128, 64))
 
 
+class FontCacheTest(unittest.TestCase):
+    def test_font_cache_hits_and_misses(self):
+        cache = FontCache(capacity=2)
+        font = cache.get("tests/font.ttf", 32)
+
+        self.assertTrue(cache.get("tests/font.ttf", 32) is font)
+        self.assertTrue(cache.hits == 1 and cache.misses == 1)
+
+    def test_font_cache_evicts_least_recently_used(self):
+        cache = FontCache(capacity=2)
+        cache.get("tests/font.ttf", 16)
+        cache.get("tests/font.ttf", 32)
+        cache.get("tests/font.ttf", 16)
+        cache.get("tests/font.ttf", 64)
+
+        self.assertTrue(
+            len(cache) == 2
+            and ("tests/font.ttf", 32) not in cache
+            and cache.evictions == 1
+        )
+
+
+class GenerationConfigTest(unittest.TestCase):
+    def test_config_matches_positional_parameters(self):
+        config = GenerationConfig(extension="png", skewing_angle=4, random_skew=True, blur=1)
+        images = []
+        for generate in [
+            lambda: FakeTextDataGenerator.generate(
+                3, "TEST TEST", "tests/font.ttf", "tests/font.ttf", None, 32, "png", 4, True,
+                1, False, 0, 0, 0, False, 0, -1, 1, "#282828", 0, 1.0, 0, (5, 5, 5, 5),
+                False, 0, 0, 0, 0, 0, 255, False, 0, (5, 5, 5, 5), False, False,
+                rng=sample_rng(7, 3),
+            ),
+            lambda: FakeTextDataGenerator.generate_from_config(
+                3, "TEST TEST", "tests/font.ttf", "tests/font.ttf", config, 7
+            ),
+        ]:
+            images.append(generate().tobytes())
+
+        self.assertTrue(images[0] == images[1])
+
+    def test_kerning_is_passed_to_the_layout(self):
+        plain, kerned = [
+            FakeTextDataGenerator.generate_from_config(
+                0, "AVATAR To", "tests/font.ttf", "tests/font.ttf",
+                GenerationConfig(width=-1, margins=(0, 0, 0, 0), kerning=kerning), 1,
+            )
+            for kerning in [False, True]
+        ]
+        generator = GeneratorFromStrings(
+            ["AVATAR To"], count=1, fonts_en=["tests/font.ttf"], fonts_ch=["tests/font.ttf"],
+            margins=(0, 0, 0, 0), kerning=True, seed=1,
+        )
+
+        self.assertTrue(
+            kerned.size[0] < plain.size[0] and next(generator)[0].size == kerned.size
+        )
+
+    def test_seed_makes_samples_reproducible(self):
+        config = GenerationConfig(random_skew=True, skewing_angle=10, background_type=0)
+        first, second, other = [
+            FakeTextDataGenerator.generate_from_config(
+                0, "TEST TEST", "tests/font.ttf", "tests/font.ttf", config, seed
+            ).tobytes()
+            for seed in [1234, 1234, 4321]
+        ]
+
+        self.assertTrue(first == second and first != other)
+
+    def test_samples_use_independent_streams(self):
+        config = GenerationConfig(
+            background_type=0, erosion_kernel_size=2, erosion_iteration=1, erosion_cap=0.5
+        )
+        # The global generators don't matter
+        np.random.seed(0)
+        first = FakeTextDataGenerator.generate_from_config(
+            0, "TEST", "tests/font.ttf", "tests/font.ttf", config, 5
+        ).tobytes()
+        np.random.seed(0)
+        second = FakeTextDataGenerator.generate_from_config(
+            1, "TEST", "tests/font.ttf", "tests/font.ttf", config, 5
+        ).tobytes()
+        again = FakeTextDataGenerator.generate_from_config(
+            0, "TEST", "tests/font.ttf", "tests/font.ttf", config, 5
+        ).tobytes()
+
+        self.assertTrue(first != second and first == again)
+
+    def test_config_is_immutable_and_picklable(self):
+        import pickle
+
+        config = GenerationConfig(size=64)
+        with self.assertRaises(AttributeError):
+            config.size = 32
+        with self.assertRaises(AttributeError):
+            config.anything = 0
+
+        self.assertTrue(pickle.loads(pickle.dumps(config)) == config)
+
+
+class WarmUpTest(unittest.TestCase):
+    def test_warm_up_loads_fonts_and_pictures(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as directory:
+            os.mkdir(os.path.join(directory, "pictures"))
+            for name in ["a.png", "b.png"]:
+                Image.new("RGB", (64, 64)).save(os.path.join(directory, "pictures", name))
+            get_picture_cache().clear()
+            os.chdir(directory)
+            try:
+                summary = warm_up(
+                    GenerationConfig(size=30, background_type=3),
+                    [os.path.join(cwd, "tests/font.ttf")] * 3,
+                )
+                background_generator.picture(32, 64)
+            finally:
+                os.chdir(cwd)
+
+        self.assertTrue(
+            summary["fonts"] == 1
+            and summary["pictures"] == 2
+            and (os.path.join(cwd, "tests/font.ttf"), 30) in get_font_cache()
+            and get_picture_cache().stats()["hits"] == 1
+        )
+        get_picture_cache().clear()
+
+    def test_warm_up_can_leave_out_the_handwriting_model(self):
+        summary = warm_up(
+            GenerationConfig(is_handwritten=True), ["tests/font.ttf"], handwriting=False
+        )
+
+        self.assertTrue(summary["fonts"] == 1 and not summary["handwritten"])
+
+    def test_generator_warm_up(self):
+        generator = GeneratorFromStrings(
+            ["TEST TEST TEST"], fonts_en=["tests/font.ttf"], fonts_ch=["tests/font.ttf"]
+        )
+
+        self.assertTrue(generator.warm_up()["fonts"] == 1)
+
+
+class StrokeRendererTest(unittest.TestCase):
+    def test_strokes_fill_a_known_bounding_box(self):
+        t = np.linspace(0, 4 * math.pi, 100)
+        offsets = np.diff(np.stack([t * 2, np.sin(t) * 3], axis=1), axis=0, prepend=0)
+        word = np.concatenate([offsets, np.zeros((100, 1))], axis=1)
+        word[49, 2] = 1
+        word[-1, 2] = 1
+        small_word = word.copy()
+        small_word[:, :2] *= 0.5
+
+        one = np.asarray(render_strokes([word], (10, 20, 30), height=48))
+        two = np.asarray(render_strokes([word, small_word], (10, 20, 30), height=48))
+        alpha = two[:, :, 3]
+
+        self.assertTrue(
+            one.shape[0] == two.shape[0] == 48
+            and two.shape[1] > one.shape[1]
+            and alpha[0].max() > 0
+            and alpha[-1].max() > 0
+            and alpha[:, 0].max() > 0
+            and alpha[:, -1].max() > 0
+            and (two[:, :, :3] == (10, 20, 30)).all()
+        )
+
+
+class StrokeLibraryTest(unittest.TestCase):
+    def test_add_flush_and_reopen(self):
+        first = np.random.rand(20, 3).astype(np.float32)
+        second = np.random.rand(7, 3).astype(np.float32)
+        third = np.random.rand(11, 3).astype(np.float32)
+        with tempfile.TemporaryDirectory() as directory:
+            library = StrokeLibrary(directory)
+            library.add("hello", first)
+            library.add("world", second)
+            library.flush()
+            library.add("hello", third)
+            pending = library.get("hello", 1)
+            library.flush()
+
+            reopened = StrokeLibrary(directory)
+            self.assertTrue(
+                len(reopened) == 2
+                and reopened.count("hello") == 2
+                and "world" in reopened
+                and (reopened.get("hello", 0) == first).all()
+                and (reopened.get("world", 0) == second).all()
+                and (reopened.get("hello", 1) == third).all()
+                and (pending == third).all()
+                and reopened.sample("missing") is None
+            )
+
+    def test_jitter_keeps_the_end_of_strokes(self):
+        coords = np.random.rand(30, 3)
+        coords[:, 2] = np.random.randint(0, 2, 30)
+        jittered = jitter(coords)
+        self.assertTrue(
+            jittered.shape == coords.shape
+            and (jittered[:, 2] == coords[:, 2]).all()
+            and not np.allclose(jittered[:, :2], coords[:, :2])
+        )
+
+
+class OutputLayoutTest(unittest.TestCase):
+    def test_sample_dir(self):
+        self.assertTrue(
+            sample_dir(1234567, "1234567.jpg") == ""
+            and sample_dir(1234567, "1234567.jpg", "index") == os.path.join("001", "234")
+            and sample_dir(999, "999.jpg", "index") == os.path.join("000", "000")
+            and sample_dir(1234567, "1234567.jpg", "index", 100)
+            == os.path.join("123", "45")
+            and sample_dir(5, "5.jpg", "hash") == sample_dir(6, "5.jpg", "hash")
+            and len(sample_dir(5, "5.jpg", "hash").split(os.sep)) == 2
+        )
+
+    def test_generate_in_sharded_directories(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = GenerationConfig(
+                out_dir=directory,
+                extension="png",
+                name_format=2,
+                output_mask=1,
+                layout="index",
+                files_per_dir=2,
+            )
+            for i in range(5):
+                FakeTextDataGenerator.generate_from_config(
+                    i, "test", "tests/font.ttf", "tests/font.ttf", config
+                )
+            self.assertTrue(
+                sorted(os.listdir(directory)) == ["0", "1"]
+                and sorted(os.listdir(os.path.join(directory, "0"))) == ["0", "1"]
+                and sorted(os.listdir(os.path.join(directory, "0", "1")))
+                == ["2.png", "2_mask.png", "3.png", "3_mask.png"]
+                and sorted(os.listdir(os.path.join(directory, "1", "0")))
+                == ["4.png", "4_mask.png"]
+            )
+
+
+class ImageEncoderTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.image = background_generator.gaussian_noise(32, 96, rng=rng).convert("RGBA")
+
+    def decode(self, data):
+        return Image.open(io.BytesIO(data))
+
+    def test_jpeg_drops_alpha(self):
+        low = ImageEncoder(jpeg_quality=20).encode(self.image, "jpg")
+        high = ImageEncoder(jpeg_quality=95).encode(self.image, "jpg")
+        from_cv2 = ImageEncoder("cv2", jpeg_quality=95).encode(self.image, "jpg")
+        self.assertTrue(
+            self.decode(high).mode == "RGB"
+            and self.decode(from_cv2).size == self.image.size
+            and len(low) < len(high)
+        )
+
+    def test_png_is_lossless_whatever_the_backend(self):
+        fast = ImageEncoder(png_compression=0).encode(self.image, "png")
+        small = ImageEncoder("cv2", png_compression=9).encode(self.image, "png")
+        self.assertTrue(
+            np.array_equal(np.asarray(self.decode(fast)), np.asarray(self.image))
+            and np.array_equal(np.asarray(self.decode(small)), np.asarray(self.image))
+            and len(small) < len(fast)
+        )
+
+    def test_raw_and_webp(self):
+        array = np.load(io.BytesIO(ImageEncoder().encode(self.image, "npy")))
+        webp = ImageEncoder(webp_quality=50).encode(self.image, "webp")
+        self.assertTrue(
+            array.dtype == np.uint8
+            and np.array_equal(array, np.asarray(self.image.convert("RGB")))
+            and self.decode(webp).size == self.image.size
+        )
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            ImageEncoder("imageio")
+
+
+class TensorOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.out_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.out_dir)
+
+    def test_rows_are_padded_and_scaled(self):
+        create_tensor_output(self.out_dir, 4, 16, 40, part="00001-of-00002")
+        writer = TensorWriter(self.out_dir, "00001-of-00002", first_index=10)
+        narrow = Image.new("RGB", (20, 16), (255, 0, 0))
+        widths = [
+            writer.write(10, narrow),
+            writer.write(11, Image.new("RGBA", (30, 32), (0, 255, 0, 255))),
+            writer.write(13, Image.new("L", (100, 16), 255)),
+        ]
+        writer.flush()
+        LabelPacker(self.out_dir, 4, "00001-of-00002").close()
+        dataset = TensorDataset(self.out_dir, "00001-of-00002")
+        self.assertTrue(
+            widths == [20, 15, 40]
+            and dataset.images.shape == (4, 16, 40, 3)
+            and list(dataset.widths) == [20, 15, 0, 40]
+            and np.array_equal(dataset.images[0, :, :20], np.asarray(narrow))
+            and not dataset.images[0, :, 20:].any()
+            and (dataset.images[1, :, :15, 1] == 255).all()
+            and (dataset.images[3] == 255).all()
+        )
+
+    def test_labels(self):
+        create_tensor_output(self.out_dir, 3, 8, 8, channels=1)
+        labels = LabelPacker(self.out_dir, 3)
+        for row, text in enumerate(["one", "", "trois é 中"]):
+            labels.add(row, text)
+        with self.assertRaises(ValueError):
+            labels.add(0, "again")
+        labels.close()
+        dataset = TensorDataset(self.out_dir)
+        self.assertTrue(
+            [dataset[i][1] for i in range(len(dataset))] == ["one", "", "trois é 中"]
+            and dataset[0][0].shape == (8, 0, 1)
+        )
+
+    def test_unsupported_channels(self):
+        with self.assertRaises(ValueError):
+            create_tensor_output(self.out_dir, 1, 8, 8, channels=4)
+
+
+class TarShardsTest(unittest.TestCase):
+    def test_write_and_read_shards(self):
+        generator = GeneratorFromStrings(
+            ["one", "two", "three"],
+            count=5,
+            fonts_en=["tests/font.ttf"],
+            fonts_ch=["tests/font.ttf"],
+            output_mask=True,
+        )
+        samples = list(generator)
+        with tempfile.TemporaryDirectory() as directory:
+            shards = write_shards(samples, directory, "png", samples_per_shard=2)
+            with ShardReader(directory) as reader:
+                streamed = list(reader)
+                sample = reader[3]
+                self.assertTrue(
+                    len(shards) == 3
+                    and len(reader) == 5
+                    and [s["label"] for s in streamed] == ["one", "two", "three", "one", "two"]
+                    and [s["index"] for s in streamed] == list(range(5))
+                    and sample["label"] == "one"
+                    and np.array_equal(np.asarray(sample["image"]), np.asarray(samples[3][0][0]))
+                    and np.array_equal(np.asarray(sample["mask"]), np.asarray(samples[3][0][1]))
+                    and np.array_equal(
+                        np.asarray(streamed[4]["image"]), np.asarray(samples[4][0][0])
+                    )
+                )
+
+    def test_workers_encode_the_samples(self):
+        config = GenerationConfig(extension="png", output_mask=True)
+        set_generation_config(config)
+        try:
+            index, files = FakeTextDataGenerator.encode_from_task(
+                (4, "one", "tests/font.ttf", 3)
+            )
+            skipped = FakeTextDataGenerator.encode_from_task((5, "中", "tests/font.ttf", 3))
+        finally:
+            set_generation_config(None)
+        image, mask = FakeTextDataGenerator.generate_from_config(
+            4, "one", "tests/font.ttf", "tests/font.ttf", config, 3
+        )
+        self.assertTrue(
+            index == 4
+            and sorted(files) == ["json", "mask.png", "png"]
+            and json.loads(files["json"].decode("utf8"))
+            == {"index": 4, "label": "one", "font": "tests/font.ttf", "seed": 3}
+            and np.array_equal(
+                np.asarray(Image.open(io.BytesIO(files["png"]))), np.asarray(image)
+            )
+            and skipped == (5, None)
+        )
+
+
+class SampleWriterTest(unittest.TestCase):
+    def test_bounded_jobs_and_errors(self):
+        release = threading.Event()
+        done = []
+        writer = SampleWriter(threads=1, max_pending=2)
+        writer.submit(release.wait)
+        writer.submit(done.append, 1)
+        blocked_pending = writer.pending
+        submitted = threading.Thread(target=writer.submit, args=(done.append, 2))
+        submitted.start()
+        submitted.join(0.2)
+        blocked = submitted.is_alive()
+        release.set()
+        submitted.join()
+        writer.submit(operator.truediv, 1, 0)
+        with self.assertRaises(ZeroDivisionError):
+            writer.close()
+        self.assertTrue(blocked_pending == 2 and blocked and done == [1, 2])
+
+    def test_generate_with_writer_threads(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = GenerationConfig(out_dir=directory, extension="png", output_mask=1)
+            set_sample_writer(2)
+            try:
+                for i in range(10):
+                    FakeTextDataGenerator.generate_from_config(
+                        i, "test", "tests/font.ttf", "tests/font.ttf", config
+                    )
+            finally:
+                set_sample_writer(0)
+            self.assertTrue(len(os.listdir(directory)) == 20 and get_sample_writer() is None)
+
+
+class ResumeTest(unittest.TestCase):
+    def test_find_done_from_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = SampleJournal(directory, labels=True, metadata=True)
+            journal.add(3, os.path.join("0", "3.jpg"), "three", "font.ttf", 1)
+            journal.add(0, os.path.join("0", "0.jpg"), "zero zero", "font.ttf", 2)
+            journal.close()
+            labels = find_done(directory, 5)[0]
+            with open(os.path.join(directory, "metadata.jsonl"), "a") as f:
+                f.write('{"index": 4, "lab')
+            metadata, source = find_done(directory, 5)
+            os.remove(os.path.join(directory, "metadata.jsonl"))
+            from_labels, labels_source = find_done(directory, 5)
+            self.assertTrue(
+                source == "metadata.jsonl"
+                and labels_source == "labels.txt"
+                and metadata.tolist() == [True, False, False, True, False]
+                and from_labels.tolist() == metadata.tolist()
+                and find_done(directory, 5, name_format=0)[0].sum() == 0
+                and find_done(os.path.join(directory, "0"), 5)[1] is None
+            )
+
+    def test_labels_with_spaces(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = SampleJournal(directory, labels=True, name_format=0)
+            journal.add(1, os.path.join("0", "two words_1.jpg"), "two words", "font.ttf", 1)
+            journal.add(3, os.path.join("0", "a  b c_3.jpg"), "a  b c", "font.ttf", 2)
+            journal.close()
+            self.assertTrue(
+                find_done(directory, 4, name_format=0)[0].tolist() == [False, True, False, True]
+                and read_labels(directory, name_format=0)
+                == {"0/two words_1.jpg": "two words", "0/a  b c_3.jpg": "a  b c"}
+            )
+
+    def test_find_done_from_image_names(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["a_b_1.jpg", "c_3.jpg", "c_3_mask.png", "c_4_mask.png", "c_2.jpg.part"]:
+                open(os.path.join(directory, name), "w").close()
+            done, source = find_done(directory, 5, name_format=0, extension="jpg")
+            self.assertTrue(
+                source == "the image file names"
+                and done.tolist() == [False, True, False, True, False]
+                and find_done(directory, 5, name_format=0)[1] is None
+            )
+
+    def test_appending_drops_a_cut_line(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "labels.txt"), "w", encoding="utf8") as f:
+                f.write("0.jpg zero\n1.jpg o" + "n" * 5000)
+            with open(os.path.join(directory, "metadata.jsonl"), "w", encoding="utf8") as f:
+                f.write('{"index": 4, "lab')
+            journal = SampleJournal(directory, labels=True, metadata=True, append=True)
+            journal.add(1, "1.jpg", "one", "font.ttf", 1)
+            journal.close()
+            with open(os.path.join(directory, "labels.txt"), "r", encoding="utf8") as f:
+                labels = f.read()
+            with open(os.path.join(directory, "metadata.jsonl"), "r", encoding="utf8") as f:
+                metadata = [json.loads(line)["index"] for line in f]
+            self.assertTrue(labels == "0.jpg zero\n1.jpg one\n" and metadata == [1])
+
+    def test_shard_indexes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            write_shards(
+                [(Image.new("RGB", (8, 8)), str(i)) for i in range(5)],
+                directory,
+                "png",
+                samples_per_shard=2,
+            )
+            # An unfinished shard has no index
+            os.remove(os.path.join(directory, "shard-000002.tar.idx"))
+            done = np.zeros(5, dtype=bool)
+            self.assertTrue(
+                read_shard_indexes(directory, done) == 2
+                and done.tolist() == [True, True, True, True, False]
+            )
+
+
+class ShardingTest(unittest.TestCase):
+    def test_shard_range(self):
+        ranges = [run.shard_range(10, 3, k) for k in range(3)]
+        self.assertTrue(
+            ranges == [(0, 3), (3, 6), (6, 10)]
+            and run.shard_range(10) == (0, 10)
+            and part_name("labels.txt", shard_part(40, 3)) == "labels-00003-of-00040.txt"
+            and part_name("labels.txt", shard_part(1, 0)) == "labels.txt"
+        )
+
+    def test_shards_get_the_tasks_of_the_whole_run(self):
+        args = run.argparse.Namespace(
+            count=23,
+            seed=11,
+            input_file="",
+            use_wikipedia=False,
+            random_sequences=False,
+            length=1,
+            random=False,
+            case=None,
+        )
+        lang_dict = ["a", "b", "c", "d", "e"]
+        fonts = ["font_{}.ttf".format(i) for i in range(5)]
+        batch_size = run.STRING_BATCH_SIZE
+        # Shards starting and stopping in the middle of batches
+        run.STRING_BATCH_SIZE = 4
+        try:
+            tasks = list(run.iter_tasks(args, lang_dict, fonts))
+            sharded = []
+            for k in range(3):
+                sharded += run.iter_tasks(args, lang_dict, fonts, *run.shard_range(23, 3, k))
+            done = np.zeros(23, dtype=bool)
+            done[5:9] = True
+            resumed = list(run.iter_tasks(args, lang_dict, fonts, 3, 12, done))
+        finally:
+            run.STRING_BATCH_SIZE = batch_size
+        self.assertTrue(
+            [t[0] for t in tasks] == list(range(23))
+            and sharded == tasks
+            and resumed == tasks[3:5] + tasks[9:12]
+        )
+
+
+def lease_worker(directory, results):
+    """
+        Work through the chunks of a LeaseQueue of 50 samples the way run.py
+        does, skipping every seventh sample
+    """
+
+    leases = LeaseQueue(directory, 50, lease_size=5)
+    for chunk in leases:
+        start, stop = leases.chunk_range(chunk)
+        for index in range(start, stop):
+            leases.started(index)
+        leases.finished(chunk)
+        for index in range(start, stop):
+            if index % 7 == 3:
+                leases.skipped(index)
+            else:
+                leases.written(index)
+            results.put(index)
+    leases.close()
+
+
+class LeaseQueueTest(unittest.TestCase):
+    def test_processes_share_the_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(target=lease_worker, args=(directory, results))
+                for _ in range(3)
+            ]
+            for w in workers:
+                w.start()
+            indices = [results.get(timeout=30) for _ in range(50)]
+            for w in workers:
+                w.join()
+            self.assertTrue(
+                sorted(indices) == list(range(50))
+                and sorted(os.listdir(directory))
+                == ["{:09d}.done".format(chunk) for chunk in range(10)]
+            )
+
+    def test_expired_lease_is_taken_over(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first = LeaseQueue(directory, 10, lease_size=5, timeout=60)
+            second = LeaseQueue(directory, 10, lease_size=5, timeout=60)
+            claimed = [first.claim(), second.claim(), second.claim()]
+            # The first process stopped renewing its lease of chunk 0
+            os.utime(os.path.join(directory, "000000000.0.lease"), (0, 0))
+            taken_over = second.claim()
+            lost = first.renew()
+            first.finished(0)
+            second.finished(0)
+            self.assertTrue(
+                claimed == [0, 1, None]
+                and taken_over == 0
+                and lost == [0]
+                and not first.holds(0)
+                and sorted(os.listdir(directory)) == ["000000000.done", "000000001.0.lease"]
+            )
+            first.close()
+            second.close()
+
+
+class PictureCacheTest(unittest.TestCase):
+    def test_listing_and_lru_capacity(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ["a.png", "b.png", ".hidden.png"]:
+                Image.new("RGB", (100, 50)).save(os.path.join(directory, name))
+            # Room for a single 100x50 RGB picture
+            cache = PictureCache(capacity=100 * 50 * 3)
+            pictures = sorted(cache.listdir(directory))
+            Image.new("RGB", (100, 50)).save(os.path.join(directory, "c.png"))
+
+            a = cache.get(os.path.join(directory, "a.png"), 40, 32)
+            a_again = cache.get(os.path.join(directory, "a.png"), 60, 10)
+            cache.get(os.path.join(directory, "b.png"), 40, 32)
+
+            self.assertTrue(
+                pictures == ["a.png", "b.png"]
+                and sorted(cache.listdir(directory)) == pictures
+                and a is a_again
+                and len(cache) == 1
+                and cache.stats()["hits"] == 1
+                and cache.stats()["evictions"] == 1
+            )
+
+    def test_small_pictures_are_decoded_once_and_upscaled_per_call(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "small.png")
+            Image.fromarray(np.random.randint(0, 256, (20, 30, 3)).astype(np.uint8)).save(path)
+            cache = PictureCache()
+            pic = cache.get(path, 60, 32)
+            taller = cache.get(path, 30, 50)
+            expected = Image.open(path).resize([60, 40], Image.ANTIALIAS)
+
+            self.assertTrue(
+                pic.size == (60, 40)
+                and pic.tobytes() == expected.tobytes()
+                and taller.size == (75, 50)
+                and cache.get(path, 10, 10).size == (30, 20)
+                and len(cache) == 1
+                and cache.stats()["bytes"] == 30 * 20 * 3
+                and cache.stats()["misses"] == 1
+            )
+
+
+class ComputerTextGenerator(unittest.TestCase):
+    def test_atlas_engine_matches_pil_engine(self):
+        images = []
+        for engine in ["pil", "atlas"]:
+            images.append(
+                computer_text_generator.generate(
+                    "Hello, World!", "tests/font.ttf", "tests/font.ttf",
+                    "#101010,#ff00ff", 32, 0, 1.0, 2, False, engine=engine,
+                    rng=np.random.default_rng(42),
+                )
+            )
+
+        (pil_img, pil_mask), (atlas_img, atlas_mask) = images
+        self.assertTrue(
+            pil_img.tobytes() == atlas_img.tobytes()
+            and pil_mask.tobytes() == atlas_mask.tobytes()
+        )
+
+    def test_vertical_mask_is_drawn_apart(self):
+        images = []
+        for engine, with_mask in [("pil", True), ("atlas", True), ("pil", False)]:
+            images.append(
+                computer_text_generator.generate(
+                    "Hello", "tests/font.ttf", "tests/font.ttf",
+                    "#101010,#ff20ff", 32, 1, 1.0, 2, False, engine=engine,
+                    with_mask=with_mask, rng=np.random.default_rng(42),
+                )
+            )
+
+        (pil_img, pil_mask), (atlas_img, atlas_mask), (no_mask_img, no_mask) = images
+        self.assertTrue(
+            pil_img.tobytes() == atlas_img.tobytes() == no_mask_img.tobytes()
+            and pil_mask.tobytes() == atlas_mask.tobytes()
+            and no_mask is None
+        )
+
+    def test_vertical_text_color_range_in_any_order(self):
+        images = [
+            computer_text_generator.generate(
+                "Hello", "tests/font.ttf", "tests/font.ttf",
+                "#ff20ff,#101010", 32, 1, 1.0, 2, False, engine=engine,
+                with_mask=False, rng=np.random.default_rng(7),
+            )[0]
+            for engine in ["pil", "atlas"]
+        ]
+
+        self.assertTrue(images[0].tobytes() == images[1].tobytes())
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            computer_text_generator.generate(
+                "TEST", "tests/font.ttf", "tests/font.ttf",
+                "#010101", 32, 0, 1.0, 0, False, engine="unknown",
+            )
+
+
+    def test_mask_is_skipped_when_disabled(self):
+        image = computer_text_generator.generate(
+            "TEST", "tests/font.ttf", "tests/font.ttf", "#010101", 32, 0, 1.0, 0, False,
+            with_mask=False,
+        )[1]
+        sample = FakeTextDataGenerator.generate(
+            0, "TEST", "tests/font.ttf", "tests/font.ttf", None, 32, "jpg", 0, False, 0, False,
+            1, 1, 0, False, 0, -1, 0, "#010101", 0, 1, 0, (5, 5, 5, 5), False, 0, 0, 0, 0, 0,
+            255, False, 0, (5, 5, 5, 5), 0, 0,
+        )
+        sample_with_mask = FakeTextDataGenerator.generate(
+            0, "TEST", "tests/font.ttf", "tests/font.ttf", None, 32, "jpg", 0, False, 0, False,
+            1, 1, 0, False, 0, -1, 0, "#010101", 0, 1, 0, (5, 5, 5, 5), False, 0, 0, 0, 0, 0,
+            255, False, 0, (5, 5, 5, 5), 0, 1,
+        )
+
+        self.assertTrue(
+            image is None
+            and sample.size == sample_with_mask[0].size == sample_with_mask[1].size
+            and sample.tobytes() == sample_with_mask[0].tobytes()
+        )
+
+
+class DistorsionGeneratorTest(unittest.TestCase):
+    def test_sine_distorsion_moves_every_column(self):
+        arr = np.random.randint(0, 256, (16, 40, 4)).astype(np.uint8)
+        image, mask = distorsion_generator.sin(
+            Image.fromarray(arr, "RGBA"), None, vertical=True
+        )
+        max_offset = 4
+        expected = np.zeros((16 + 2 * max_offset, 40, 4), dtype=np.uint8)
+        for i in range(40):
+            o = max_offset + int(math.sin(math.radians(i)) * max_offset)
+            expected[o : o + 16, i] = arr[:, i]
+
+        self.assertTrue(mask is None and np.array_equal(np.asarray(image), expected))
+
+    def test_random_distorsion_moves_mask_with_image(self):
+        arr = np.random.randint(1, 256, (30, 60, 4)).astype(np.uint8)
+        image, mask = distorsion_generator.random(
+            Image.fromarray(arr, "RGBA"),
+            Image.fromarray(arr[:, :, :3], "RGB"),
+            vertical=True,
+            horizontal=True,
+        )
+        image = np.asarray(image)
+
+        self.assertTrue(
+            image.shape[:2] == (30 + 2 * 3, 60 + 2 * 3)
+            and np.array_equal(image[:, :, :3], np.asarray(mask))
+        )
+
+
+class TextLayoutTest(unittest.TestCase):
+    def test_horizontal_offsets_are_prefix_sums(self):
+        text = "TEST TEST TEST" * 15
+        layout = layout_horizontal(text, "tests/font.ttf", "tests/font.ttf", 32, 1.0, 2)
+        metrics = get_font_metrics("tests/font.ttf", 32)
+        widths = [metrics.width(c) if c != " " else metrics.width(" ") for c in text]
+
+        self.assertTrue(
+            all(layout.offsets[i] == sum(widths[0:i]) + 2 * i for i in range(len(text)))
+            and layout.width == sum(widths) + 2 * (len(text) - 1)
+            and layout.height == max(metrics.height(c) for c in text)
+        )
+
+    def test_vertical_layout_height(self):
+        layout = layout_vertical("TEST", "tests/font.ttf", "tests/font.ttf", 32, 1.0, 1)
+        metrics = get_font_metrics("tests/font.ttf", 32)
+
+        self.assertTrue(
+            layout.height == sum(metrics.height(c) for c in "TEST") + 4
+            and layout.offsets[1] == metrics.height("T") + 1
+        )
+
+    def test_kerning_keeps_line_consistent(self):
+        layout = layout_horizontal("AVATAR", "tests/font.ttf", "tests/font.ttf", 32, 1.0, 0, kerning=True)
+
+        self.assertTrue(
+            all(
+                layout.offsets[i + 1] == layout.offsets[i] + layout.advances[i]
+                for i in range(len(layout.text) - 1)
+            )
+            and layout.width == layout.offsets[-1] + layout.advances[-1]
+        )
+
+    def test_non_ascii_latin_is_routed_to_covering_font(self):
+        fonts = route_text("Señor é", "tests/font.ttf", "trdg/fonts/latin/BEBAS___.ttf")
+
+        self.assertTrue(all(f == "tests/font.ttf" for f in fonts))
+
+    def test_reject_text_without_glyphs(self):
+        with self.assertRaises(MissingGlyphError):
+            layout_horizontal("TEST \u4e2d", "tests/font.ttf", "tests/font.ttf", 32, 1.0, 0)
+
+
+class FontIndexTest(unittest.TestCase):
+    def test_read_codepoints(self):
+        codepoints = read_codepoints("tests/font.ttf")
+
+        self.assertTrue(
+            all(ord(c) in codepoints for c in string.ascii_letters + string.digits)
+            and ord("\u4e2d") not in codepoints
+        )
+
+    def test_font_coverage(self):
+        coverage = get_font_coverage("tests/font.ttf")
+
+        self.assertTrue("A" in coverage and "\u00e9" in coverage and "\u4e2d" not in coverage)
+
+    def test_metrics_index_matches_getsize(self):
+        index_dir = tempfile.mkdtemp()
+        build_index(["tests/font.ttf"], [32], index_dir)
+        table = MetricsIndex(index_dir).get("tests/font.ttf", 32)
+        font = FontCache().get("tests/font.ttf", 32)
+
+        self.assertTrue(
+            table is not None
+            and all(table.getsize(c) == font.getsize(c) for c in string.printable[:94])
+            and table.getsize("\u4e2d") is None
+        )
+
+    def test_layout_reads_metrics_index(self):
+        index_dir = tempfile.mkdtemp()
+        build_index(["tests/font.ttf"], [32], index_dir)
+        expected = layout_horizontal("TEST TEST", "tests/font.ttf", "tests/font.ttf", 32, 1.0, 0)
+
+        load_metrics_index(index_dir)
+        clear_font_metrics()
+        try:
+            metrics = get_font_metrics("tests/font.ttf", 32)
+            layout = layout_horizontal("TEST TEST", "tests/font.ttf", "tests/font.ttf", 32, 1.0, 0)
+        finally:
+            load_metrics_index(None)
+            clear_font_metrics()
+
+        self.assertTrue(metrics._table is not None and layout == expected)
+
+
 class CommandLineInterface(unittest.TestCase):
     def test_output_dir(self):
         args = ["python3", "run.py", "-c", "1", "--output_dir", "../tests/out_2/"]
@@ -886,6 +1770,141 @@ class CommandLineInterface(unittest.TestCase):
         self.assertTrue(len(os.listdir("tests/out/")) == 1)
         empty_directory("tests/out/")
 
+    def test_chunksize_and_max_in_flight(self):
+        args = ["python3", "run.py", "-c", "10", "-cz", "3", "-mf", "3", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        self.assertTrue(len(os.listdir("tests/out/")) == 10)
+        empty_directory("tests/out/")
+
+    def test_index_output_layout(self):
+        args = ["python3", "run.py", "-c", "10", "-na", "2", "-ol", "index", "-fpd", "4", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        labels = read_labels("tests/out/")
+        self.assertTrue(
+            sorted(labels) == sorted("0/{}/{}.jpg".format(i // 4, i) for i in range(10))
+            and all(os.path.isfile(os.path.join("tests/out/", path)) for path in labels)
+        )
+        shutil.rmtree("tests/out/0")
+        empty_directory("tests/out/")
+
+    def test_tar_output_format(self):
+        args = ["python3", "run.py", "-c", "10", "-of", "tar", "-sps", "4", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        with ShardReader("tests/out/") as reader:
+            self.assertTrue(
+                len(reader.shards) == 3
+                and sorted(s["index"] for s in reader) == list(range(10))
+            )
+        empty_directory("tests/out/")
+
+    def test_resume(self):
+        args = ["python3", "run.py", "-c", "5", "-na", "2", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        first_run = os.path.getmtime("tests/out/0.jpg")
+        subprocess.Popen(args[:3] + ["10", "--resume"] + args[4:], cwd="trdg/").wait()
+        with open("tests/out/labels.txt", "r", encoding="utf8") as f:
+            labels = sorted(line.split(" ")[0] for line in f)
+        self.assertTrue(
+            labels == sorted("{}.jpg".format(i) for i in range(10))
+            and len(os.listdir("tests/out/")) == 11
+            and os.path.getmtime("tests/out/0.jpg") == first_run
+        )
+        empty_directory("tests/out/")
+
+    def test_resume_without_journal(self):
+        args = ["python3", "run.py", "-i", "../tests/test.txt", "-c", "4", "-ft", "../tests/font.ttf", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        os.remove("tests/out/TEST2_1.jpg")
+        first_run = os.path.getmtime("tests/out/TEST1_0.jpg")
+        subprocess.Popen(args[:5] + ["6", "--resume"] + args[6:], cwd="trdg/").wait()
+        names = sorted(os.listdir("tests/out/"))
+        self.assertTrue(
+            names == sorted("TEST{}_{}.jpg".format(i % 3 + 1, i) for i in range(6))
+            and os.path.getmtime("tests/out/TEST1_0.jpg") == first_run
+        )
+        empty_directory("tests/out/")
+
+    def test_seed_is_independent_of_thread_count(self):
+        outputs = []
+        for threads in ["1", "3"]:
+            args = ["python3", "run.py", "-c", "12", "-t", threads, "-sd", "3", "-k", "5", "-rk", "-d", "3", "-b", "0", "--output_dir", "../tests/out/"]
+            subprocess.Popen(args, cwd="trdg/").wait()
+            outputs.append({f: md5(os.path.join("tests/out/", f)) for f in os.listdir("tests/out/")})
+            empty_directory("tests/out/")
+        self.assertTrue(len(outputs[0]) == 12 and outputs[0] == outputs[1])
+
+    def test_shards_render_the_whole_run(self):
+        args = ["python3", "run.py", "-c", "10", "-sd", "3", "-na", "2", "-k", "5", "-rk", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args, cwd="trdg/").wait()
+        whole_run = {f: md5(os.path.join("tests/out/", f)) for f in os.listdir("tests/out/")}
+        labels = read_labels("tests/out/")
+        empty_directory("tests/out/")
+        for k in range(3):
+            subprocess.Popen(args + ["-ns", "3", "-si", str(k)], cwd="trdg/").wait()
+        shards = {f: md5(os.path.join("tests/out/", f)) for f in os.listdir("tests/out/")}
+        self.assertTrue(
+            len(whole_run) == 11
+            and {f: shards[f] for f in whole_run if f != "labels.txt"}
+            == {f: h for f, h in whole_run.items() if f != "labels.txt"}
+            and "labels-00002-of-00003.txt" in shards
+            and read_labels("tests/out/") == labels
+        )
+        empty_directory("tests/out/")
+
+    def test_tensor_output_format(self):
+        args = ["python3", "run.py", "-i", "../tests/lease_strings.txt", "-c", "9", "-sd", "3", "-k", "5", "-rk", "-b", "0", "-ft", "../tests/font.ttf", "--output_dir", "../tests/out/"]
+        subprocess.Popen(args + ["-e", "png", "-na", "2"], cwd="trdg/").wait()
+        files = {
+            i: np.asarray(Image.open("tests/out/{}.png".format(i)).convert("RGB"))
+            for i in range(9)
+            if os.path.exists("tests/out/{}.png".format(i))
+        }
+        empty_directory("tests/out/")
+        subprocess.Popen(args + ["-of", "tensor", "-tw", "300"], cwd="trdg/").wait()
+        dataset = TensorDataset("tests/out/")
+        images = {i: np.array(dataset[i][0]) for i in range(len(dataset)) if dataset.widths[i]}
+        labels = [dataset[i][1] for i in range(len(dataset))]
+        del dataset
+        empty_directory("tests/out/")
+        self.assertTrue(
+            sorted(images) == sorted(files) == [0, 1, 2, 4, 5, 6, 7, 8]
+            and all(np.array_equal(images[i], files[i]) for i in files)
+            and labels[:4] == ["alpha", "bravo", "charlie", "delta 中"]
+        )
+
+    def test_every_shard_lists_its_samples(self):
+        args = ["python3", "run.py", "-i", "../tests/test.txt", "-c", "6", "-sd", "3", "-ns", "2", "-ft", "../tests/font.ttf", "--output_dir", "../tests/out/"]
+        for k in range(2):
+            subprocess.Popen(args + ["-si", str(k)], cwd="trdg/").wait()
+        names = sorted(os.listdir("tests/out/"))
+        labels = read_labels("tests/out/", name_format=0)
+        empty_directory("tests/out/")
+        self.assertTrue(
+            "labels-00000-of-00002.txt" in names
+            and "labels-00001-of-00002.txt" in names
+            and labels == {"TEST{}_{}.jpg".format(i % 3 + 1, i): "TEST{}".format(i % 3 + 1) for i in range(6)}
+        )
+
+    def test_lease_dir_processes(self):
+        # Every seventh string has a character the font lacks
+        args = ["python3", "run.py", "-i", "../tests/lease_strings.txt", "-c", "30", "-sd", "3", "-na", "2", "-ls", "4", "-lt", "8", "-ld", "../tests/out/leases", "-ft", "../tests/font.ttf", "--output_dir", "../tests/out/"]
+        processes = [subprocess.Popen(args, cwd="trdg/") for _ in range(3)]
+        for process in processes:
+            process.wait()
+        lines = []
+        for name in os.listdir("tests/out/"):
+            if name.startswith("labels"):
+                with open(os.path.join("tests/out/", name), "r", encoding="utf8") as f:
+                    lines += f.read().splitlines()
+        rendered = sorted(int(line.split(".")[0]) for line in lines)
+        leases = sorted(os.listdir("tests/out/leases"))
+        shutil.rmtree("tests/out/leases")
+        empty_directory("tests/out/")
+        self.assertTrue(
+            rendered == [i for i in range(30) if i % 7 != 3]
+            and leases == ["{:09d}.done".format(chunk) for chunk in range(8)]
+        )
+
     def test_count_parameter(self):
         args = ["python3", "run.py", "-c", "10", "--output_dir", "../tests/out/"]
         subprocess.Popen(args, cwd="trdg/").wait()
@@ -1,22 +1,23 @@
-import cv2
 import math
 import os
-import random as rnd
 import numpy as np
 
+from functools import lru_cache
+
 from PIL import Image, ImageDraw, ImageFilter
 
+from trdg.picture_cache import get_picture_cache
+
 
-def gaussian_noise(height, width):
+def gaussian_noise(height, width, rng=None):
     """
         Create a background with Gaussian noise (to mimic paper)
     """
 
-    # We create an all white image
-    image = np.ones((height, width)) * 255
+    rng = np.random.default_rng(rng)
 
-    # We add gaussian noise
-    cv2.randn(image, 235, 10)
+    # We create a white image with gaussian noise
+    image = rng.normal(235, 10, (height, width))
 
     return Image.fromarray(image).convert("RGBA")
 
@@ -29,60 +30,76 @@ def plain_white(height, width):
     return Image.new("L", (width, height), 255).convert("RGBA")
 
 
-def quasicrystal(height, width):
+@lru_cache(maxsize=32)
+def _quasicrystal_grid(height, width):
+    """
+        Return the (x, y) coordinate grids of a quasicrystal background
+    """
+
+    x = np.arange(height, dtype=np.float64) / (height - 1) * 4 * math.pi - 2 * math.pi
+    y = np.arange(width, dtype=np.float64) / (width - 1) * 4 * math.pi - 2 * math.pi
+    x_grid, y_grid = np.meshgrid(x, y, indexing="ij")
+    x_grid.setflags(write=False)
+    y_grid.setflags(write=False)
+    return x_grid, y_grid
+
+
+def quasicrystal(height, width, rng=None):
     """
         Create a background with quasicrystal (https://en.wikipedia.org/wiki/Quasicrystal)
     """
 
-    image = Image.new("L", (width, height))
-    pixels = image.load()
+    rng = np.random.default_rng(rng)
+    frequency = rng.random() * 30 + 20  # frequency
+    phase = rng.random() * 2 * math.pi  # phase
+    rotation_count = int(rng.integers(10, 20, endpoint=True))  # of rotations
 
-    frequency = rnd.random() * 30 + 20  # frequency
-    phase = rnd.random() * 2 * math.pi  # phase
-    rotation_count = rnd.randint(10, 20)  # of rotations
+    # Every pixel sums cos(r * sin(a + rotation) * frequency + phase) with
+    # (r, a) the polar coordinates of (x, y), and r * sin(a + rotation) is
+    # y * cos(rotation) + x * sin(rotation)
+    x, y = _quasicrystal_grid(height, width)
+    z = np.zeros((height, width), dtype=np.float64)
+    for i in range(rotation_count):
+        rotation = i * math.pi * 2.0 / rotation_count
+        z += np.cos((y * math.cos(rotation) + x * math.sin(rotation)) * frequency + phase)
 
-    for kw in range(width):
-        y = float(kw) / (width - 1) * 4 * math.pi - 2 * math.pi
-        for kh in range(height):
-            x = float(kh) / (height - 1) * 4 * math.pi - 2 * math.pi
-            z = 0.0
-            for i in range(rotation_count):
-                r = math.hypot(x, y)
-                a = math.atan2(y, x) + i * math.pi * 2.0 / rotation_count
-                z += math.cos(r * math.sin(a) * frequency + phase)
-            c = int(255 - round(255 * z / rotation_count))
-            pixels[kw, kh] = c  # grayscale
-    return image.convert("RGBA")
+    c = np.clip(255 - np.round(255 * z / rotation_count), 0, 255)
+    return Image.fromarray(c.astype(np.uint8), "L").convert("RGBA")
 
 
-def picture(height, width):
+def pictures_directory():
     """
-        Create a background with a picture
+        Return the directory the picture backgrounds are taken from
     """
+
     script_path = os.path.realpath(os.getcwd())
-    pictures = os.listdir(os.path.join(script_path, "pictures"))
-    pictures = [i for i in pictures if not i.startswith(".")]
+    return os.path.join(script_path, "pictures")
 
-    if len(pictures) > 0:
-        pic = Image.open(os.path.join(script_path, "pictures", pictures[rnd.randint(0, len(pictures) - 1)]))
 
-        if pic.size[0] < width:
-            pic = pic.resize(
-                [width, int(pic.size[1] * (width / pic.size[0]))], Image.ANTIALIAS
-            )
-        if pic.size[1] < height:
-            pic = pic.resize(
-                [int(pic.size[0] * (height / pic.size[1])), height], Image.ANTIALIAS
-            )
+def picture(height, width, rng=None):
+    """
+        Create a background with a picture
+    """
+    rng = np.random.default_rng(rng)
+    directory = pictures_directory()
+    cache = get_picture_cache()
+    pictures = cache.listdir(directory)
+
+    if len(pictures) > 0:
+        pic = cache.get(
+            os.path.join(directory, pictures[rng.integers(len(pictures))]),
+            width,
+            height,
+        )
 
         if pic.size[0] == width:
             x = 0
         else:
-            x = rnd.randint(0, pic.size[0] - width)
+            x = int(rng.integers(0, pic.size[0] - width, endpoint=True))
         if pic.size[1] == height:
             y = 0
         else:
-            y = rnd.randint(0, pic.size[1] - height)
+            y = int(rng.integers(0, pic.size[1] - height, endpoint=True))
 
         return pic.crop((x, y, x + width, y + height))
     else:
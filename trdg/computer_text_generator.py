@@ -1,7 +1,11 @@
-import random as rnd
-
 from PIL import Image, ImageColor, ImageFont, ImageDraw, ImageFilter
 
+from trdg.font_cache import get_font
+from trdg.glyph_atlas import get_glyph_atlas, blend, stamp
+from trdg.text_layout import layout_horizontal, layout_vertical
+
+import numpy as np
+
 import string
 import re
 
@@ -19,171 +23,172 @@ WHITESPACE_UNICODE = r'[\u0020\u00A0\u1680\u2000\u2001\u2002\u2003\u2004\u2005\u
 CONTROL_UNICODE = r'[\u0000\u0001\u0002\u0003\u0004\u0005\u0006\u0007\u0008\u0009\u000A\u000B\u000C\u000D\u000E\u000F\u0010\u0011\u0012\u0013\u0014\u0015\u0016\u0017\u0018\u0019\u001A\u001B\u001C\u001D\u001E\u001F\u007F\u0080\u0081\u0082\u0083\u0084\u0085\u0086\u0087\u0088\u0089\u008A\u008B\u008C\u008D\u008E\u008F\u0090\u0091\u0092\u0093\u0094\u0095\u0096\u0097\u0098\u0099\u009A\u009B\u009C\u009D\u009E\u009F]'
 
 def generate(
-    text, font_en, font_ch, text_color, font_size, orientation, space_width, character_spacing, fit
+    text, font_en, font_ch, text_color, font_size, orientation, space_width, character_spacing, fit, engine="pil", kerning=False, with_mask=True, rng=None
 ):
+    """
+        Render text, returns (image, mask). The mask is None if with_mask is False.
+    """
 
     # normalize whitespace
     text = re.sub(WHITESPACE_UNICODE, ' ', text)
     # normalize control unicode (e.g. backspace)
     text = re.sub(CONTROL_UNICODE, '', text)
 
+    if engine == "pil":
+        horizontal, vertical = _generate_horizontal_text, _generate_vertical_text
+    elif engine == "atlas":
+        horizontal, vertical = _generate_horizontal_text_atlas, _generate_vertical_text_atlas
+    else:
+        raise ValueError("Unknown rendering engine " + str(engine))
+
     if orientation == 0:
-        return _generate_horizontal_text(
-            text, font_en, font_ch, text_color, font_size, space_width, character_spacing, fit
+        layout = layout_horizontal(
+            text, font_en, font_ch, font_size, space_width, character_spacing, kerning
         )
+        return horizontal(layout, text_color, font_size, fit, with_mask, rng)
     elif orientation == 1:
-        return _generate_vertical_text(
-            text, font_en, font_ch, text_color, font_size, space_width, character_spacing, fit
+        layout = layout_vertical(
+            text, font_en, font_ch, font_size, space_width, character_spacing
         )
+        return vertical(layout, text_color, font_size, fit, with_mask, rng)
     else:
         raise ValueError("Unknown orientation " + str(orientation))
 
 
-def _generate_horizontal_text(
-    text, font_en, font_ch, text_color, font_size, space_width, character_spacing, fit
-):
-    image_font_en = ImageFont.truetype(font=font_en, size=font_size)
-    image_font_ch = ImageFont.truetype(font=font_ch, size=font_size)
+def _generate_horizontal_text(layout, text_color, font_size, fit, with_mask=True, rng=None):
+    txt_img = Image.new("RGBA", (layout.width, layout.height), (0, 0, 0, 0))
+    txt_img_draw = ImageDraw.Draw(txt_img)
 
-    en_character = string.ascii_letters + string.digits + string.punctuation + " "
+    txt_mask = None
+    if with_mask:
+        txt_mask = Image.new("RGB", (layout.width, layout.height), (0, 0, 0))
+        txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
+        txt_mask_draw.fontmode = "1"
+
+    fill = _random_fill(text_color, rng)
+
+    for i, c in enumerate(layout.text):
+        image_font = get_font(layout.fonts[i], font_size)
+        txt_img_draw.text(
+            (layout.offsets[i], 0),
+            c,
+            fill=fill,
+            font=image_font,
+        )
+        if txt_mask is None:
+            continue
+        txt_mask_draw.text(
+            (layout.offsets[i], 0),
+            c,
+            fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
+            font=image_font,
+        )
 
-    space_width_en = int(image_font_en.getsize(" ")[0] * space_width)
-    # space_width_ch = int(image_font_ch.getsize(" ")[0] * space_width)
+    return _fit(txt_img, txt_mask, fit)
 
-    char_widths = []
-    for c in text:
-        if c.strip() != "":
-            if c in en_character:
-                char_widths.append(image_font_en.getsize(c)[0])
-            else:
-                char_widths.append(image_font_ch.getsize(c)[0])
-        else:
-            char_widths.append(space_width_en)
 
-    text_width = sum(char_widths) + character_spacing * (len(text) - 1)
-    text_height = max([image_font_en.getsize(c)[1] for c in text] + [image_font_ch.getsize(c)[1] for c in text])
+def _generate_vertical_text(layout, text_color, font_size, fit, with_mask=True, rng=None):
+    txt_img = Image.new("RGBA", (layout.width, layout.height), (0, 0, 0, 0))
+    txt_img_draw = ImageDraw.Draw(txt_img)
 
-    txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGB", (text_width, text_height), (0, 0, 0))
+    txt_mask = None
+    if with_mask:
+        txt_mask = Image.new("RGB", (layout.width, layout.height), (0, 0, 0))
+        txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
+        txt_mask_draw.fontmode = "1"
+
+    fill = _random_fill(text_color, rng)
+
+    for i, c in enumerate(layout.text):
+        image_font = get_font(layout.fonts[i], font_size)
+        txt_img_draw.text(
+            (0, layout.offsets[i]),
+            c,
+            fill=fill,
+            font=image_font,
+        )
+        if txt_mask is None:
+            continue
+        txt_mask_draw.text(
+            (0, layout.offsets[i]),
+            c,
+            fill=_mask_color(i),
+            font=image_font,
+        )
+
+    return _fit(txt_img, txt_mask, fit)
 
-    txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_mask, mode="RGB")
-    txt_mask_draw.fontmode = "1"
 
+def _random_fill(text_color, rng=None):
     colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
     c1, c2 = colors[0], colors[-1]
 
-    fill = (
-        rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-        rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-        rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
+    rng = np.random.default_rng(rng)
+    return tuple(
+        int(rng.integers(min(c1[k], c2[k]), max(c1[k], c2[k]), endpoint=True))
+        for k in range(3)
     )
 
-    for i, c in enumerate(text):
-        if c in en_character:
-            txt_img_draw.text(
-                (sum(char_widths[0:i]) + i * character_spacing, 0),
-                c,
-                fill=fill,
-                font=image_font_en,
-            )
-            txt_mask_draw.text(
-                (sum(char_widths[0:i]) + i * character_spacing, 0),
-                c,
-                fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-                font=image_font_en,
-            )
-        else:
-            txt_img_draw.text(
-                (sum(char_widths[0:i]) + i * character_spacing, 0),
-                c,
-                fill=fill,
-                font=image_font_ch,
-            )
-            txt_mask_draw.text(
-                (sum(char_widths[0:i]) + i * character_spacing, 0),
-                c,
-                fill=((i + 1) // (255 * 255), (i + 1) // 255, (i + 1) % 255),
-                font=image_font_ch,
-            )
 
+def _mask_color(i):
+    return (
+        min(i // (255 * 255), 255),
+        min(i // 255, 255),
+        i % 255,
+    )
+
+
+def _fit(txt_img, txt_mask, fit):
     if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox())
+        bbox = txt_img.getbbox()
+        return txt_img.crop(bbox), txt_mask.crop(bbox) if txt_mask is not None else None
     else:
         return txt_img, txt_mask
 
 
-def _generate_vertical_text(
-    text, font_en, font_ch, text_color, font_size, space_width, character_spacing, fit
-):
-    image_font_en = ImageFont.truetype(font=font_en, size=font_size)
-    image_font_ch = ImageFont.truetype(font=font_ch, size=font_size)
+def _generate_horizontal_text_atlas(layout, text_color, font_size, fit, with_mask=True, rng=None):
+    """
+        Same output as _generate_horizontal_text, but every glyph is
+        rasterized once per process and blitted from the glyph atlas
+    """
 
-    en_character = string.ascii_letters + string.digits + string.punctuation + " "
+    atlas = get_glyph_atlas()
 
-    space_height_en = int(image_font_en.getsize(" ")[1] * space_width)
+    txt_arr = np.zeros((layout.height, layout.width, 4), dtype=np.uint8)
+    mask_arr = np.zeros((layout.height, layout.width, 3), dtype=np.uint8) if with_mask else None
 
-    char_heights = []
-    for c in text:
-        if c.strip() != "":
-            if c in en_character:
-                char_heights.append(image_font_en.getsize(c)[1])
-            else:
-                char_heights.append(image_font_ch.getsize(c)[1])
-        else:
-            char_heights.append(space_height_en)
+    ink = _random_fill(text_color, rng) + (255,)
 
-    text_width = max([image_font_en.getsize(c)[0] for c in text] + [image_font_ch.getsize(c)[0] for c in text])
+    for i, c in enumerate(layout.text):
+        g = atlas.get(layout.fonts[i], font_size, c)
+        x = layout.offsets[i]
+        blend(txt_arr, g.coverage, x + g.offset[0], g.offset[1], ink)
+        if mask_arr is not None:
+            stamp(mask_arr, g.mono, x + g.mono_offset[0], g.mono_offset[1], _mask_color(i + 1))
 
-    text_height = sum(char_heights) + character_spacing * len(text)
+    txt_mask = Image.fromarray(mask_arr, "RGB") if mask_arr is not None else None
+    return _fit(Image.fromarray(txt_arr, "RGBA"), txt_mask, fit)
 
-    txt_img = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
-    txt_mask = Image.new("RGBA", (text_width, text_height), (0, 0, 0, 0))
 
-    txt_img_draw = ImageDraw.Draw(txt_img)
-    txt_mask_draw = ImageDraw.Draw(txt_img)
+def _generate_vertical_text_atlas(layout, text_color, font_size, fit, with_mask=True, rng=None):
+    """
+        Same output as _generate_vertical_text, but every glyph is
+        rasterized once per process and blitted from the glyph atlas
+    """
 
-    colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-    c1, c2 = colors[0], colors[-1]
-
-    fill = (
-        rnd.randint(c1[0], c2[0]),
-        rnd.randint(c1[1], c2[1]),
-        rnd.randint(c1[2], c2[2]),
-    )
-
-    for i, c in enumerate(text):
-        if c in en_character:
-            txt_img_draw.text(
-                (0, sum(char_heights[0:i]) + i * character_spacing),
-                c,
-                fill=fill,
-                font=image_font_en,
-            )
-            txt_mask_draw.text(
-                (0, sum(char_heights[0:i]) + i * character_spacing),
-                c,
-                fill=(i // (255 * 255), i // 255, i % 255),
-                font=image_font_en,
-            )
-        else:
-            txt_img_draw.text(
-                (0, sum(char_heights[0:i]) + i * character_spacing),
-                c,
-                fill=fill,
-                font=image_font_ch,
-            )
-            txt_mask_draw.text(
-                (0, sum(char_heights[0:i]) + i * character_spacing),
-                c,
-                fill=(i // (255 * 255), i // 255, i % 255),
-                font=image_font_ch,
-            )
+    atlas = get_glyph_atlas()
 
+    txt_arr = np.zeros((layout.height, layout.width, 4), dtype=np.uint8)
+    mask_arr = np.zeros((layout.height, layout.width, 3), dtype=np.uint8) if with_mask else None
 
-    if fit:
-        return txt_img.crop(txt_img.getbbox()), txt_mask.crop(txt_img.getbbox())
-    else:
-        return txt_img, txt_mask
+    ink = _random_fill(text_color, rng) + (255,)
 
+    for i, c in enumerate(layout.text):
+        g = atlas.get(layout.fonts[i], font_size, c)
+        y = layout.offsets[i]
+        blend(txt_arr, g.coverage, g.offset[0], y + g.offset[1], ink)
+        if mask_arr is not None:
+            stamp(mask_arr, g.mono, g.mono_offset[0], y + g.mono_offset[1], _mask_color(i))
 
+    txt_mask = Image.fromarray(mask_arr, "RGB") if mask_arr is not None else None
+    return _fit(Image.fromarray(txt_arr, "RGBA"), txt_mask, fit)
@@ -1,10 +1,19 @@
 import os
-import random as rnd
 
 from PIL import Image, ImageFilter, ImageOps
 
-from trdg import computer_text_generator, background_generator, distorsion_generator
+from trdg import (
+    computer_text_generator,
+    background_generator,
+    distorsion_generator,
+    output_layout,
+)
 from trdg.downstream_augment import DownstreamAugment
+from trdg.image_encoder import DEFAULT_ENCODER
+from trdg.sample_writer import completed_writes, get_sample_writer, pending_writes
+from trdg.tar_shards import sample_files
+from trdg.tensor_output import get_tensor_writer
+from trdg.text_layout import MissingGlyphError
 import numpy as np
 
 try:
@@ -13,14 +22,122 @@ except ImportError as e:
     print("Missing modules for handwritten text generation.")
 
 
+_generation_config = None
+
+
+def set_generation_config(config):
+    """
+        Set the GenerationConfig used by generate_from_task in this process
+        (usable from a Pool initializer)
+    """
+
+    global _generation_config
+    _generation_config = config
+
+
+def _save_sample(index, saves, encoder):
+    for image, path in saves:
+        encoder.save(image, path)
+    return index
+
+
+def sample_rng(seed, index):
+    """
+        Return the random generator of sample index of a run seeded with
+        seed: it only depends on both, not on which worker renders the
+        sample or in which order
+    """
+
+    return np.random.default_rng(np.random.SeedSequence([seed, index]))
+
+
 class FakeTextDataGenerator(object):
     @classmethod
     def generate_from_tuple(cls, t):
         """
-            Same as generate, but takes all parameters as one tuple
+            Same as generate, but takes all parameters as one tuple.
+            Samples with characters none of their fonts can draw are skipped.
+        """
+
+        try:
+            cls.generate(*t)
+        except MissingGlyphError as e:
+            print("Skipping sample {}: {}".format(t[0], e))
+
+    @classmethod
+    def generate_from_config(cls, index, text, font_en, font_ch, config, seed=None):
+        """
+            Same as generate, with the sample independent parameters taken
+            from a GenerationConfig. If seed (the seed of a run) is given, the
+            random draws of the sample come from sample_rng(seed, index), so
+            that it can be reproduced on its own.
+        """
+
+        rng = None if seed is None else sample_rng(seed, index)
+        return cls.generate(index, text, font_en, font_ch, *config, rng=rng)
+
+    @classmethod
+    def generate_from_task(cls, task):
+        """
+            Same as generate_from_tuple for an (index, text, font, seed) task,
+            rendered with the GenerationConfig of set_generation_config.
+            Returns the (process id, samples waiting to be written, indices
+            of the samples written since the last call, indices of the
+            samples skipped) of the worker, see sample_writer.
+        """
+
+        index, text, font, seed = task
+        written = []
+        skipped = []
+        try:
+            cls.generate_from_config(index, text, font, font, _generation_config, seed)
+            written.append(index)
+        except MissingGlyphError as e:
+            print("Skipping sample {}: {}".format(index, e))
+            skipped.append(index)
+        if get_sample_writer() is not None:
+            written = completed_writes()
+        return os.getpid(), pending_writes(), written, skipped
+
+    @classmethod
+    def encode_from_task(cls, task):
+        """
+            Same as generate_from_task, but the sample is encoded to its tar
+            shard members (see tar_shards.sample_files) instead of written.
+            Returns (index, files), files being None if it was skipped.
         """
 
-        cls.generate(*t)
+        index, text, font, seed = task
+        config = _generation_config
+        try:
+            image = cls.generate_from_config(index, text, font, font, config, seed)
+        except MissingGlyphError as e:
+            print("Skipping sample {}: {}".format(index, e))
+            return index, None
+        mask = None
+        if isinstance(image, tuple):
+            image, mask = image
+        metadata = {"font": font, "seed": seed}
+        return index, sample_files(
+            index, text, image, mask, config.extension, metadata, config.encoder
+        )
+
+    @classmethod
+    def tensor_from_task(cls, task):
+        """
+            Same as generate_from_task, but the image is written in place in
+            its row of the arrays of tensor_output.set_tensor_output.
+            Returns the (index, width) of the sample, width being 0 if it
+            was skipped.
+        """
+
+        index, text, font, seed = task
+        try:
+            image = cls.generate_from_config(index, text, font, font, _generation_config, seed)
+        except MissingGlyphError as e:
+            print("Skipping sample {}: {}".format(index, e))
+            return index, 0
+        return index, get_tensor_writer().write(index, image)
 
     @classmethod
     def generate(
@@ -60,25 +177,41 @@ class FakeTextDataGenerator(object):
         border,
         fit,
         output_mask,
+        engine="pil",
+        layout="flat",
+        files_per_dir=output_layout.DEFAULT_FILES_PER_DIR,
+        encoder=None,
+        kerning=False,
+        rng=None,
     ):
+        # Every random draw of the sample comes from rng
+        rng = np.random.default_rng(rng)
+
         image = None
         margin_top, margin_left, margin_bottom, margin_right = margins
         if random_margins:
-            margin_top = rnd.randint(0, margin_top)
-            margin_left = rnd.randint(0, margin_left)
-            margin_bottom = rnd.randint(0, margin_bottom)
-            margin_right = rnd.randint(0, margin_right)
+            margin_top = int(rng.integers(0, margin_top, endpoint=True))
+            margin_left = int(rng.integers(0, margin_left, endpoint=True))
+            margin_bottom = int(rng.integers(0, margin_bottom, endpoint=True))
+            margin_right = int(rng.integers(0, margin_right, endpoint=True))
 
         horizontal_margin = margin_left + margin_right
         vertical_margin = margin_top + margin_bottom
 
+        # The mask goes through every step the image does, only pay for it
+        # when it is actually written or returned
+        with_mask = output_mask == 1
+
         ##########################
         # Create picture of text #
         ##########################
+        mask = None
         if is_handwritten:
             if orientation == 1:
                 raise ValueError("Vertical handwritten text is unavailable")
-            image = handwritten_text_generator.generate(text, text_color)
+            image = handwritten_text_generator.generate(text, text_color, rng=rng)
+            if with_mask:
+                mask = Image.new("RGB", image.size, (0, 0, 0))
         else:
             image, mask = computer_text_generator.generate(
                 text,
@@ -90,16 +223,22 @@ class FakeTextDataGenerator(object):
                 space_width,
                 character_spacing,
                 fit,
+                engine,
+                kerning,
+                with_mask=with_mask,
+                rng=rng,
             )
-        random_angle = rnd.randint(0 - skewing_angle, skewing_angle)
+        random_angle = int(rng.integers(0 - skewing_angle, skewing_angle, endpoint=True))
 
         rotated_img = image.rotate(
             skewing_angle if not random_skew else random_angle, expand=1
         )
 
-        rotated_mask = mask.rotate(
-            skewing_angle if not random_skew else random_angle, expand=1
-        )
+        rotated_mask = None
+        if with_mask:
+            rotated_mask = mask.rotate(
+                skewing_angle if not random_skew else random_angle, expand=1
+            )
 
         #############################
         # Apply distorsion to image #
@@ -127,12 +266,15 @@ class FakeTextDataGenerator(object):
                 rotated_mask,
                 vertical=(distorsion_orientation == 0 or distorsion_orientation == 2),
                 horizontal=(distorsion_orientation == 1 or distorsion_orientation == 2),
+                rng=rng,
             )
 
         ##################################
         # Resize image to desired format #
         ##################################
 
+        resized_mask = None
+
         # Horizontal text
         if orientation == 0:
             new_width = int(
@@ -142,7 +284,8 @@ class FakeTextDataGenerator(object):
             resized_img = distorted_img.resize(
                 (new_width, size - vertical_margin), Image.ANTIALIAS
             )
-            resized_mask = distorted_mask.resize((new_width, size - vertical_margin))
+            if with_mask:
+                resized_mask = distorted_mask.resize((new_width, size - vertical_margin))
             background_width = width if width > 0 else new_width + horizontal_margin
             background_height = size
         # Vertical text
@@ -154,9 +297,10 @@ class FakeTextDataGenerator(object):
             resized_img = distorted_img.resize(
                 (size - horizontal_margin, new_height), Image.ANTIALIAS
             )
-            resized_mask = distorted_mask.resize(
-                (size - horizontal_margin, new_height), Image.ANTIALIAS
-            )
+            if with_mask:
+                resized_mask = distorted_mask.resize(
+                    (size - horizontal_margin, new_height), Image.ANTIALIAS
+                )
             background_width = size
             background_height = new_height + vertical_margin
         else:
@@ -167,7 +311,7 @@ class FakeTextDataGenerator(object):
         #############################
         if background_type == 0:
             background_img = background_generator.gaussian_noise(
-                background_height, background_width
+                background_height, background_width, rng
             )
         elif background_type == 1:
             background_img = background_generator.plain_white(
@@ -175,13 +319,15 @@ class FakeTextDataGenerator(object):
             )
         elif background_type == 2:
             background_img = background_generator.quasicrystal(
-                background_height, background_width
+                background_height, background_width, rng
             )
         else:
             background_img = background_generator.picture(
-                background_height, background_width
+                background_height, background_width, rng
             )
-        background_mask = Image.new("RGB", (background_width, background_height), (0, 0, 0))
+        background_mask = None
+        if with_mask:
+            background_mask = Image.new("RGB", (background_width, background_height), (0, 0, 0))
 
         #############################
         # Place text with alignment #
@@ -190,49 +336,33 @@ class FakeTextDataGenerator(object):
         new_text_width, _ = resized_img.size
 
         if alignment == 0 or width == -1:
-            background_img.paste(resized_img, (margin_left, margin_top), resized_img)
-            background_mask.paste(resized_mask, (margin_left, margin_top))
+            text_position = (margin_left, margin_top)
         elif alignment == 1:
-            background_img.paste(
-                resized_img,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (int(background_width / 2 - new_text_width / 2), margin_top),
-            )
+            text_position = (int(background_width / 2 - new_text_width / 2), margin_top)
         else:
-            background_img.paste(
-                resized_img,
-                (background_width - new_text_width - margin_right, margin_top),
-                resized_img,
-            )
-            background_mask.paste(
-                resized_mask,
-                (background_width - new_text_width - margin_right, margin_top),
-            )
+            text_position = (background_width - new_text_width - margin_right, margin_top)
+
+        background_img.paste(resized_img, text_position, resized_img)
+        if with_mask:
+            background_mask.paste(resized_mask, text_position)
 
         ##################################
         # Apply gaussian blur #
         ##################################
 
         gaussian_filter = ImageFilter.GaussianBlur(
-            radius=blur if not random_blur else rnd.randint(0, blur)
+            radius=blur if not random_blur else int(rng.integers(0, blur, endpoint=True))
         )
         final_image = background_img.filter(gaussian_filter)
-        final_mask = background_mask.filter(gaussian_filter)
+        final_mask = background_mask.filter(gaussian_filter) if with_mask else None
 
         ##################################
         # Apply random_erosion #
         ##################################
-        colormode_image = final_image.mode
-        colormode_mask = final_mask.mode
-        final_image = np.array(final_image)
-        final_mask = np.array(final_mask)
-
-        im = DownstreamAugment(final_image, colormode_image)
-        mask = DownstreamAugment(final_mask, colormode_mask)
+        im = DownstreamAugment(np.array(final_image), final_image.mode, rng)
+        mask = None
+        if with_mask:
+            mask = DownstreamAugment(np.array(final_mask), final_mask.mode, rng)
 
         ##################################
         # Apply random_erosion #
@@ -240,71 +370,75 @@ class FakeTextDataGenerator(object):
         im.random_erosion(erosion_kernel_size, 
                           erosion_iteration, 
                           erosion_cap)
-        mask.random_erosion(erosion_kernel_size, 
-                            erosion_iteration, 
-                            erosion_cap)
+        if with_mask:
+            mask.random_erosion(erosion_kernel_size, 
+                                erosion_iteration, 
+                                erosion_cap)
 
         ##################################
         # Apply Cutout #
         ##################################
         im.cutout(n_holes_pct, hole_size_pct)
-        mask.cutout(n_holes_pct, hole_size_pct)
+        if with_mask:
+            mask.cutout(n_holes_pct, hole_size_pct)
                 
         ##################################
         # Apply Inverted#
         ##################################
         if invert:
             im.invert()
-            mask.invert()
+            if with_mask:
+                mask.invert()
 
         ##################################
         # Apply transparentify#
         ##################################
         if alpha_low != 255:
             im.transparentify(alpha_low)
-            mask.transparentify(alpha_low)
+            if with_mask:
+                mask.transparentify(alpha_low)
 
         ##################################
         # Turning into PIL Image#
         ##################################
         final_image = Image.fromarray(im.get_img(), mode=im.get_colormode())
-        final_mask = Image.fromarray(mask.get_img(), mode=mask.get_colormode())
+        if with_mask:
+            final_mask = Image.fromarray(mask.get_img(), mode=mask.get_colormode())
 
         ##################################
         # Add Border#
         ##################################
-        if np.random.random() <= border_prob:
-            border_size = (np.random.randint(1, border[0]) if border[0] > 0 else 0, 
-                           np.random.randint(1, border[1]) if border[1] > 0 else 0, 
-                           np.random.randint(1, border[2]) if border[2] > 0 else 0, 
-                           np.random.randint(1, border[3]) if border[3] > 0 else 0)
+        if rng.random() <= border_prob:
+            border_size = (int(rng.integers(1, border[0])) if border[0] > 0 else 0, 
+                           int(rng.integers(1, border[1])) if border[1] > 0 else 0, 
+                           int(rng.integers(1, border[2])) if border[2] > 0 else 0, 
+                           int(rng.integers(1, border[3])) if border[3] > 0 else 0)
 
             final_image = ImageOps.expand(final_image, border=border_size)
-            final_mask = ImageOps.expand(final_mask, border=border_size)
+            if with_mask:
+                final_mask = ImageOps.expand(final_mask, border=border_size)
         
         #####################################
         # Generate name for resulting image #
         #####################################
-        if name_format == 0:
-            image_name = "{}_{}.{}".format(text, str(index), extension)
-            mask_name = "{}_{}_mask.png".format(text, str(index))
-        elif name_format == 1:
-            image_name = "{}_{}.{}".format(str(index), text, extension)
-            mask_name = "{}_{}_mask.png".format(str(index), text)
-        elif name_format == 2:
-            image_name = "{}.{}".format(str(index), extension)
-            mask_name = "{}_mask.png".format(str(index))
-        else:
-            print("{} is not a valid name format. Using default.".format(name_format))
-            image_name = "{}_{}.{}".format(text, str(index), extension)
-            mask_name = "{}_{}_mask.png".format(text, str(index))
+        image_name, mask_name = output_layout.sample_names(index, text, extension, name_format)
 
         # Save the image
         if out_dir is not None:
-            final_image.convert("RGBA").save(os.path.join(out_dir, image_name))
-            if output_mask == 1:
-                final_mask.convert("RGBA").save(os.path.join(out_dir, mask_name))
+            sample_dir = output_layout.make_sample_dir(
+                out_dir, output_layout.sample_dir(index, image_name, layout, files_per_dir)
+            )
+            # The image last, its file tells that the sample is written
+            saves = [(final_image, os.path.join(sample_dir, image_name))]
+            if with_mask:
+                saves.insert(0, (final_mask, os.path.join(sample_dir, mask_name)))
+            encoder = encoder or DEFAULT_ENCODER
+            writer = get_sample_writer()
+            if writer is None:
+                _save_sample(index, saves, encoder)
+            else:
+                writer.submit(_save_sample, index, saves, encoder)
         else:
-            if output_mask == 1:
+            if with_mask:
                 return final_image.convert("RGBA"), final_mask.convert("RGBA")
             return final_image.convert("RGBA")
@@ -1,100 +1,123 @@
 import cv2
 import math
 import os
-import random as rnd
 import numpy as np
 
+from functools import lru_cache
+
 from PIL import Image, ImageDraw, ImageFilter
 
 
-def _apply_func_distorsion(image, mask, vertical, horizontal, max_offset, func):
+@lru_cache(maxsize=256)
+def _offset_table(func, length, max_offset):
     """
-        Apply a distorsion to an image
+        Return the read-only offsets int(func(radians(i)) * max_offset) of
+        i in [0, length), func being math.sin or math.cos
     """
 
-    # Nothing to do!
-    if not vertical and not horizontal:
-        return image, mask
+    table = np.array(
+        [int(func(math.radians(i)) * max_offset) for i in range(length)], dtype=np.intp
+    )
+    table.setflags(write=False)
+    return table
 
-    # FIXME: From looking at the code I think both are already RGBA
-    rgb_image = image.convert("RGBA")
-    rgb_mask = image.convert("RGB")
-
-    img_arr = np.array(rgb_image)
-    mask_arr = np.array(mask)
-
-    vertical_offsets = [func(i) for i in range(img_arr.shape[1])]
-    horizontal_offsets = [
-        func(i)
-        for i in range(
-            img_arr.shape[0]
-            + (
-                (max(vertical_offsets) - min(min(vertical_offsets), 0))
-                if vertical
-                else 0
-            )
-        )
-    ]
 
-    new_img_arr = np.zeros(
-        (
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            4,
+def _distorsion_map(height, width, max_offset, vertical, horizontal, offsets):
+    """
+        Return the (x, y) source of every pixel of a distorted image, as a
+        cv2.remap int16 map. Pixels with no source point to (-1, -1).
+
+        offsets(length) returns the offset vector of length columns or rows.
+        Every column is moved down by max_offset + its vertical offset, then
+        the rows are moved right by max_offset + their horizontal offset.
+    """
+
+    out_height = height + (2 * max_offset if vertical else 0)
+    out_width = width + (2 * max_offset if horizontal else 0)
+    rows = np.arange(out_height)[:, None]
+    cols = np.arange(out_width)[None, :]
+
+    vertical_offsets = offsets(width) if vertical else None
+
+    if horizontal:
+        # Only the original height plus the extent of the vertical offsets
+        # gets shifted, the rows past it stay empty
+        row_count = height + (
+            (vertical_offsets.max() - min(vertical_offsets.min(), 0)) if vertical else 0
         )
+        shifts = np.full(out_height, out_width, dtype=np.intp)
+        shifts[:row_count] = max_offset + offsets(row_count)
+        src_cols = cols - shifts[:, None]
+    else:
+        src_cols = np.repeat(cols, out_height, axis=0)
+    invalid = (src_cols < 0) | (src_cols >= width)
+
+    if vertical:
+        src_rows = rows - max_offset - vertical_offsets[np.clip(src_cols, 0, width - 1)]
+    else:
+        src_rows = np.repeat(rows, out_width, axis=1)
+    invalid |= (src_rows < 0) | (src_rows >= height)
+
+    src_cols[invalid] = -1
+    src_rows[invalid] = -1
+    return np.dstack([src_cols, src_rows]).astype(np.int16)
+
+
+@lru_cache(maxsize=64)
+def _periodic_distorsion_map(func, height, width, max_offset, vertical, horizontal):
+    """
+        Return the (cached) _distorsion_map of a sin or cos distorsion
+    """
+
+    distorsion_map = _distorsion_map(
+        height,
+        width,
+        max_offset,
+        vertical,
+        horizontal,
+        lambda length: _offset_table(func, length, max_offset),
     )
+    distorsion_map.setflags(write=False)
+    return distorsion_map
 
-    new_img_arr_copy = np.copy(new_img_arr)
 
-    new_mask_arr = np.zeros(
-        (
-            # I keep img_arr to maximise the chance of
-            # a breakage if img and mask don't match
-            img_arr.shape[0] + (2 * max_offset if vertical else 0),
-            img_arr.shape[1] + (2 * max_offset if horizontal else 0),
-            3,
+def _apply_map_distorsion(image, mask, distorsion_map):
+    """
+        Apply a distorsion map to an image and its mask (which can be None)
+    """
+
+    def remap(arr):
+        return cv2.remap(
+            arr,
+            distorsion_map,
+            None,
+            cv2.INTER_NEAREST,
+            borderMode=cv2.BORDER_CONSTANT,
+            borderValue=0,
         )
+
+    return (
+        Image.fromarray(remap(np.asarray(image.convert("RGBA"))), "RGBA"),
+        Image.fromarray(remap(np.asarray(mask.convert("RGB"))), "RGB")
+        if mask is not None
+        else None,
     )
 
-    new_mask_arr_copy = np.copy(new_mask_arr)
 
-    if vertical:
-        column_height = img_arr.shape[0]
-        for i, o in enumerate(vertical_offsets):
-            column_pos = (i + max_offset) if horizontal else i
-            new_img_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = img_arr[:, i, :]
-            new_mask_arr[
-                max_offset + o : column_height + max_offset + o, column_pos, :
-            ] = mask_arr[:, i, :]
+def _apply_periodic_distorsion(image, mask, vertical, horizontal, func):
+    """
+        Apply a sin or cos distorsion to an image and its mask (which can be None)
+    """
 
-    if horizontal:
-        row_width = img_arr.shape[1]
-        for i, o in enumerate(horizontal_offsets):
-            if vertical:
-                new_img_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_img_arr[i, max_offset : row_width + max_offset, :]
-                new_mask_arr_copy[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = new_mask_arr[i, max_offset : row_width + max_offset, :]
-            else:
-                new_img_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = img_arr[i, :, :]
-                new_mask_arr[
-                    i, max_offset + o : row_width + max_offset + o, :
-                ] = mask_arr[i, :, :]
+    # Nothing to do!
+    if not vertical and not horizontal:
+        return image, mask
 
-    return (
-        Image.fromarray(
-            np.uint8(new_img_arr_copy if horizontal and vertical else new_img_arr)
-        ).convert("RGBA"),
-        Image.fromarray(
-            np.uint8(new_mask_arr_copy if horizontal and vertical else new_mask_arr)
-        ).convert("RGB")
+    max_offset = int(image.height ** 0.5)
+    distorsion_map = _periodic_distorsion_map(
+        func, image.height, image.width, max_offset, bool(vertical), bool(horizontal)
     )
+    return _apply_map_distorsion(image, mask, distorsion_map)
 
 
 def sin(image, mask, vertical=False, horizontal=False):
@@ -102,16 +125,7 @@ def sin(image, mask, vertical=False, horizontal=False):
         Apply a sine distorsion on one or both of the specified axis
     """
 
-    max_offset = int(image.height ** 0.5)
-
-    return _apply_func_distorsion(
-        image,
-        mask,
-        vertical,
-        horizontal,
-        max_offset,
-        (lambda x: int(math.sin(math.radians(x)) * max_offset)),
-    )
+    return _apply_periodic_distorsion(image, mask, vertical, horizontal, math.sin)
 
 
 def cos(image, mask, vertical=False, horizontal=False):
@@ -119,25 +133,26 @@ def cos(image, mask, vertical=False, horizontal=False):
         Apply a cosine distorsion on one or both of the specified axis
     """
 
-    max_offset = int(image.height ** 0.5)
-
-    return _apply_func_distorsion(
-        image,
-        mask,
-        vertical,
-        horizontal,
-        max_offset,
-        (lambda x: int(math.cos(math.radians(x)) * max_offset)),
-    )
+    return _apply_periodic_distorsion(image, mask, vertical, horizontal, math.cos)
 
 
-def random(image, mask, vertical=False, horizontal=False):
+def random(image, mask, vertical=False, horizontal=False, rng=None):
     """
         Apply a random distorsion on one or both of the specified axis
     """
 
-    max_offset = int(image.height ** 0.4)
+    # Nothing to do!
+    if not vertical and not horizontal:
+        return image, mask
 
-    return _apply_func_distorsion(
-        image, mask, vertical, horizontal, max_offset, (lambda x: rnd.randint(0, max_offset))
+    rng = np.random.default_rng(rng)
+    max_offset = int(image.height ** 0.4)
+    distorsion_map = _distorsion_map(
+        image.height,
+        image.width,
+        max_offset,
+        vertical,
+        horizontal,
+        lambda length: rng.integers(0, max_offset + 1, length),
     )
+    return _apply_map_distorsion(image, mask, distorsion_map)
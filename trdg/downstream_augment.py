@@ -4,10 +4,11 @@ import cv2
 
 class DownstreamAugment:
 
-    def __init__(self, img: np.ndarray, colormode: str):
+    def __init__(self, img: np.ndarray, colormode: str, rng=None):
         DownstreamAugment._color_channel_validate(img, colormode)
         self.img = img
         self.colormode = colormode
+        self.rng = np.random.default_rng(rng)
 
     @property
     def img(self):
@@ -58,10 +59,10 @@ class DownstreamAugment:
             img_eroded = img.copy()
             img_eroded[:, :, :3] = cv2.erode(img[:, :, :3], kernel, iterations=erosion_iteration)
 
-        p = min(np.random.random(), erosion_cap)
+        p = min(self.rng.random(), erosion_cap)
 
         #random on pixel, not channel
-        random_mask = np.random.choice([0, 1], size=img.shape[:2] , p=[1 - p, p])
+        random_mask = self.rng.choice([0, 1], size=img.shape[:2] , p=[1 - p, p])
         random_mask = np.expand_dims(random_mask, axis=2)
 
         if self.colormode == 'RGB':
@@ -98,11 +99,11 @@ class DownstreamAugment:
                 
         mask = np.ones((h, w), np.uint8)
         n_holes_max = max(h, w) // hole_size * n_holes_pct
-        n_holes = np.random.randint(n_holes_max)
+        n_holes = self.rng.integers(n_holes_max)
         for _ in range(n_holes):
             # Central Anhor
-            y = np.random.randint(h)
-            x = np.random.randint(w)
+            y = self.rng.integers(h)
+            x = self.rng.integers(w)
             y1 = np.clip(y - hole_size // 2, 0, h)
             y2 = np.clip(y + hole_size // 2, 0, h)
             x1 = np.clip(x - hole_size // 2, 0, w)
@@ -138,4 +139,4 @@ class DownstreamAugment:
         else:
             raise Exception('Colormode other than RGB and RGBA not supported')
 
-        self.img[:, :, 3] = np.random.randint(low, high=high)
+        self.img[:, :, 3] = self.rng.integers(low, high=high)
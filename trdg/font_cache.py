@@ -0,0 +1,125 @@
+"""
+Process-wide LRU cache of ImageFont objects
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from PIL import ImageFont
+
+DEFAULT_CAPACITY = 128
+
+
+class FontCache(object):
+    """
+        Bounded LRU cache of ImageFont objects keyed by (font path, size).
+
+        Loading a TrueType font means re-opening and re-parsing the file, which
+        dominates the fixed cost of rendering short samples. Every worker
+        process gets its own instance (see `get_font`) so the loaded faces are
+        reused across all the samples it renders.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Font cache capacity must be at least 1")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._fonts = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._fonts)
+
+    def __contains__(self, key):
+        return key in self._fonts
+
+    def get(self, font_path, size):
+        """
+            Return the ImageFont for (font_path, size), loading it on a miss
+        """
+
+        key = (font_path, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self._fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(font=font_path, size=size)
+
+        with self._lock:
+            self._fonts[key] = font
+            self._fonts.move_to_end(key)
+            while len(self._fonts) > self.capacity:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+        return font
+
+    def resize(self, capacity):
+        """
+            Change the capacity, evicting the least recently used fonts if needed
+        """
+
+        if capacity < 1:
+            raise ValueError("Font cache capacity must be at least 1")
+        with self._lock:
+            self.capacity = capacity
+            while len(self._fonts) > self.capacity:
+                self._fonts.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+            Drop every cached font and reset the counters
+        """
+
+        with self._lock:
+            self._fonts.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+            Return the cache counters as a dict
+        """
+
+        return {
+            "size": len(self._fonts),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_font_cache = FontCache()
+
+
+def get_font_cache():
+    """
+        Return the cache shared by everything running in this process
+    """
+
+    return _font_cache
+
+
+def set_font_cache_capacity(capacity):
+    """
+        Resize the process-wide cache (usable as a Pool initializer)
+    """
+
+    _font_cache.resize(capacity)
+
+
+def get_font(font_path, size):
+    """
+        Shortcut for get_font_cache().get(font_path, size)
+    """
+
+    return _font_cache.get(font_path, size)
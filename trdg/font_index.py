@@ -0,0 +1,383 @@
+"""
+Persistent per-font metrics index and codepoint coverage
+
+The index is a directory holding one memory-mapped table per (font, size)
+and an index.json describing them. Workers open the tables read-only, so
+every process on a machine shares the same pages through the OS cache
+instead of measuring characters with getsize at runtime.
+
+The coverage of a font is the set of codepoints its cmap maps to a glyph,
+used to route every character to a font that can draw it.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from trdg.font_cache import get_font
+
+INDEX_FILE = "index.json"
+
+# Columns of a metrics table
+CODEPOINT, WIDTH, HEIGHT = 0, 1, 2
+
+
+def _read_table_offsets(data):
+    """
+        Return {tag: (offset, length)} for the first font of a TTF/OTF/TTC file
+    """
+
+    base = 0
+    if data[0:4] == b"ttcf":
+        (base,) = struct.unpack(">I", data[12:16])
+    (num_tables,) = struct.unpack(">H", data[base + 4 : base + 6])
+    tables = {}
+    for i in range(num_tables):
+        record = base + 12 + 16 * i
+        tag, _, offset, length = struct.unpack(">4sIII", data[record : record + 16])
+        tables[tag] = (offset, length)
+    return tables
+
+
+def _read_cmap_subtable(data, offset):
+    """
+        Return the codepoints mapped to a real glyph by one cmap subtable
+    """
+
+    (fmt,) = struct.unpack(">H", data[offset : offset + 2])
+    codepoints = []
+
+    if fmt == 0:
+        glyphs = data[offset + 6 : offset + 6 + 256]
+        codepoints = [np.array([c for c in range(256) if glyphs[c] != 0], dtype=np.uint32)]
+    elif fmt == 4:
+        (seg_count_x2,) = struct.unpack(">H", data[offset + 6 : offset + 8])
+        seg_count = seg_count_x2 // 2
+        ends_at = offset + 14
+        starts_at = ends_at + seg_count_x2 + 2
+        deltas_at = starts_at + seg_count_x2
+        range_offsets_at = deltas_at + seg_count_x2
+        ends = struct.unpack(">%dH" % seg_count, data[ends_at : ends_at + seg_count_x2])
+        starts = struct.unpack(">%dH" % seg_count, data[starts_at : starts_at + seg_count_x2])
+        deltas = struct.unpack(">%dh" % seg_count, data[deltas_at : deltas_at + seg_count_x2])
+        range_offsets = struct.unpack(
+            ">%dH" % seg_count, data[range_offsets_at : range_offsets_at + seg_count_x2]
+        )
+        for i in range(seg_count):
+            start, end = starts[i], min(ends[i], 0xFFFE)
+            if start > end:
+                continue
+            chars = np.arange(start, end + 1, dtype=np.uint32)
+            if range_offsets[i] == 0:
+                glyphs = (chars + deltas[i]) & 0xFFFF
+            else:
+                glyphs_at = range_offsets_at + 2 * i + range_offsets[i] + 2 * (chars - start)
+                glyphs_at = glyphs_at[glyphs_at + 2 <= len(data)]
+                raw = np.frombuffer(data, dtype=np.uint8)
+                glyphs = (raw[glyphs_at].astype(np.uint32) << 8) | raw[glyphs_at + 1]
+                chars = chars[: len(glyphs)]
+                glyphs = np.where(glyphs != 0, (glyphs + deltas[i]) & 0xFFFF, 0)
+            codepoints.append(chars[glyphs != 0])
+    elif fmt == 6:
+        first, count = struct.unpack(">HH", data[offset + 6 : offset + 10])
+        glyphs = np.array(
+            struct.unpack(">%dH" % count, data[offset + 10 : offset + 10 + 2 * count]),
+            dtype=np.uint32,
+        )
+        codepoints = [np.arange(first, first + count, dtype=np.uint32)[glyphs != 0]]
+    elif fmt in (12, 13):
+        (num_groups,) = struct.unpack(">I", data[offset + 12 : offset + 16])
+        for i in range(num_groups):
+            group = offset + 16 + 12 * i
+            start, end, glyph = struct.unpack(">III", data[group : group + 12])
+            if fmt == 12 and glyph == 0:
+                start += 1
+            if fmt == 13 and glyph == 0:
+                continue
+            if start <= end:
+                codepoints.append(np.arange(start, end + 1, dtype=np.uint32))
+
+    if len(codepoints) == 0:
+        return np.zeros(0, dtype=np.uint32)
+    return np.concatenate(codepoints)
+
+
+def read_codepoints(font_path):
+    """
+        Return the sorted codepoints that a font maps to a glyph, read
+        from its Unicode cmap subtables
+    """
+
+    with open(font_path, "rb") as f:
+        data = f.read()
+
+    tables = _read_table_offsets(data)
+    if b"cmap" not in tables:
+        raise ValueError("{} has no cmap table".format(font_path))
+    cmap, _ = tables[b"cmap"]
+
+    (num_subtables,) = struct.unpack(">H", data[cmap + 2 : cmap + 4])
+    codepoints = [np.zeros(0, dtype=np.uint32)]
+    for i in range(num_subtables):
+        record = cmap + 4 + 8 * i
+        platform, encoding, offset = struct.unpack(">HHI", data[record : record + 8])
+        # Unicode platform, or Windows with a Unicode BMP/full repertoire encoding
+        if platform == 0 or (platform == 3 and encoding in (1, 10)):
+            codepoints.append(_read_cmap_subtable(data, cmap + offset))
+
+    return np.unique(np.concatenate(codepoints))
+
+
+class FontCoverage(object):
+    """
+        Bitset of the codepoints supported by a font, with O(1) lookups
+    """
+
+    def __init__(self, codepoints):
+        codepoints = np.asarray(codepoints, dtype=np.uint32)
+        bits = np.zeros((sys.maxunicode + 1) // 8, dtype=np.uint8)
+        np.bitwise_or.at(bits, codepoints >> 3, (1 << (codepoints & 7)).astype(np.uint8))
+        self._bits = bits.tobytes()
+        self.count = len(codepoints)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, c):
+        cp = ord(c)
+        return (self._bits[cp >> 3] >> (cp & 7)) & 1 == 1
+
+
+_font_coverages = {}
+
+
+def get_font_coverage(font_path):
+    """
+        Return the FontCoverage of a font, None if its cmap can't be read.
+
+        Coverages are computed once per process, from the metrics index when
+        one is loaded, otherwise by parsing the font file.
+    """
+
+    if font_path in _font_coverages:
+        return _font_coverages[font_path]
+
+    coverage = None
+    codepoints = None
+    if _metrics_index is not None:
+        codepoints = _metrics_index.codepoints(font_path)
+    if codepoints is None:
+        try:
+            codepoints = read_codepoints(font_path)
+        except (OSError, ValueError, struct.error):
+            codepoints = None
+    if codepoints is not None and len(codepoints) > 0:
+        coverage = FontCoverage(codepoints)
+    _font_coverages[font_path] = coverage
+    return coverage
+
+
+def _font_signature(font_path):
+    stat = os.stat(font_path)
+    return {"mtime": int(stat.st_mtime), "bytes": stat.st_size}
+
+
+def _table_name(font_path, size):
+    digest = hashlib.sha1(os.path.abspath(font_path).encode("utf8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(font_path))[0]
+    return "{}-{}-{}.npy".format(stem, digest, size)
+
+
+def build_metrics(font_path, size):
+    """
+        Measure every codepoint of a font at one size.
+
+        Returns a (N, 3) int32 array of (codepoint, width, height) sorted by
+        codepoint, and the (ascent, descent) of the font.
+    """
+
+    font = get_font(font_path, size)
+    codepoints = read_codepoints(font_path)
+    table = np.zeros((len(codepoints), 3), dtype=np.int32)
+    table[:, CODEPOINT] = codepoints
+    for i, cp in enumerate(codepoints):
+        table[i, WIDTH], table[i, HEIGHT] = font.getsize(chr(cp))
+    return table, font.getmetrics()
+
+
+def build_index(font_paths, sizes, index_dir, verbose=False):
+    """
+        Build (or update) the metrics index of font_paths at every size
+    """
+
+    if not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+
+    index = _read_index_file(index_dir)
+    for font_path in font_paths:
+        key = os.path.abspath(font_path)
+        signature = _font_signature(font_path)
+        entry = index.get(key)
+        if entry is None or entry["signature"] != signature:
+            entry = {"signature": signature, "sizes": {}}
+        for size in sizes:
+            if str(size) in entry["sizes"]:
+                continue
+            try:
+                table, (ascent, descent) = build_metrics(font_path, size)
+            except (OSError, ValueError, struct.error) as e:
+                print("Skipping {}: {}".format(font_path, e))
+                break
+            name = _table_name(font_path, size)
+            np.save(os.path.join(index_dir, name), table)
+            entry["sizes"][str(size)] = {
+                "table": name,
+                "ascent": ascent,
+                "descent": descent,
+                "codepoints": len(table),
+            }
+            if verbose:
+                print("{} @ {}: {} codepoints".format(font_path, size, len(table)))
+        index[key] = entry
+
+    with open(os.path.join(index_dir, INDEX_FILE), "w", encoding="utf8") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    return index
+
+
+def _read_index_file(index_dir):
+    path = os.path.join(index_dir, INDEX_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf8") as f:
+        return json.load(f)
+
+
+class MetricsTable(object):
+    """
+        Read-only view over the metrics of one (font, size)
+    """
+
+    def __init__(self, path, ascent, descent):
+        self.table = np.load(path, mmap_mode="r")
+        self.codepoints = self.table[:, CODEPOINT]
+        self.ascent = ascent
+        self.descent = descent
+
+    def __len__(self):
+        return len(self.table)
+
+    def getsize(self, c):
+        """
+            Return the (width, height) of a character, None if it is not indexed
+        """
+
+        cp = ord(c)
+        i = int(np.searchsorted(self.codepoints, cp))
+        if i < len(self.codepoints) and self.codepoints[i] == cp:
+            return int(self.table[i, WIDTH]), int(self.table[i, HEIGHT])
+        return None
+
+
+class MetricsIndex(object):
+    """
+        Lazily opened collection of MetricsTable stored in index_dir
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self._index = _read_index_file(index_dir)
+        self._tables = {}
+
+    def get(self, font_path, size):
+        """
+            Return the MetricsTable of (font_path, size), None if it is
+            missing or the font changed since the index was built
+        """
+
+        key = (font_path, size)
+        if key in self._tables:
+            return self._tables[key]
+
+        table = None
+        entry = self._index.get(os.path.abspath(font_path))
+        if (
+            entry is not None
+            and str(size) in entry["sizes"]
+            and os.path.isfile(font_path)
+            and entry["signature"] == _font_signature(font_path)
+        ):
+            meta = entry["sizes"][str(size)]
+            table = MetricsTable(
+                os.path.join(self.index_dir, meta["table"]), meta["ascent"], meta["descent"]
+            )
+        self._tables[key] = table
+        return table
+
+    def codepoints(self, font_path):
+        """
+            Return the indexed codepoints of a font (from any of its sizes),
+            None if it isn't indexed
+        """
+
+        entry = self._index.get(os.path.abspath(font_path))
+        if entry is None or len(entry["sizes"]) == 0:
+            return None
+        size = int(sorted(entry["sizes"])[0])
+        table = self.get(font_path, size)
+        return None if table is None else table.codepoints
+
+
+_metrics_index = None
+
+
+def load_metrics_index(index_dir):
+    """
+        Make every FontMetrics of this process read from the index in index_dir
+    """
+
+    global _metrics_index
+    _metrics_index = MetricsIndex(index_dir) if index_dir else None
+
+
+def get_metrics_index():
+    return _metrics_index
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the per-font metrics index used by the text renderers."
+    )
+    parser.add_argument(
+        "-fd", "--font_dir", type=str, nargs="?", help="The directory of the fonts to index", required=True
+    )
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        help="The font sizes to index. Should match the -f/--format values used for generation",
+        default=[32],
+    )
+    parser.add_argument(
+        "-o", "--output_dir", type=str, nargs="?", help="Where to write the index", required=True
+    )
+    args = parser.parse_args()
+
+    fonts = [
+        os.path.join(args.font_dir, p)
+        for p in sorted(os.listdir(args.font_dir))
+        if os.path.splitext(p)[1].lower() in (".ttf", ".otf", ".ttc")
+    ]
+    build_index(fonts, args.sizes, args.output_dir, verbose=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Sample independent parameters of FakeTextDataGenerator.generate
+"""
+
+from collections import namedtuple
+
+from trdg.image_encoder import ImageEncoder
+from trdg.output_layout import DEFAULT_FILES_PER_DIR
+
+# Same order as the parameters of FakeTextDataGenerator.generate following
+# (index, text, font_en, font_ch)
+FIELDS = [
+    "out_dir",
+    "size",
+    "extension",
+    "skewing_angle",
+    "random_skew",
+    "blur",
+    "random_blur",
+    "background_type",
+    "distorsion_type",
+    "distorsion_orientation",
+    "is_handwritten",
+    "name_format",
+    "width",
+    "alignment",
+    "text_color",
+    "orientation",
+    "space_width",
+    "character_spacing",
+    "margins",
+    "random_margins",
+    "erosion_kernel_size",
+    "erosion_iteration",
+    "erosion_cap",
+    "n_holes_pct",
+    "hole_size_pct",
+    "alpha_low",
+    "invert",
+    "border_prob",
+    "border",
+    "fit",
+    "output_mask",
+    "engine",
+    "layout",
+    "files_per_dir",
+    "encoder",
+    "kerning",
+]
+
+DEFAULTS = {
+    "out_dir": None,
+    "size": 32,
+    "extension": "jpg",
+    "skewing_angle": 0,
+    "random_skew": False,
+    "blur": 0,
+    "random_blur": False,
+    "background_type": 0,
+    "distorsion_type": 0,
+    "distorsion_orientation": 0,
+    "is_handwritten": False,
+    "name_format": 0,
+    "width": -1,
+    "alignment": 1,
+    "text_color": "#282828",
+    "orientation": 0,
+    "space_width": 1.0,
+    "character_spacing": 0,
+    "margins": (5, 5, 5, 5),
+    "random_margins": False,
+    "erosion_kernel_size": 0,
+    "erosion_iteration": 0,
+    "erosion_cap": 0,
+    "n_holes_pct": 0,
+    "hole_size_pct": 0,
+    "alpha_low": 255,
+    "invert": False,
+    "border_prob": 0,
+    "border": (5, 5, 5, 5),
+    "fit": False,
+    "output_mask": False,
+    "engine": "pil",
+    "layout": "flat",
+    "files_per_dir": DEFAULT_FILES_PER_DIR,
+    "encoder": None,
+    "kerning": False,
+}
+
+
+class GenerationConfig(namedtuple("GenerationConfig", FIELDS)):
+    """
+        Immutable set of the parameters shared by every sample of a run.
+
+        It is pickled once per worker (see run.init_worker) instead of once
+        per sample, and `generate(index, text, font_en, font_ch, *config)`
+        is a valid call of FakeTextDataGenerator.generate.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_args(cls, args):
+        """
+            Build the configuration of the run.py command line arguments
+        """
+
+        return cls(
+            out_dir=args.output_dir,
+            size=args.format,
+            extension=args.extension,
+            skewing_angle=args.skew_angle,
+            random_skew=args.random_skew,
+            blur=args.blur,
+            random_blur=args.random_blur,
+            background_type=args.background,
+            distorsion_type=args.distorsion,
+            distorsion_orientation=args.distorsion_orientation,
+            is_handwritten=args.handwritten,
+            name_format=args.name_format,
+            width=args.width,
+            alignment=args.alignment,
+            text_color=args.text_color,
+            orientation=args.orientation,
+            space_width=args.space_width,
+            character_spacing=args.character_spacing,
+            margins=tuple(args.margins),
+            random_margins=args.random_margins,
+            erosion_kernel_size=args.erosion_kernel_size,
+            erosion_iteration=args.erosion_iteration,
+            erosion_cap=args.erosion_cap,
+            n_holes_pct=args.n_holes_pct,
+            hole_size_pct=args.hole_size_pct,
+            alpha_low=args.alpha_low,
+            invert=args.invert,
+            border_prob=args.border_prob,
+            border=tuple(args.border),
+            fit=args.fit,
+            output_mask=args.output_mask,
+            engine=args.render_engine,
+            layout=args.output_layout,
+            files_per_dir=args.files_per_dir,
+            encoder=ImageEncoder(
+                args.encoder, args.jpeg_quality, args.png_compression, args.webp_quality
+            ),
+            kerning=args.kerning,
+        )
+
+
+# namedtuple only takes defaults= from Python 3.7
+GenerationConfig.__new__.__defaults__ = tuple(DEFAULTS[f] for f in FIELDS)
@@ -43,6 +43,10 @@ class GeneratorFromDict:
         border=(5, 5, 5, 5),
         fit=False,
         output_mask=False,
+        engine="pil",
+        kerning=False,
+        config=None,
+        seed=None,
     ):
         self.count = count
         self.length = length
@@ -81,8 +85,16 @@ class GeneratorFromDict:
             border,
             fit,
             output_mask,
+            engine,
+            kerning,
+            config=config,
+            seed=seed,
         )
 
+    def warm_up(self):
+        """Preload the fonts, pictures and models used by the samples, returns what was loaded"""
+        return self.generator.warm_up()
+
     def __iter__(self):
         return self.generator
 
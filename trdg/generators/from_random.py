@@ -45,6 +45,10 @@ class GeneratorFromRandom:
         border=(5, 5, 5, 5),
         fit=False,
         output_mask=False,
+        engine="pil",
+        kerning=False,
+        config=None,
+        seed=None,
     ):
         self.count = count
         self.length = length
@@ -94,8 +98,16 @@ class GeneratorFromRandom:
             border,
             fit,
             output_mask,
+            engine,
+            kerning,
+            config=config,
+            seed=seed,
         )
 
+    def warm_up(self):
+        """Preload the fonts, pictures and models used by the samples, returns what was loaded"""
+        return self.generator.warm_up()
+
     def __iter__(self):
         return self.generator
 
@@ -159,6 +171,10 @@ class GeneratorFromControlledRandom:
         border=(5, 5, 5, 5),
         fit=False,
         output_mask=False,
+        engine="pil",
+        kerning=False,
+        config=None,
+        seed=None,
     ):
         self.count = count
         self.length = length
@@ -209,8 +225,16 @@ class GeneratorFromControlledRandom:
             border,
             fit,
             output_mask,
+            engine,
+            kerning,
+            config=config,
+            seed=seed,
         )
 
+    def warm_up(self):
+        """Preload the fonts, pictures and models used by the samples, returns what was loaded"""
+        return self.generator.warm_up()
+
     def __iter__(self):
         return self.generator
 
@@ -1,9 +1,17 @@
 from ..data_generator import FakeTextDataGenerator
+from ..generation_config import GenerationConfig
+from ..warmup import warm_up
+from ..text_layout import MissingGlyphError
 from ..utils import load_dict, load_fonts
 
 
 class GeneratorFromStrings:
-    """Generator that uses a given list of strings"""
+    """Generator that uses a given list of strings
+
+    A GenerationConfig passed as config replaces all the rendering parameters.
+    With a seed, the rendering of the n-th sample only depends on the seed, n
+    and its string.
+    """
 
     def __init__(
         self,
@@ -39,40 +47,59 @@ class GeneratorFromStrings:
         border=(5, 5, 5, 5),
         fit=False,
         output_mask=False,
+        engine="pil",
+        kerning=False,
+        config=None,
+        seed=None,
     ):
         self.count = count
         self.strings = strings
         self.fonts_en = fonts_en
         self.fonts_ch = fonts_ch
-        self.size = size
-        self.skewing_angle = skewing_angle
-        self.random_skew = random_skew
-        self.blur = blur
-        self.random_blur = random_blur
-        self.background_type = background_type
-        self.distorsion_type = distorsion_type
-        self.distorsion_orientation = distorsion_orientation
-        self.is_handwritten = is_handwritten
-        self.width = width
-        self.alignment = alignment
-        self.text_color = text_color
-        self.orientation = orientation
-        self.space_width = space_width
-        self.character_spacing = character_spacing
-        self.margins = margins
-        self.random_margins = random_margins
-        self.erosion_kernel_size = erosion_kernel_size
-        self.erosion_iteration = erosion_iteration
-        self.erosion_cap = erosion_cap 
-        self.n_holes_pct = n_holes_pct
-        self.hole_size_pct = hole_size_pct
-        self.alpha_low = alpha_low
-        self.invert = invert
-        self.border_prob = border_prob
-        self.border = border
-        self.fit = fit
-        self.output_mask = output_mask
+        if config is None:
+            config = GenerationConfig(
+                out_dir=None,
+                size=size,
+                extension=None,
+                skewing_angle=skewing_angle,
+                random_skew=random_skew,
+                blur=blur,
+                random_blur=random_blur,
+                background_type=background_type,
+                distorsion_type=distorsion_type,
+                distorsion_orientation=distorsion_orientation,
+                is_handwritten=is_handwritten,
+                name_format=0,
+                width=width,
+                alignment=alignment,
+                text_color=text_color,
+                orientation=orientation,
+                space_width=space_width,
+                character_spacing=character_spacing,
+                margins=margins,
+                random_margins=random_margins,
+                erosion_kernel_size=erosion_kernel_size,
+                erosion_iteration=erosion_iteration,
+                erosion_cap=erosion_cap,
+                n_holes_pct=n_holes_pct,
+                hole_size_pct=hole_size_pct,
+                alpha_low=alpha_low,
+                invert=invert,
+                border_prob=border_prob,
+                border=border,
+                fit=fit,
+                output_mask=output_mask,
+                engine=engine,
+                kerning=kerning,
+            )
+        self.config = config
+        self.seed = seed
         self.generated_count = 0
+        self.skipped_count = 0
+
+    def warm_up(self):
+        """Preload the fonts, pictures and models used by the samples, returns what was loaded"""
+        return warm_up(self.config, self.fonts_en + self.fonts_ch)
 
     def __iter__(self):
         return self
@@ -84,43 +111,25 @@ class GeneratorFromStrings:
         if self.generated_count == self.count:
             raise StopIteration
         self.generated_count += 1
+        # Strings with characters that none of the fonts can draw are rejected
+        # before rendering, the next string is used instead
+        for _ in range(len(self.strings)):
+            try:
+                return self._generate(self.generated_count - 1 + self.skipped_count)
+            except MissingGlyphError as e:
+                self.skipped_count += 1
+                error = e
+        raise error
+
+    def _generate(self, i):
         return (
-            FakeTextDataGenerator.generate(
+            FakeTextDataGenerator.generate_from_config(
                 self.generated_count,
-                self.strings[(self.generated_count - 1) % len(self.strings)],
-                self.fonts_en[(self.generated_count - 1) % len(self.fonts_en)],
-                self.fonts_ch[(self.generated_count - 1) % len(self.fonts_ch)],
-                None,
-                self.size,
-                None,
-                self.skewing_angle,
-                self.random_skew,
-                self.blur,
-                self.random_blur,
-                self.background_type,
-                self.distorsion_type,
-                self.distorsion_orientation,
-                self.is_handwritten,
-                0,
-                self.width,
-                self.alignment,
-                self.text_color,
-                self.orientation,
-                self.space_width,
-                self.character_spacing,
-                self.margins,
-                self.random_margins,
-                self.erosion_kernel_size,
-                self.erosion_iteration,
-                self.erosion_cap,
-                self.n_holes_pct,
-                self.hole_size_pct,
-                self.alpha_low,
-                self.invert,
-                self.border_prob,
-                self.border,
-                self.fit,
-                self.output_mask,
+                self.strings[i % len(self.strings)],
+                self.fonts_en[i % len(self.fonts_en)],
+                self.fonts_ch[i % len(self.fonts_ch)],
+                self.config,
+                self.seed,
             ),
-            self.strings[(self.generated_count - 1) % len(self.strings)],
-        )
\ No newline at end of file
+            self.strings[i % len(self.strings)],
+        )
@@ -0,0 +1,152 @@
+"""
+Pre-rasterized glyph bitmaps composited with NumPy
+"""
+
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+from trdg.font_cache import get_font
+
+DEFAULT_CAPACITY = 65536
+
+# coverage: antialiased 8-bit bitmap, used for the text image
+# mono: binary bitmap (0 or 255), used for the mask like ImageDraw's fontmode "1"
+# offset and mono_offset: (x, y) position of the bitmaps relative to the pen position
+# advance: (width, height) of the glyph as reported by the font
+Glyph = namedtuple(
+    "Glyph", ["coverage", "offset", "mono", "mono_offset", "advance"]
+)
+
+
+def _to_array(core):
+    return np.asarray(Image.Image()._new(core), dtype=np.uint8)
+
+
+class GlyphAtlas(object):
+    """
+        Bounded LRU of glyph bitmaps keyed by (font path, size, character).
+
+        Each glyph is rasterized by FreeType once, after which drawing it is
+        a NumPy blit instead of another ImageDraw.text call.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Glyph atlas capacity must be at least 1")
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._glyphs = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    def get(self, font_path, size, character):
+        """
+            Return the Glyph of character, rasterizing it on a miss
+        """
+
+        key = (font_path, size, character)
+        with self._lock:
+            glyph = self._glyphs.get(key)
+            if glyph is not None:
+                self._glyphs.move_to_end(key)
+                self.hits += 1
+                return glyph
+            self.misses += 1
+
+        font = get_font(font_path, size)
+        coverage, offset = font.getmask2(character, "L")
+        mono, mono_offset = font.getmask2(character, "1")
+        glyph = Glyph(
+            _to_array(coverage),
+            offset,
+            _to_array(mono),
+            mono_offset,
+            font.getsize(character),
+        )
+
+        with self._lock:
+            self._glyphs[key] = glyph
+            while len(self._glyphs) > self.capacity:
+                self._glyphs.popitem(last=False)
+        return glyph
+
+    def clear(self):
+        """
+            Drop every cached glyph and reset the counters
+        """
+
+        with self._lock:
+            self._glyphs.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+def _clip(canvas, bitmap, x, y):
+    """
+        Return the overlapping (canvas region, bitmap region) of a blit at (x, y)
+    """
+
+    height, width = canvas.shape[:2]
+    bitmap_height, bitmap_width = bitmap.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + bitmap_width, width), min(y + bitmap_height, height)
+    if x0 >= x1 or y0 >= y1:
+        return None, None
+    return (
+        canvas[y0:y1, x0:x1],
+        bitmap[y0 - y : y1 - y, x0 - x : x1 - x],
+    )
+
+
+def blend(canvas, bitmap, x, y, ink):
+    """
+        Blend ink into an RGBA canvas through an 8-bit coverage bitmap.
+
+        Uses the same fixed point arithmetic as ImageDraw: color channels of
+        fully transparent pixels take the ink as is, everything else is
+        blended by coverage.
+    """
+
+    region, coverage = _clip(canvas, bitmap, x, y)
+    if region is None:
+        return
+    coverage = coverage.astype(np.uint32)[:, :, None]
+    channel_coverage = np.repeat(coverage, 4, axis=2)
+    channel_coverage[:, :, :3][
+        (region[:, :, 3] == 0) & (coverage[:, :, 0] != 0)
+    ] = 255
+    ink = np.asarray(ink, dtype=np.uint32)
+    tmp = (
+        region.astype(np.uint32) * (255 - channel_coverage)
+        + ink * channel_coverage
+        + 128
+    )
+    region[...] = ((tmp >> 8) + tmp) >> 8
+
+
+def stamp(canvas, bitmap, x, y, ink):
+    """
+        Write ink into the canvas wherever the binary bitmap is set
+    """
+
+    region, mono = _clip(canvas, bitmap, x, y)
+    if region is None:
+        return
+    region[mono > 0] = ink
+
+
+_glyph_atlas = GlyphAtlas()
+
+
+def get_glyph_atlas():
+    """
+        Return the atlas shared by everything running in this process
+    """
+
+    return _glyph_atlas
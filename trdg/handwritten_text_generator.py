@@ -1,46 +1,41 @@
+import math
 import os
 import pickle
 import numpy as np
-import random as rnd
 import tensorflow as tf
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
-import matplotlib.mlab as mlab
-import seaborn
-from PIL import Image, ImageColor
+from PIL import ImageColor
 from collections import namedtuple
 
+from trdg.stroke_library import get_stroke_library, jitter
+from trdg.stroke_renderer import DEFAULT_HEIGHT, DEFAULT_STROKE_WIDTH, render_strokes
 
-def _sample(e, mu1, mu2, std1, std2, rho):
-    cov = np.array([[std1 * std1, std1 * std2 * rho], [std1 * std2 * rho, std2 * std2]])
-    mean = np.array([mu1, mu2])
 
-    x, y = np.random.multivariate_normal(mean, cov)
-    end = np.random.binomial(1, e)
+def _sample(e, mu1, mu2, std1, std2, rho, rng):
+    # Bivariate normal draw, without building and decomposing a covariance
+    # matrix like multivariate_normal does on every call
+    z1, z2 = rng.standard_normal(2)
+    x = mu1 + std1 * z1
+    y = mu2 + std2 * (rho * z1 + math.sqrt(max(1.0 - rho * rho, 0.0)) * z2)
+    end = rng.binomial(1, e)
     return np.array([x, y, end])
 
 
-def _split_strokes(points):
-    points = np.array(points)
-    strokes = []
-    b = 0
-    for e in range(len(points)):
-        if points[e, 2] == 1.0:
-            strokes += [points[b : e + 1, :2].copy()]
-            b = e + 1
-    return strokes
+def _choose(pi, rng):
+    """
+        Draw a mixture component from its weights
+    """
 
-
-def _cumsum(points):
-    sums = np.cumsum(points[:, :2], axis=0)
-    return np.concatenate([sums, points[:, 2:]], axis=1)
+    cumulative = np.cumsum(pi)
+    return min(
+        int(np.searchsorted(cumulative, rng.random() * cumulative[-1], side="right")),
+        len(pi) - 1,
+    )
 
 
-def _sample_text(sess, args_text, translation):
-    # Original creator said it helps (https://github.com/Grzego/handwriting-generation/issues/3)
-    args_text += " "
-
-    fields = [
+# Tensors of the model graph, stored in the collection of the same name
+Params = namedtuple(
+    "Params",
+    [
         "coordinates",
         "sequence",
         "bias",
@@ -56,8 +51,23 @@ def _sample_text(sess, args_text, translation):
         "phi",
         "finish",
         "zero_states",
-    ]
-    vs = namedtuple("Params", fields)(*[tf.get_collection(name)[0] for name in fields])
+    ],
+)
+
+
+def _sample_text(step, reset, args_text, translation, rng=None):
+    """
+        Sample the strokes of a word, one model step at a time.
+
+        step(coordinates, sequence, bias) runs the model and returns
+        (e, pi, mu1, mu2, std1, std2, rho, finish), reset() zeroes its state.
+        Returns (stroke_data, coords).
+    """
+
+    rng = np.random.default_rng(rng)
+
+    # Original creator said it helps (https://github.com/Grzego/handwriting-generation/issues/3)
+    args_text += " "
 
     text = np.array([translation.get(c, 0) for c in args_text])
     sequence = np.eye(len(translation), dtype=np.float32)[text]
@@ -68,36 +78,13 @@ def _sample_text(sess, args_text, translation):
     coord = np.array([0.0, 0.0, 1.0])
     coords = [coord]
 
-    phi_data, window_data, kappa_data, stroke_data = [], [], [], []
-    sess.run(vs.zero_states)
+    stroke_data = []
+    reset()
     for s in range(1, 60 * len(args_text) + 1):
-        e, pi, mu1, mu2, std1, std2, rho, finish, phi, window, kappa = sess.run(
-            [
-                vs.e,
-                vs.pi,
-                vs.mu1,
-                vs.mu2,
-                vs.std1,
-                vs.std2,
-                vs.rho,
-                vs.finish,
-                vs.phi,
-                vs.window,
-                vs.kappa,
-            ],
-            feed_dict={
-                vs.coordinates: coord[None, None, ...],
-                vs.sequence: sequence,
-                vs.bias: 1.0,
-            },
-        )
-        phi_data += [phi[0, :]]
-        window_data += [window[0, :]]
-        kappa_data += [kappa[0, :]]
-        # ---
-        g = np.random.choice(np.arange(pi.shape[1]), p=pi[0])
+        e, pi, mu1, mu2, std1, std2, rho, finish = step(coord[None, None, ...], sequence, 1.0)
+        g = _choose(pi[0], rng)
         coord = _sample(
-            e[0, 0], mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g]
+            e[0, 0], mu1[0, g], mu2[0, g], std1[0, g], std2[0, g], rho[0, g], rng
         )
         coords += [coord]
         stroke_data += [
@@ -110,90 +97,123 @@ def _sample_text(sess, args_text, translation):
     coords = np.array(coords)
     coords[-1, 2] = 1.0
 
-    return phi_data, window_data, kappa_data, stroke_data, coords
+    return stroke_data, coords
 
 
-def _crop_white_borders(image):
-    image_data = np.asarray(image)
-    grey_image_data = np.asarray(image.convert("L"))
-    non_empty_columns = np.where(grey_image_data.min(axis=0) < 255)[0]
-    non_empty_rows = np.where(grey_image_data.min(axis=1) < 255)[0]
-    cropBox = (
-        min(non_empty_rows),
-        max(non_empty_rows),
-        min(non_empty_columns),
-        max(non_empty_columns),
-    )
-    image_data_new = image_data[
-        cropBox[0] : cropBox[1] + 1, cropBox[2] : cropBox[3] + 1, :
-    ]
-
-    return Image.fromarray(image_data_new)
+MODEL_DIR = os.path.join(os.path.dirname(__file__), "handwritten_model")
 
 
-def _join_images(images):
-    widths, heights = zip(*(i.size for i in images))
+class HandwritingModel(object):
+    """
+        Handwriting generation model with its own graph and a session kept
+        open for the life of the object, so that importing and restoring
+        the model is done once per process instead of once per sample.
+    """
 
-    total_width = sum(widths) - 35 * len(images)
-    max_height = max(heights)
+    def __init__(self, model_dir=MODEL_DIR):
+        with open(os.path.join(model_dir, "translation.pkl"), "rb") as file:
+            self.translation = pickle.load(file)
 
-    compound_image = Image.new("RGBA", (total_width, max_height))
-
-    x_offset = 0
-    for im in images:
-        compound_image.paste(im, (x_offset, 0))
-        x_offset += im.size[0] - 35
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.sess = tf.Session(
+                graph=self.graph, config=tf.ConfigProto(device_count={"GPU": 0})
+            )
+            saver = tf.train.import_meta_graph(os.path.join(model_dir, "model-29.meta"))
+            saver.restore(self.sess, os.path.join(model_dir, "model-29"))
+            self.params = Params(*[tf.get_collection(name)[0] for name in Params._fields])
+
+        # Only what the sampler uses is fetched (not phi, window and kappa),
+        # through callables that skip the per-call setup of Session.run
+        vs = self.params
+        self._step = self.sess.make_callable(
+            [vs.e, vs.pi, vs.mu1, vs.mu2, vs.std1, vs.std2, vs.rho, vs.finish],
+            feed_list=[vs.coordinates, vs.sequence, vs.bias],
+        )
+        self._reset = self.sess.make_callable(vs.zero_states)
+
+    def sample(self, word, rng=None):
+        """
+            Sample the strokes of a word, returns (stroke_data, coords)
+        """
+
+        return _sample_text(self._step, self._reset, word, self.translation, rng)
+
+    def strokes(self, word, rng=None):
+        """
+            Return the pen offsets of a word, drawn from the stroke library
+            (see stroke_library.load_stroke_library) and jittered when it
+            has the word, sampled from the model otherwise
+        """
+
+        rng = np.random.default_rng(rng)
+        library = get_stroke_library()
+        if library is not None:
+            coords = library.sample(word, rng)
+            if coords is not None:
+                return jitter(coords, rng=rng)
+        return self.sample(word, rng)[1]
+
+    def generate(
+        self,
+        text,
+        text_color,
+        height=DEFAULT_HEIGHT,
+        stroke_width=DEFAULT_STROKE_WIDTH,
+        rng=None,
+    ):
+        """
+            Render text as handwriting in a color picked from text_color,
+            returns an RGBA image of the given height
+        """
+
+        rng = np.random.default_rng(rng)
+        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
+        c1, c2 = colors[0], colors[-1]
 
-    return compound_image
+        color = tuple(
+            int(rng.integers(min(c1[k], c2[k]), max(c1[k], c2[k]), endpoint=True))
+            for k in range(3)
+        )
 
+        words = [self.strokes(word, rng) for word in text.split(" ")]
+        return render_strokes(words, color, height=height, stroke_width=stroke_width)
 
-def generate(text, text_color):
-    with open(os.path.join("handwritten_model", "translation.pkl"), "rb") as file:
-        translation = pickle.load(file)
+    def close(self):
+        """
+            Release the session
+        """
 
-    config = tf.ConfigProto(device_count={"GPU": 0})
-    tf.reset_default_graph()
-    with tf.Session(config=config) as sess:
-        saver = tf.train.import_meta_graph("handwritten_model/model-29.meta")
-        saver.restore(sess, "handwritten_model/model-29")
-        images = []
-        colors = [ImageColor.getrgb(c) for c in text_color.split(",")]
-        c1, c2 = colors[0], colors[-1]
+        self.sess.close()
 
-        color = "#{:02x}{:02x}{:02x}".format(
-            rnd.randint(min(c1[0], c2[0]), max(c1[0], c2[0])),
-            rnd.randint(min(c1[1], c2[1]), max(c1[1], c2[1])),
-            rnd.randint(min(c1[2], c2[2]), max(c1[2], c2[2])),
-        )
 
-        for word in text.split(" "):
-            _, window_data, kappa_data, stroke_data, coords = _sample_text(
-                sess, word, translation
-            )
+_model = None
+_model_pid = None
 
-            strokes = np.array(stroke_data)
-            strokes[:, :2] = np.cumsum(strokes[:, :2], axis=0)
-            _, maxx = np.min(strokes[:, 0]), np.max(strokes[:, 0])
-            miny, maxy = np.min(strokes[:, 1]), np.max(strokes[:, 1])
 
-            fig, ax = plt.subplots(1, 1)
-            fig.patch.set_visible(False)
-            ax.axis("off")
+def get_model():
+    """
+        Return the model of this process, loading it on the first call. A
+        forked process loads its own, the TensorFlow session of its parent
+        can't be used after fork.
+    """
 
-            for stroke in _split_strokes(_cumsum(np.array(coords))):
-                plt.plot(stroke[:, 0], -stroke[:, 1], color=color)
+    global _model, _model_pid
+    if _model is None or _model_pid != os.getpid():
+        _model = HandwritingModel()
+        _model_pid = os.getpid()
+    return _model
 
-            fig.patch.set_alpha(0)
-            fig.patch.set_facecolor("none")
 
-            canvas = plt.get_current_fig_manager().canvas
-            canvas.draw()
+def warm_up():
+    """
+        Load the handwriting model in this process
+    """
 
-            image = Image.frombytes(
-                "RGBA", canvas.get_width_height(), canvas.buffer_rgba()
-            )
-            images.append(_crop_white_borders(image))
+    get_model()
 
-            plt.close()
 
-        return _join_images(images)
+def generate(
+    text, text_color, height=DEFAULT_HEIGHT, stroke_width=DEFAULT_STROKE_WIDTH, rng=None
+):
+    return get_model().generate(text, text_color, height, stroke_width, rng)
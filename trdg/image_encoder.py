@@ -0,0 +1,126 @@
+"""
+Encoding of the generated images to files
+"""
+
+import io
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+BACKENDS = ["pil", "cv2"]
+
+# Defaults of PIL, so that the output is unchanged unless asked otherwise
+DEFAULT_JPEG_QUALITY = 75
+DEFAULT_PNG_COMPRESSION = 6
+DEFAULT_WEBP_QUALITY = 80
+
+# Uncompressed arrays, written with numpy whatever the backend
+RAW_EXTENSIONS = ["npy"]
+
+# Suffix of the files being written by ImageEncoder.save
+PARTIAL_SUFFIX = ".part"
+
+
+def _image_mode(image, extension):
+    """
+        Return the mode image is encoded in for a format: JPEG has no alpha
+        channel, raw arrays keep the mode of the image if it has no alpha
+    """
+
+    if extension in ["jpg", "jpeg"]:
+        return "RGB" if image.mode != "L" else "L"
+    if extension in RAW_EXTENSIONS:
+        return image.mode if image.mode in ["L", "RGB"] else "RGB"
+    return "RGBA"
+
+
+class ImageEncoder(object):
+    """
+        Encodes images in the format of a file extension, with PIL or
+        cv2.imencode, at the given JPEG and WebP quality (0-100) and PNG
+        compression level (0-9, 0 being the fastest and largest). npy files
+        hold the uint8 array of the image (H, W) or (H, W, C), see
+        RAW_EXTENSIONS.
+    """
+
+    def __init__(
+        self,
+        backend="pil",
+        jpeg_quality=DEFAULT_JPEG_QUALITY,
+        png_compression=DEFAULT_PNG_COMPRESSION,
+        webp_quality=DEFAULT_WEBP_QUALITY,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(
+                "Unknown encoder backend {}, expected one of {}".format(backend, BACKENDS)
+            )
+        self.backend = backend
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self.webp_quality = webp_quality
+
+    def _pil_params(self, extension):
+        if extension in ["jpg", "jpeg"]:
+            return {"quality": self.jpeg_quality}
+        if extension == "png":
+            return {"compress_level": self.png_compression}
+        if extension == "webp":
+            return {"quality": self.webp_quality}
+        return {}
+
+    def _cv2_params(self, extension):
+        if extension in ["jpg", "jpeg"]:
+            return [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        if extension == "png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        if extension == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, self.webp_quality]
+        return []
+
+    def _write(self, image, extension, f):
+        extension = extension.lower()
+        image = image.convert(_image_mode(image, extension))
+        if extension in RAW_EXTENSIONS:
+            np.save(f, np.asarray(image))
+        elif self.backend == "pil":
+            image.save(
+                f,
+                format=Image.registered_extensions()["." + extension],
+                **self._pil_params(extension)
+            )
+        else:
+            array = np.asarray(image)
+            if array.ndim == 3:
+                array = cv2.cvtColor(
+                    array, cv2.COLOR_RGBA2BGRA if array.shape[2] == 4 else cv2.COLOR_RGB2BGR
+                )
+            ok, data = cv2.imencode("." + extension, array, self._cv2_params(extension))
+            if not ok:
+                raise ValueError("cv2 can't encode {} images".format(extension))
+            f.write(data.tobytes())
+
+    def encode(self, image, extension):
+        """
+            Return the bytes of image in the format of extension
+        """
+
+        buffer = io.BytesIO()
+        self._write(image, extension, buffer)
+        return buffer.getvalue()
+
+    def save(self, image, path):
+        """
+            Write image to path, in the format of its extension. The file is
+            written under a temporary name first, so that a file at path is
+            always complete (see resume.find_done).
+        """
+
+        partial = path + PARTIAL_SUFFIX
+        with open(partial, "wb") as f:
+            self._write(image, path.rsplit(".", 1)[-1], f)
+        os.replace(partial, path)
+
+
+DEFAULT_ENCODER = ImageEncoder()
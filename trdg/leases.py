@@ -0,0 +1,286 @@
+"""
+Coordinator-free distribution of the indices of a run over processes sharing
+a directory (e.g. on machines with a common network filesystem)
+
+The run is split in chunks of lease_size consecutive indices. A process
+works on a chunk after creating its lease file, CHUNK.GEN.lease, with
+O_EXCL, so that only one process gets it. The holder of a lease touches it
+every timeout / 4 seconds; a lease not touched for timeout seconds has
+expired, and another process takes the chunk over by creating the lease of
+the next generation (with O_EXCL too). CHUNK.done marks a chunk whose
+samples are all written.
+
+Samples only depend on the seed of the run and their index, so a chunk
+rendered twice (by a process whose lease expired while it was still
+working) gives the same files twice.
+"""
+
+import os
+import socket
+import threading
+import time
+
+DEFAULT_LEASE_SIZE = 1000
+DEFAULT_LEASE_TIMEOUT = 300
+
+LEASE_EXTENSION = ".lease"
+DONE_EXTENSION = ".done"
+
+
+def default_owner():
+    """
+        Return a name for this process unique among the machines sharing
+        the lease directory
+    """
+
+    return "{}-{}".format(socket.gethostname(), os.getpid())
+
+
+class LeaseQueue(object):
+    """
+        Hands the chunks of a run of count samples to this process: iterating
+        over it yields the number of every chunk claimed, until none can be.
+        wait then tells whether the chunks left, leased by other processes,
+        are done or one of them expired.
+
+        The indices of a chunk are given to started as its tasks are created
+        and to written as its samples are written (or skipped), and the
+        chunk to finished once all its tasks are created: the chunk is
+        marked done when that is the case and all its samples are written,
+        after a call to on_done(chunk) if given (e.g. to flush the files
+        listing them). A chunk taken over by another process is dropped
+        (see holds) and never marked done by this one.
+
+        Expiry compares the modification times of the lease files to the
+        clock of this machine, the clocks of the machines and of the file
+        server must not be more than a fraction of timeout apart.
+    """
+
+    def __init__(
+        self,
+        directory,
+        count,
+        lease_size=DEFAULT_LEASE_SIZE,
+        timeout=DEFAULT_LEASE_TIMEOUT,
+        owner=None,
+        on_done=None,
+    ):
+        if lease_size < 1:
+            raise ValueError("A lease needs at least one sample")
+        self.directory = directory
+        self.count = count
+        self.lease_size = lease_size
+        self.timeout = timeout
+        self.owner = owner or default_owner()
+        self.on_done = on_done
+        self.chunks = (count + lease_size - 1) // lease_size
+        # Generation of the lease of every chunk this process holds
+        self.held = {}
+        # Tasks of every held chunk not written yet, plus one until the
+        # chunk is finished
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def chunk_range(self, chunk):
+        """
+            Return the [start, stop) range of the indices of a chunk
+        """
+
+        start = chunk * self.lease_size
+        return start, min(start + self.lease_size, self.count)
+
+    def _lease_path(self, chunk, generation):
+        return os.path.join(
+            self.directory, "{:09d}.{}{}".format(chunk, generation, LEASE_EXTENSION)
+        )
+
+    def _done_path(self, chunk):
+        return os.path.join(self.directory, "{:09d}{}".format(chunk, DONE_EXTENSION))
+
+    def _scan(self):
+        """
+            Return the chunks done and the {chunk: (generation, mtime)} of
+            the latest lease of every other chunk with one
+        """
+
+        done = set()
+        leases = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(DONE_EXTENSION):
+                done.add(int(name[: -len(DONE_EXTENSION)]))
+            elif name.endswith(LEASE_EXTENSION):
+                chunk, generation = map(int, name[: -len(LEASE_EXTENSION)].split("."))
+                if chunk in leases and leases[chunk][0] > generation:
+                    continue
+                try:
+                    mtime = os.stat(os.path.join(self.directory, name)).st_mtime
+                except FileNotFoundError:
+                    # Removed by the process that just finished it
+                    continue
+                leases[chunk] = (generation, mtime)
+        return done, leases
+
+    def _create(self, chunk, generation):
+        try:
+            fd = os.open(
+                self._lease_path(chunk, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY
+            )
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            f.write(self.owner)
+        if os.path.exists(self._done_path(chunk)):
+            # Finished since the scan
+            os.remove(self._lease_path(chunk, generation))
+            return False
+        with self._lock:
+            self.held[chunk] = generation
+            self._pending[chunk] = 1
+        return True
+
+    def claim(self):
+        """
+            Lease a chunk that is free or whose lease expired, return its
+            number, None if there is none
+        """
+
+        done, leases = self._scan()
+        expired = time.time() - self.timeout
+        for chunk in range(self.chunks):
+            if chunk in done or chunk in self.held:
+                continue
+            if chunk not in leases:
+                if self._create(chunk, 0):
+                    return chunk
+            elif leases[chunk][1] < expired:
+                if self._create(chunk, leases[chunk][0] + 1):
+                    return chunk
+        return None
+
+    def __iter__(self):
+        while not self._stop.is_set():
+            chunk = self.claim()
+            if chunk is None:
+                return
+            yield chunk
+
+    def wait(self):
+        """
+            Wait until a chunk can be claimed, returns True then, False once
+            every chunk is done or leased by this process
+        """
+
+        while not self._stop.is_set():
+            done, leases = self._scan()
+            expired = time.time() - self.timeout
+            others = False
+            for chunk in range(self.chunks):
+                if chunk in done or chunk in self.held:
+                    continue
+                if chunk not in leases or leases[chunk][1] < expired:
+                    return True
+                others = True
+            if not others:
+                return False
+            self._stop.wait(min(self.timeout / 4, 10))
+        return False
+
+    def holds(self, chunk):
+        """
+            Tell whether this process still holds the lease of a chunk it
+            claimed, False once it is done or was taken over
+        """
+
+        with self._lock:
+            return chunk in self.held
+
+    def renew(self):
+        """
+            Touch the leases of this process, and drop the chunks it lost to
+            another process (its lease had expired), returned
+        """
+
+        with self._lock:
+            held = list(self.held.items())
+        lost = []
+        for chunk, generation in held:
+            if os.path.exists(self._lease_path(chunk, generation + 1)):
+                with self._lock:
+                    self.held.pop(chunk, None)
+                lost.append(chunk)
+                continue
+            try:
+                os.utime(self._lease_path(chunk, generation))
+            except FileNotFoundError:
+                # Finished meanwhile
+                pass
+        return lost
+
+    def start_renewing(self, interval=None):
+        """
+            Renew the leases every interval seconds (timeout / 4 by default)
+            on a thread, until close
+        """
+
+        interval = interval or self.timeout / 4
+
+        def renew():
+            while not self._stop.wait(interval):
+                self.renew()
+
+        self._renewer = threading.Thread(target=renew, daemon=True)
+        self._renewer.start()
+
+    def started(self, index):
+        with self._lock:
+            self._pending[index // self.lease_size] += 1
+
+    def written(self, index):
+        self._release(index // self.lease_size)
+
+    skipped = written
+
+    def finished(self, chunk):
+        self._release(chunk)
+
+    def _release(self, chunk):
+        with self._lock:
+            self._pending[chunk] -= 1
+            if self._pending[chunk] > 0:
+                return
+            del self._pending[chunk]
+            generation = self.held.pop(chunk, None)
+        if generation is not None:
+            self._complete(chunk, generation)
+
+    def _complete(self, chunk, generation):
+        if self.on_done is not None:
+            self.on_done(chunk)
+        open(self._done_path(chunk), "w").close()
+        for g in range(generation + 1):
+            try:
+                os.remove(self._lease_path(chunk, g))
+            except FileNotFoundError:
+                pass
+
+    def close(self):
+        """
+            Stop renewing, and give up the leases of the chunks that aren't
+            done so that other processes take them over right away
+        """
+
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+        with self._lock:
+            held = list(self.held.items())
+            self.held = {}
+            self._pending = {}
+        for chunk, generation in held:
+            try:
+                os.remove(self._lease_path(chunk, generation))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,148 @@
+"""
+Naming and placement of the generated files in the output directory
+"""
+
+import glob
+import hashlib
+import os
+
+LAYOUTS = ["flat", "index", "hash"]
+
+DEFAULT_FILES_PER_DIR = 1000
+
+# Levels of subdirectories of the sharded layouts
+DEPTH = 2
+
+LABELS_FILE = "labels.txt"
+
+# Directories already created by this process
+_created = set()
+
+
+def sample_names(index, text, extension, name_format):
+    """
+        Return the (image, mask) file names of a sample for a name format
+        (see the --name_format argument of run.py)
+    """
+
+    if name_format == 0:
+        image_name = "{}_{}.{}".format(text, str(index), extension)
+        mask_name = "{}_{}_mask.png".format(text, str(index))
+    elif name_format == 1:
+        image_name = "{}_{}.{}".format(str(index), text, extension)
+        mask_name = "{}_{}_mask.png".format(str(index), text)
+    elif name_format == 2:
+        image_name = "{}.{}".format(str(index), extension)
+        mask_name = "{}_mask.png".format(str(index))
+    else:
+        print("{} is not a valid name format. Using default.".format(name_format))
+        image_name = "{}_{}.{}".format(text, str(index), extension)
+        mask_name = "{}_{}_mask.png".format(text, str(index))
+    return image_name, mask_name
+
+
+def label_separator(name_format):
+    """
+        Return what separates the image path from the label in the lines of
+        the labels file: a space with name format 2 (as upstream), a tab
+        with the others, whose file names contain the label and so may
+        contain spaces
+    """
+
+    return " " if name_format == 2 else "\t"
+
+
+def sample_dir(index, image_name, layout="flat", files_per_dir=DEFAULT_FILES_PER_DIR):
+    """
+        Return the subdirectory (relative to the output directory) of a sample
+
+        flat: none, every file is in the output directory
+        index: files_per_dir consecutive samples per directory, nested in
+        DEPTH levels of files_per_dir directories (the top level only grows
+        past that after files_per_dir ** (DEPTH + 1) samples),
+        e.g. 1234567 is in 001/234
+        hash: DEPTH levels of 256 directories named after the md5 of the
+        image name, e.g. 3f/a2
+    """
+
+    if layout == "flat":
+        return ""
+    if layout == "index":
+        shard = index // files_per_dir
+        width = len(str(files_per_dir - 1))
+        parts = []
+        for _ in range(DEPTH - 1):
+            shard, part = divmod(shard, files_per_dir)
+            parts.append(str(part).zfill(width))
+        parts.append(str(shard).zfill(width))
+        return os.path.join(*reversed(parts))
+    if layout == "hash":
+        digest = hashlib.md5(image_name.encode("utf8")).hexdigest()
+        return os.path.join(*[digest[2 * i : 2 * i + 2] for i in range(DEPTH)])
+    raise ValueError("Unknown output layout {}, expected one of {}".format(layout, LAYOUTS))
+
+
+def sample_path(index, image_name, layout="flat", files_per_dir=DEFAULT_FILES_PER_DIR):
+    """
+        Return the path of a sample image relative to the output directory
+    """
+
+    return os.path.join(sample_dir(index, image_name, layout, files_per_dir), image_name)
+
+
+def make_sample_dir(out_dir, subdir):
+    """
+        Create out_dir/subdir if this process hasn't already, and return it
+    """
+
+    path = os.path.join(out_dir, subdir)
+    if subdir and path not in _created:
+        os.makedirs(path, exist_ok=True)
+        _created.add(path)
+    return path
+
+
+def part_name(name, part=None):
+    """
+        Return the name a file of the output directory gets when written by
+        a part of a run sharing the directory with others (a shard or a
+        worker), e.g. labels-00003-of-00040.txt for labels.txt. Unchanged if
+        part is None.
+    """
+
+    if part is None:
+        return name
+    stem, extension = os.path.splitext(name)
+    return "{}-{}{}".format(stem, part, extension)
+
+
+def shard_part(num_shards=1, shard_index=0):
+    """
+        Return the part (see part_name) of a shard of a sharded run (see the
+        --num_shards argument of run.py), None if the run isn't sharded
+    """
+
+    if num_shards == 1:
+        return None
+    return "{:05d}-of-{:05d}".format(shard_index, num_shards)
+
+
+def read_labels(out_dir, name_format=2):
+    """
+        Return the {image path: label} mapping of the labels file of out_dir,
+        or of the labels files of all its parts (see part_name), paths being
+        relative to out_dir. name_format is the one of the run (see
+        label_separator).
+    """
+
+    separator = label_separator(name_format)
+    stem, extension = os.path.splitext(LABELS_FILE)
+    paths = glob.glob(os.path.join(out_dir, "{}-*{}".format(stem, extension)))
+    paths.append(os.path.join(out_dir, LABELS_FILE))
+    labels = {}
+    for path in sorted(p for p in paths if os.path.isfile(p)):
+        with open(path, "r", encoding="utf8") as f:
+            for line in f:
+                path, _, label = line.rstrip("\n").partition(separator)
+                labels[path] = label
+    return labels
@@ -0,0 +1,196 @@
+"""
+Process-wide index and LRU cache of the picture backgrounds
+"""
+
+import os
+from collections import OrderedDict
+from threading import Lock
+
+from PIL import Image
+
+# In bytes of decoded pixels
+DEFAULT_CAPACITY = 256 * 1024 * 1024
+
+
+def _upscale(pic, width, height):
+    """
+        Return a picture upscaled, keeping its aspect ratio, to cover a
+        (width, height) background, the picture itself if it already does
+    """
+
+    if pic.size[0] < width:
+        pic = pic.resize(
+            [width, int(pic.size[1] * (width / pic.size[0]))], Image.ANTIALIAS
+        )
+    if pic.size[1] < height:
+        pic = pic.resize(
+            [int(pic.size[0] * (height / pic.size[1])), height], Image.ANTIALIAS
+        )
+    return pic
+
+
+def _nbytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+class PictureCache(object):
+    """
+        Bounded LRU cache of decoded pictures keyed by path, capped by the
+        total size of their pixels.
+
+        The pictures directory is listed once and every picture is decoded
+        once, so a cache hit costs no I/O at all: the background is cropped
+        from the already decoded picture (upscaled first if it is smaller
+        than the background, which the bundled pictures never are). Every
+        worker process gets its own instance (see `get_picture_cache`).
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity < 0:
+            raise ValueError("Picture cache capacity can't be negative")
+        self.capacity = capacity
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._listings = {}
+        self._sizes = {}
+        self._pictures = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._pictures)
+
+    def listdir(self, directory):
+        """
+            Return the pictures of directory (hidden files excluded), listing
+            it on the first call only
+        """
+
+        pictures = self._listings.get(directory)
+        if pictures is None:
+            pictures = [p for p in os.listdir(directory) if not p.startswith(".")]
+            self._listings[directory] = pictures
+        return pictures
+
+    def size(self, path):
+        """
+            Return the (width, height) of a picture without decoding it
+        """
+
+        size = self._sizes.get(path)
+        if size is None:
+            with Image.open(path) as pic:
+                size = pic.size
+            self._sizes[path] = size
+        return size
+
+    def get(self, path, width, height):
+        """
+            Return the picture at path, upscaled to cover (width, height) if
+            it is smaller. The returned image is shared and must not be
+            modified.
+        """
+
+        with self._lock:
+            pic = self._pictures.get(path)
+            if pic is not None:
+                self._pictures.move_to_end(path)
+                self.hits += 1
+                return _upscale(pic, width, height)
+            self.misses += 1
+
+        pic = Image.open(path)
+        pic.load()
+        self._sizes[path] = pic.size
+
+        nbytes = _nbytes(pic)
+        if nbytes <= self.capacity:
+            with self._lock:
+                if path not in self._pictures:
+                    self._pictures[path] = pic
+                    self.nbytes += nbytes
+                self._evict()
+        return _upscale(pic, width, height)
+
+    def preload(self, directory):
+        """
+            Decode the pictures of directory in listing order, as long as
+            they fit in the remaining capacity. Returns how many were loaded.
+        """
+
+        loaded = 0
+        for name in self.listdir(directory):
+            path = os.path.join(directory, name)
+            with Image.open(path) as pic:
+                nbytes = pic.size[0] * pic.size[1] * len(pic.getbands())
+                self._sizes[path] = pic.size
+            if self.nbytes + nbytes > self.capacity:
+                break
+            self.get(path, 1, 1)
+            loaded += 1
+        return loaded
+
+    def _evict(self):
+        while self.nbytes > self.capacity:
+            _, pic = self._pictures.popitem(last=False)
+            self.nbytes -= _nbytes(pic)
+            self.evictions += 1
+
+    def resize(self, capacity):
+        """
+            Change the capacity, evicting the least recently used pictures if needed
+        """
+
+        if capacity < 0:
+            raise ValueError("Picture cache capacity can't be negative")
+        with self._lock:
+            self.capacity = capacity
+            self._evict()
+
+    def clear(self):
+        """
+            Drop every cached picture and listing, and reset the counters
+        """
+
+        with self._lock:
+            self._listings.clear()
+            self._sizes.clear()
+            self._pictures.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """
+            Return the cache counters as a dict
+        """
+
+        return {
+            "size": len(self._pictures),
+            "bytes": self.nbytes,
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+_picture_cache = PictureCache()
+
+
+def get_picture_cache():
+    """
+        Return the cache shared by everything running in this process
+    """
+
+    return _picture_cache
+
+
+def set_picture_cache_capacity(capacity):
+    """
+        Resize the process-wide cache (usable from a Pool initializer)
+    """
+
+    _picture_cache.resize(capacity)
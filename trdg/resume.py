@@ -0,0 +1,207 @@
+"""
+Bookkeeping of the samples of a run that are done, so that it can be resumed
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+
+from trdg.output_layout import LABELS_FILE, label_separator, part_name
+from trdg.tar_shards import INDEX_EXTENSION
+
+METADATA_FILE = "metadata.jsonl"
+
+
+def _mark(done, index):
+    if 0 <= index < len(done):
+        done[index] = True
+
+
+def _index_from_name(name, name_format):
+    """
+        Return the index of a sample from the name of its image file
+    """
+
+    stem = os.path.splitext(os.path.basename(name))[0]
+    if name_format == 1:
+        return int(stem.split("_", 1)[0])
+    if name_format == 2:
+        return int(stem)
+    return int(stem.rsplit("_", 1)[1])
+
+
+def read_metadata(path, done):
+    """
+        Mark the samples of a metadata file in the done array. A line cut by
+        a crash is ignored.
+    """
+
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            try:
+                _mark(done, json.loads(line)["index"])
+            except (ValueError, KeyError):
+                continue
+
+
+def read_labels(path, name_format, done):
+    """
+        Mark the samples of a labels file in the done array. A line cut by a
+        crash is ignored.
+    """
+
+    separator = label_separator(name_format)
+    with open(path, "r", encoding="utf8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                continue
+            try:
+                _mark(done, _index_from_name(line.split(separator, 1)[0], name_format))
+            except (ValueError, IndexError):
+                continue
+
+
+def read_shard_indexes(directory, done, prefix="shard"):
+    """
+        Mark the samples of the indexed tar shards of directory in the done
+        array. Returns the number the next shard should get: a shard without
+        index wasn't closed, it is overwritten.
+    """
+
+    next_shard = 0
+    for path in sorted(glob.glob(os.path.join(directory, prefix + "-*.tar" + INDEX_EXTENSION))):
+        with open(path, "r", encoding="utf8") as f:
+            for key in json.load(f):
+                _mark(done, int(key))
+        shard = int(os.path.basename(path)[len(prefix) + 1 :].split(".", 1)[0])
+        next_shard = max(next_shard, shard + 1)
+    return next_shard
+
+
+def read_image_names(directory, name_format, extension, done):
+    """
+        Mark the samples whose image file is in directory in the done array,
+        returns the number of files found. Masks are written before the
+        images, so the image of a sample is the last of its files.
+    """
+
+    found = 0
+    suffix = "." + extension
+    for entry in os.scandir(directory):
+        if not entry.name.endswith(suffix) or entry.name.endswith("_mask.png"):
+            continue
+        try:
+            _mark(done, _index_from_name(entry.name, name_format))
+        except (ValueError, IndexError):
+            continue
+        found += 1
+    return found
+
+
+def find_done(out_dir, count, name_format=2, part=None, extension=None):
+    """
+        Return a boolean array of count elements telling which samples of an
+        interrupted run writing files to out_dir are done, and where it was
+        read from: the metadata file or else the labels file (only those of
+        part if given, see output_layout.part_name), or else the names of
+        the images of out_dir if extension is given (runs with the flat
+        layout and no journal). None if there is nothing to read.
+    """
+
+    done = np.zeros(count, dtype=bool)
+    for name in [METADATA_FILE, LABELS_FILE]:
+        name = part_name(name, part)
+        path = os.path.join(out_dir, name)
+        if os.path.isfile(path):
+            if name == METADATA_FILE:
+                read_metadata(path, done)
+            else:
+                read_labels(path, name_format, done)
+            return done, name
+    if (
+        extension is not None
+        and os.path.isdir(out_dir)
+        and read_image_names(out_dir, name_format, extension, done)
+    ):
+        return done, "the image file names"
+    return done, None
+
+
+def truncate_partial_line(path):
+    """
+        Cut a file after its last newline, dropping the line a crash left
+        unfinished if any
+    """
+
+    with open(path, "r+b") as f:
+        end = position = f.seek(0, os.SEEK_END)
+        while position > 0:
+            step = min(4096, position)
+            f.seek(position - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                position += newline + 1 - step
+                break
+            position -= step
+        if position != end:
+            f.truncate(position)
+
+
+class SampleJournal(object):
+    """
+        Appends a line to the labels file and/or the metadata file of out_dir
+        (those of part if given, see output_layout.part_name) for every
+        sample written, so that both are usable (and the run resumable) whenever it
+        stops. When appending, the last line of a file is dropped if a crash
+        cut it. The lines of the labels file are separated as suits the name
+        format of the images (see output_layout.label_separator).
+    """
+
+    def __init__(
+        self, out_dir, labels=True, metadata=False, append=False, part=None, name_format=2
+    ):
+        self._append = append
+        self._separator = label_separator(name_format)
+        self._labels = None
+        self._metadata = None
+        if labels:
+            self._labels = self._open(os.path.join(out_dir, part_name(LABELS_FILE, part)))
+        if metadata:
+            self._metadata = self._open(os.path.join(out_dir, part_name(METADATA_FILE, part)))
+
+    def _open(self, path):
+        if not self._append:
+            return open(path, "w", encoding="utf8")
+        if os.path.isfile(path):
+            truncate_partial_line(path)
+        return open(path, "a", encoding="utf8")
+
+    def add(self, index, path, text, font, seed):
+        """
+            Record a written sample, path being relative to the output
+            directory
+        """
+
+        path = path.replace(os.sep, "/")
+        if self._labels is not None:
+            self._labels.write("{}{}{}\n".format(path, self._separator, text))
+        if self._metadata is not None:
+            self._metadata.write(
+                json.dumps(
+                    {"index": index, "label": text, "path": path, "font": font, "seed": seed},
+                    ensure_ascii=False,
+                )
+                + "\n"
+            )
+
+    def flush(self):
+        for f in [self._labels, self._metadata]:
+            if f is not None:
+                f.flush()
+
+    def close(self):
+        for f in [self._labels, self._metadata]:
+            if f is not None:
+                f.close()
@@ -3,21 +3,58 @@ import os, errno
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
+import itertools
 import random as rnd
 import string
 import sys
+import threading
 
+import numpy as np
 from tqdm import tqdm
 from trdg.string_generator import (
     create_strings_from_dict,
-    create_strings_from_file,
     create_strings_from_wikipedia,
     create_strings_randomly,
+    iter_strings_from_file,
 )
 from trdg.utils import load_dict, load_fonts
-from trdg.data_generator import FakeTextDataGenerator
+from trdg.data_generator import FakeTextDataGenerator, set_generation_config
+from trdg.generation_config import GenerationConfig
+from trdg.font_cache import DEFAULT_CAPACITY, set_font_cache_capacity
+from trdg.font_index import load_metrics_index
+from trdg.output_layout import (
+    DEFAULT_FILES_PER_DIR,
+    LAYOUTS,
+    sample_names,
+    part_name,
+    shard_part,
+    sample_path,
+)
+from trdg.image_encoder import (
+    BACKENDS,
+    DEFAULT_JPEG_QUALITY,
+    DEFAULT_PNG_COMPRESSION,
+    DEFAULT_WEBP_QUALITY,
+)
+from trdg.leases import DEFAULT_LEASE_SIZE, DEFAULT_LEASE_TIMEOUT, LeaseQueue
+from trdg.picture_cache import set_picture_cache_capacity
+from trdg.resume import SampleJournal, find_done, read_shard_indexes
+from trdg.sample_writer import DEFAULT_THREADS, SampleWriter, set_sample_writer
+from trdg.tar_shards import (
+    DEFAULT_SAMPLES_PER_SHARD,
+    DEFAULT_SHARD_MAX_SIZE,
+    ShardWriter,
+    sample_key,
+)
+from trdg.stroke_library import load_stroke_library
+from trdg.tensor_output import LabelPacker, create_tensor_output, set_tensor_output
+from trdg.warmup import describe, warm_up
+import multiprocessing
 from multiprocessing import Pool
 
+# Number of strings created at once by iter_tasks
+STRING_BATCH_SIZE = 10000
+
 
 def margins(margin):
     margins = margin.split(",")
@@ -26,6 +63,53 @@ def margins(margin):
     return [int(m) for m in margins]
 
 
+def init_worker(
+    config,
+    font_cache_size,
+    metrics_index,
+    picture_cache_size,
+    stroke_library,
+    writer_threads,
+    writer_queue,
+    fonts=None,
+    tensor_output=None,
+    handwriting=True,
+):
+    """
+        Configure the generation parameters and the per-process caches of a
+        pool worker, then preload the resources of the run if fonts is given
+        (the handwriting model included unless handwriting is False).
+        tensor_output are the arguments of set_tensor_output if the samples
+        go to memory-mapped arrays.
+    """
+
+    set_generation_config(config)
+    set_font_cache_capacity(font_cache_size)
+    load_metrics_index(metrics_index)
+    set_picture_cache_capacity(picture_cache_size * 1024 * 1024)
+    load_stroke_library(stroke_library)
+    set_sample_writer(writer_threads, writer_queue)
+    set_tensor_output(*(tensor_output or (None,)))
+    if fonts is not None:
+        print(
+            "[{}] {}".format(
+                os.getpid(), describe(warm_up(config, fonts, handwriting=handwriting))
+            )
+        )
+
+
+def init_forked_worker():
+    """
+        Load in a worker forked from a warmed up process what it couldn't
+        share: the handwriting model, whose TensorFlow session doesn't
+        survive fork
+    """
+
+    from trdg import handwritten_text_generator
+
+    handwritten_text_generator.warm_up()
+
+
 def parse_arguments():
     """
         Parse the command line arguments of the program.
@@ -53,6 +137,14 @@ def parse_arguments():
         help="The language to use, should be fr (French), en (English), es (Spanish), de (German), or cn (Chinese).",
         default="en",
     )
+    parser.add_argument(
+        "-dt",
+        "--dict",
+        type=str,
+        nargs="?",
+        help="Define the dictionary to be used instead of the one of the language",
+        default="",
+    )
     parser.add_argument(
         "-c",
         "--count",
@@ -120,14 +212,63 @@ def parse_arguments():
         help="Define the number of thread to use for image generation",
         default=1,
     )
+    parser.add_argument(
+        "-cz",
+        "--chunksize",
+        type=int,
+        nargs="?",
+        help="Define how many samples are sent to a worker at once",
+        default=16,
+    )
+    parser.add_argument(
+        "-mf",
+        "--max_in_flight",
+        type=int,
+        nargs="?",
+        help="Define how many samples can be queued for the workers at once. Defaults to 4 chunks per worker",
+        default=None,
+    )
     parser.add_argument(
         "-e",
         "--extension",
         type=str,
         nargs="?",
-        help="Define the extension to save the image with",
+        help="Define the extension to save the image with, e.g. jpg, png, webp or npy (the uint8 array of the image)",
         default="jpg",
     )
+    parser.add_argument(
+        "-en",
+        "--encoder",
+        type=str,
+        nargs="?",
+        help="Library encoding the images, pil or cv2 (cv2.imencode)",
+        choices=BACKENDS,
+        default="pil",
+    )
+    parser.add_argument(
+        "-jq",
+        "--jpeg_quality",
+        type=int,
+        nargs="?",
+        help="Quality of the JPEG images, from 0 to 100",
+        default=DEFAULT_JPEG_QUALITY,
+    )
+    parser.add_argument(
+        "-pc",
+        "--png_compression",
+        type=int,
+        nargs="?",
+        help="Compression level of the PNG images and masks, from 0 (fastest, largest) to 9",
+        default=DEFAULT_PNG_COMPRESSION,
+    )
+    parser.add_argument(
+        "-wbq",
+        "--webp_quality",
+        type=int,
+        nargs="?",
+        help="Quality of the WebP images, from 0 to 100",
+        default=DEFAULT_WEBP_QUALITY,
+    )
     parser.add_argument(
         "-k",
         "--skew_angle",
@@ -313,7 +454,7 @@ def parse_arguments():
         default=0        
     )
     parser.add_argument(
-        "-al",
+        "-alo",
         "--alpha_low",
         type=int,
         nargs="?",
@@ -347,12 +488,202 @@ def parse_arguments():
         help="Apply a tight crop around the rendered text",
         default=False,
     )
+    parser.add_argument(
+        "-ol",
+        "--output_layout",
+        type=str,
+        nargs="?",
+        choices=LAYOUTS,
+        help="Define where the produced files go. flat: all in the output directory, index: --files_per_dir consecutive samples per nested subdirectory, hash: two levels of 256 subdirectories. Sharded layouts get a labels.txt of relative paths whatever the name format",
+        default="flat",
+    )
+    parser.add_argument(
+        "-fpd",
+        "--files_per_dir",
+        type=int,
+        nargs="?",
+        help="Number of samples per directory of the index output layout",
+        default=DEFAULT_FILES_PER_DIR,
+    )
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        type=str,
+        nargs="?",
+        choices=["files", "tar", "tensor"],
+        help="Define how the samples are stored. files: one file per image and mask, tar: appended to shard-NNNNNN.tar archives with a .idx offset index each, the labels being in the archives, tensor: written in place in images.npy, a memory-mapped (count, height, --tensor_width, --tensor_channels) uint8 array, with widths.npy, label_offsets.npy and labels.bin (see trdg/tensor_output.py)",
+        default="files",
+    )
+    parser.add_argument(
+        "-tw",
+        "--tensor_width",
+        type=int,
+        nargs="?",
+        help="Width the images are padded to with --output_format tensor, wider ones are squeezed",
+        default=512,
+    )
+    parser.add_argument(
+        "-tch",
+        "--tensor_channels",
+        type=int,
+        nargs="?",
+        choices=[1, 3],
+        help="Channels of the images with --output_format tensor, 1 for grayscale",
+        default=3,
+    )
+    parser.add_argument(
+        "-sps",
+        "--samples_per_shard",
+        type=int,
+        nargs="?",
+        help="Maximum number of samples of a tar shard",
+        default=DEFAULT_SAMPLES_PER_SHARD,
+    )
+    parser.add_argument(
+        "-sms",
+        "--shard_max_size",
+        type=int,
+        nargs="?",
+        help="Size in MB after which a new tar shard is started",
+        default=DEFAULT_SHARD_MAX_SIZE // (1024 * 1024),
+    )
+    parser.add_argument(
+        "-wt",
+        "--writer_threads",
+        type=int,
+        nargs="?",
+        help="Number of threads encoding and writing the samples of every worker (with --output_format tar, of the main process appending the samples encoded by the workers to the shards), 0 to do it on the rendering thread",
+        default=DEFAULT_THREADS,
+    )
+    parser.add_argument(
+        "-wq",
+        "--writer_queue",
+        type=int,
+        nargs="?",
+        help="Maximum number of samples waiting for a writer thread, 4 per thread by default",
+        default=0,
+    )
+    parser.add_argument(
+        "-md",
+        "--metadata",
+        action="store_true",
+        help="Append the index, label, path, font and seed of every sample to metadata.jsonl as it is written",
+        default=False,
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted run in the same output directory: the samples listed in metadata.jsonl, labels.txt or the tar shard indexes are skipped",
+        default=False,
+    )
+    parser.add_argument(
+        "-sd",
+        "--seed",
+        type=int,
+        nargs="?",
+        help="Seed of the run: the strings, fonts and every random draw of sample i only depend on it and i, whatever the number of processes. Random (and printed) by default",
+        default=None,
+    )
+    parser.add_argument(
+        "-ns",
+        "--num_shards",
+        type=int,
+        nargs="?",
+        help="Split the run in that many shards of consecutive indices, e.g. to render it on as many machines with the same --seed. The labels, metadata and tar shards of a shard get its number in their name, so that every shard can write to the same output directory",
+        default=1,
+    )
+    parser.add_argument(
+        "-si",
+        "--shard_index",
+        type=int,
+        nargs="?",
+        help="Shard of the run to render, from 0 to --num_shards - 1",
+        default=0,
+    )
+    parser.add_argument(
+        "-ld",
+        "--lease_dir",
+        type=str,
+        nargs="?",
+        help="Share the run with the other processes using this directory (e.g. on several machines, with the same --seed and --output_dir): each claims chunks of --lease_size indices with lease files, and takes over the chunks of the processes that stopped renewing theirs. Every process writes its own labels and metadata files",
+        default=None,
+    )
+    parser.add_argument(
+        "-ls",
+        "--lease_size",
+        type=int,
+        nargs="?",
+        help="Number of consecutive indices leased at once with --lease_dir",
+        default=DEFAULT_LEASE_SIZE,
+    )
+    parser.add_argument(
+        "-lt",
+        "--lease_timeout",
+        type=float,
+        nargs="?",
+        help="Seconds after which a lease that wasn't renewed can be taken over, its holder renews it 4 times as often",
+        default=DEFAULT_LEASE_TIMEOUT,
+    )
+    parser.add_argument(
+        "-re",
+        "--render_engine",
+        type=str,
+        nargs="?",
+        help="Define how the text is rasterized. pil: ImageDraw.text for every character, atlas: glyphs are rasterized once per worker and blitted from a cache",
+        default="pil",
+    )
+    parser.add_argument(
+        "-ke",
+        "--kerning",
+        action="store_true",
+        help="Apply the kerning pairs of the fonts between the characters of horizontal text",
+        default=False,
+    )
     parser.add_argument(
         "-ft", "--font", type=str, nargs="?", help="Define font to be used"
     )
     parser.add_argument(
         "-fd", "--font_dir", type=str, nargs="?", help="Define a font directory to be used"
     )
+    parser.add_argument(
+        "-fcs",
+        "--font_cache_size",
+        type=int,
+        nargs="?",
+        help="Define how many loaded fonts (font file and size pairs) each worker keeps in memory",
+        default=DEFAULT_CAPACITY,
+    )
+    parser.add_argument(
+        "-mi",
+        "--metrics_index",
+        type=str,
+        nargs="?",
+        help="Directory of a font metrics index built with trdg-font-index. Character sizes are read from it instead of being measured at runtime",
+        default=None,
+    )
+    parser.add_argument(
+        "-pcs",
+        "--picture_cache_size",
+        type=int,
+        nargs="?",
+        help="Define how many megabytes of decoded pictures each worker keeps in memory when using the picture background",
+        default=256,
+    )
+    parser.add_argument(
+        "-sl",
+        "--stroke_library",
+        type=str,
+        nargs="?",
+        help="Directory of a stroke library built with trdg-stroke-library. Handwritten words found in it are not sampled from the model",
+        default=None,
+    )
+    parser.add_argument(
+        "-nwu",
+        "--no_warm_up",
+        action="store_true",
+        help="Don't preload the fonts, pictures and handwriting model before generating. They are then loaded by each worker on first use",
+        default=False,
+    )
     parser.add_argument(
         "-ca",
         "--case",
@@ -363,6 +694,168 @@ def parse_arguments():
     return parser.parse_args()
 
 
+def create_strings(args, lang_dict, count):
+    """
+        Create count synthetic sentences (or words) from the source selected in args
+    """
+
+    if args.use_wikipedia:
+        return create_strings_from_wikipedia(args.length, count, args.language)
+    elif args.random_sequences:
+        return create_strings_randomly(
+            args.length,
+            args.random,
+            count,
+            args.include_letters,
+            args.include_numbers,
+            args.include_symbols,
+            args.language,
+        )
+    else:
+        return create_strings_from_dict(args.length, args.random, count, lang_dict)
+
+
+def shard_range(count, num_shards=1, shard_index=0):
+    """
+        Return the [start, stop) range of the indices of a run of count
+        samples that shard shard_index out of num_shards renders. The ranges
+        of the shards are contiguous, disjoint and cover the run.
+    """
+
+    return count * shard_index // num_shards, count * (shard_index + 1) // num_shards
+
+
+def batch_seed(seed, batch):
+    """
+        Return the seed of rnd for a batch of STRING_BATCH_SIZE samples
+    """
+
+    return "{}-{}".format(seed, batch)
+
+
+def iter_tasks(args, lang_dict, fonts, start=0, stop=None, done=None, started=None):
+    """
+        Yield the (index, text, font, seed) task of every sample from start
+        to stop (the end of the run by default), seed being the seed of the
+        run, skipping the indices marked in done (a boolean array) if given.
+        The (text, font, seed) of every task is stored in started (a dict)
+        by index if given.
+
+        Strings and fonts are drawn STRING_BATCH_SIZE samples at a time, so
+        that memory does not grow with the count, with rnd seeded by the
+        seed of the run and the number of the batch: they only depend on the
+        index of the sample, a shard of the run gets the same samples as
+        the whole run at its indices.
+    """
+
+    stop = args.count if stop is None else stop
+    first = start - start % STRING_BATCH_SIZE
+    file_strings = None
+    if args.input_file != "" and not args.use_wikipedia:
+        file_strings = itertools.islice(
+            iter_strings_from_file(args.input_file, args.count), first, None
+        )
+
+    seed = args.seed
+    for batch_start in range(first, stop, STRING_BATCH_SIZE):
+        size = min(STRING_BATCH_SIZE, args.count - batch_start)
+        rnd.seed(batch_seed(seed, batch_start // STRING_BATCH_SIZE))
+        if file_strings is None:
+            strings = create_strings(args, lang_dict, size)
+        else:
+            strings = list(itertools.islice(file_strings, size))
+        # Drawn for the whole batch, skipped samples included, so that the
+        # others get the fonts of an uninterrupted, unsharded run
+        batch_fonts = [fonts[rnd.randrange(0, len(fonts))] for _ in range(size)]
+
+        for i in range(max(start, batch_start), min(stop, batch_start + size)):
+            if done is not None and done[i]:
+                continue
+            text = strings[i - batch_start]
+            if args.case == "upper":
+                text = text.upper()
+            elif args.case == "lower":
+                text = text.lower()
+            font = batch_fonts[i - batch_start]
+            if started is not None:
+                started[i] = (text, font, seed)
+            yield (i, text, font, seed)
+
+
+def iter_leased_tasks(args, lang_dict, fonts, leases, started=None):
+    """
+        Yield the tasks (see iter_tasks) of the chunks claimed from leases,
+        a LeaseQueue, telling it about every task created. The tasks of a
+        chunk another process took over are no longer yielded.
+    """
+
+    for chunk in leases:
+        start, stop = leases.chunk_range(chunk)
+        for task in iter_tasks(args, lang_dict, fonts, start, stop, started=started):
+            if not leases.holds(chunk):
+                # Taken over by another process
+                if started is not None:
+                    started.pop(task[0], None)
+                break
+            leases.started(task[0])
+            yield task
+        leases.finished(chunk)
+
+
+class TaskFeed(object):
+    """
+        Iterable over tasks that lets at most max_in_flight of them be handed
+        to the pool before their result is consumed (see done).
+
+        Pool.imap_unordered reads its input as fast as it can, so without it
+        every task of the run would end up queued in memory.
+    """
+
+    def __init__(self, tasks, max_in_flight):
+        self._tasks = tasks
+        self._slots = threading.Semaphore(max_in_flight)
+        self._closed = False
+        # Each only written by one thread
+        self._fed = 0
+        self._done = 0
+
+    @property
+    def in_flight(self):
+        """
+            Number of tasks handed to the pool whose result isn't consumed yet
+        """
+
+        return self._fed - self._done
+
+    def __iter__(self):
+        while True:
+            self._slots.acquire()
+            if self._closed:
+                return
+            try:
+                task = next(self._tasks)
+            except StopIteration:
+                return
+            self._fed += 1
+            yield task
+
+    def done(self):
+        """
+            Mark the result of a task as consumed
+        """
+
+        self._done += 1
+        self._slots.release()
+
+    def close(self):
+        """
+            Stop feeding tasks, e.g. when the run is interrupted
+        """
+
+        self._closed = True
+        self._slots.release()
+
+
 def main():
     """
         Description: Main function
@@ -371,6 +864,25 @@ def main():
     # Argument parsing
     args = parse_arguments()
 
+    if args.num_shards < 1:
+        sys.exit("--num_shards must be at least 1")
+    if not 0 <= args.shard_index < args.num_shards:
+        sys.exit("--shard_index must be between 0 and --num_shards - 1")
+    if args.num_shards > 1 and args.seed is None:
+        sys.exit("A sharded run needs a --seed, the same for every shard")
+    if args.lease_dir:
+        if args.seed is None:
+            sys.exit("A run with --lease_dir needs a --seed, the same for every process")
+        if args.num_shards > 1 or args.resume or args.output_format != "files":
+            sys.exit(
+                "--lease_dir can't be combined with --num_shards, --resume or --output_format tar"
+            )
+
+    if args.seed is None:
+        args.seed = int(np.random.SeedSequence().entropy % 2 ** 63)
+        print("Seed: {}".format(args.seed))
+    rnd.seed(args.seed)
+
     # Create the directory if it does not exist.
     try:
         os.makedirs(args.output_dir)
@@ -378,8 +890,14 @@ def main():
         if e.errno != errno.EEXIST:
             raise
 
-    # Creating word list
-    lang_dict = load_dict(args.language)
+    # Creating word list, only needed when the strings are drawn from it
+    lang_dict = []
+    if not args.use_wikipedia and not args.random_sequences and args.input_file == "":
+        if args.dict:
+            with open(args.dict, "r", encoding="utf8", errors="ignore") as d:
+                lang_dict = [l for l in d.read().splitlines() if len(l) > 0]
+        else:
+            lang_dict = load_dict(args.language)
 
     # Create font (path) list
     if args.font_dir:
@@ -396,96 +914,257 @@ def main():
     else:
         fonts = load_fonts(args.language)
 
-    # Creating synthetic sentences (or word)
-    strings = []
+    # Set a name format compatible with special characters automatically if they are used
+    if (
+        not args.use_wikipedia
+        and args.input_file == ""
+        and args.random_sequences
+    ) and (
+        args.include_symbols
+        or True not in (args.include_letters, args.include_numbers, args.include_symbols)
+    ):
+        args.name_format = 2
 
-    if args.use_wikipedia:
-        strings = create_strings_from_wikipedia(args.length, args.count, args.language)
-    elif args.input_file != "":
-        strings = create_strings_from_file(args.input_file, args.count)
-    elif args.random_sequences:
-        strings = create_strings_randomly(
-            args.length,
-            args.random,
-            args.count,
-            args.include_letters,
-            args.include_numbers,
-            args.include_symbols,
-            args.language,
+    max_in_flight = args.max_in_flight or args.thread_count * args.chunksize * 4
+    if max_in_flight < args.chunksize:
+        sys.exit("--max_in_flight can't be smaller than --chunksize")
+
+    if args.files_per_dir < 1:
+        sys.exit("--files_per_dir must be at least 1")
+
+    start, stop = shard_range(args.count, args.num_shards, args.shard_index)
+    if args.num_shards > 1:
+        print(
+            "Shard {} of {}: samples {} to {}".format(
+                args.shard_index, args.num_shards, start, stop - 1
+            )
         )
-        # Set a name format compatible with special characters automatically if they are used
-        if args.include_symbols or True not in (
-            args.include_letters,
-            args.include_numbers,
-            args.include_symbols,
-        ):
-            args.name_format = 2
-    else:
-        strings = create_strings_from_dict(
-            args.length, args.random, args.count, lang_dict
+
+    tar_output = args.output_format == "tar"
+    tensor_output = args.output_format == "tensor"
+    if tensor_output and (
+        args.lease_dir or args.resume or args.output_mask or args.orientation != 0
+    ):
+        sys.exit(
+            "--output_format tensor needs horizontal text, without --output_mask, --resume or --lease_dir"
         )
+    part = shard_part(args.num_shards, args.shard_index)
+    leases = None
+    if args.lease_dir:
+
+        def flush_journal(chunk):
+            # The samples of a chunk must be listed before it is done
+            if journal is not None:
+                journal.flush()
 
-    if args.case == "upper":
-        strings = [x.upper() for x in strings]
-    if args.case == "lower":
-        strings = [x.lower() for x in strings]
-
-    string_count = len(strings)
-
-    p = Pool(args.thread_count)
-    for _ in tqdm(
-        p.imap_unordered(
-            FakeTextDataGenerator.generate_from_tuple,
-            zip(
-                [i for i in range(0, string_count)],
-                strings,
-                [fonts[rnd.randrange(0, len(fonts))] for _ in range(0, string_count)],
-                [args.output_dir] * string_count,
-                [args.format] * string_count,
-                [args.extension] * string_count,
-                [args.skew_angle] * string_count,
-                [args.random_skew] * string_count,
-                [args.blur] * string_count,
-                [args.random_blur] * string_count,
-                [args.background] * string_count,
-                [args.distorsion] * string_count,
-                [args.distorsion_orientation] * string_count,
-                [args.handwritten] * string_count,
-                [args.name_format] * string_count,
-                [args.width] * string_count,
-                [args.alignment] * string_count,
-                [args.text_color] * string_count,
-                [args.orientation] * string_count,
-                [args.space_width] * string_count,
-                [args.character_spacing] * string_count,
-                [args.margins] * string_count,
-                [args.random_margins] * string_count,
-                [args.erosion_kernel_size] * string_count,
-                [args.erosion_iteration] * string_count,
-                [args.erosion_cap] * string_count,
-                [args.n_holes_pct] * string_count,
-                [args.hole_size_pct] * string_count,
-                [args.alpha_low] * string_count,
-                [args.invert] * string_count,
-                [args.border_prob] * string_count,
-                [args.border] * string_count,
-                [args.fit] * string_count,
-                [args.output_mask] * string_count,
-            ),
-        ),
-        total=args.count,
+        leases = LeaseQueue(
+            args.lease_dir,
+            args.count,
+            args.lease_size,
+            args.lease_timeout,
+            on_done=flush_journal,
+        )
+        part = leases.owner
+    tar_prefix = part_name("shard", part)
+
+    done = None
+    first_shard = 0
+    if args.resume:
+        if tar_output:
+            done = np.zeros(args.count, dtype=bool)
+            first_shard = read_shard_indexes(args.output_dir, done, tar_prefix)
+            source = "the shard indexes"
+        else:
+            done, source = find_done(
+                args.output_dir, args.count, args.name_format, part, args.extension
+            )
+        if source is None:
+            print("Nothing to resume from, generating every sample")
+        else:
+            print(
+                "Resuming: {} samples out of {} done according to {}".format(
+                    done[start:stop].sum(), stop - start, source
+                )
+            )
+
+    config = GenerationConfig.from_args(args)
+    writer = None
+    journal = None
+    labels = None
+    if tensor_output:
+        # Workers write the images in place, this process the labels
+        config = config._replace(out_dir=None)
+        create_tensor_output(
+            args.output_dir,
+            stop - start,
+            args.format,
+            args.tensor_width,
+            args.tensor_channels,
+            part,
+        )
+        labels = LabelPacker(args.output_dir, stop - start, part)
+    elif tar_output:
+        # Workers return the encoded samples, this process writes them
+        config = config._replace(out_dir=None)
+        writer = ShardWriter(
+            args.output_dir,
+            prefix=tar_prefix,
+            samples_per_shard=args.samples_per_shard,
+            max_size=args.shard_max_size * 1024 * 1024,
+            first_shard=first_shard,
+        )
+    elif (
+        args.name_format == 2
+        or args.output_layout != "flat"
+        or args.metadata
+        or part is not None
     ):
-        pass
-    p.terminate()
-
-    if args.name_format == 2:
-        # Create file with filename-to-label connections
-        with open(
-            os.path.join(args.output_dir, "labels.txt"), "w", encoding="utf8"
-        ) as f:
-            for i in range(string_count):
-                file_name = str(i) + "." + args.extension
-                f.write("{} {}\n".format(file_name, strings[i]))
+        # Filename-to-label connections, appended as samples are written. A
+        # shard (or lease process) always lists the samples it wrote.
+        journal = SampleJournal(
+            args.output_dir,
+            labels=args.name_format == 2 or args.output_layout != "flat" or part is not None,
+            metadata=args.metadata,
+            append=args.resume,
+            part=part,
+            name_format=args.name_format,
+        )
+
+    # (text, font, seed) of the samples handed to the pool and not known to
+    # be written yet
+    started = {}
+
+    def record(index):
+        text, font, seed = started.pop(index)
+        if journal is not None:
+            image_name = sample_names(index, text, args.extension, args.name_format)[0]
+            path = sample_path(index, image_name, args.output_layout, args.files_per_dir)
+            journal.add(index, path, text, font, seed)
+        if leases is not None:
+            leases.written(index)
+
+    def pack_labels(tasks):
+        # Tasks are created in the order of the samples
+        for task in tasks:
+            labels.add(task[0] - start, task[1])
+            yield task
+
+    if tensor_output:
+        tasks = pack_labels(iter_tasks(args, lang_dict, fonts, start, stop, started=started))
+    elif leases is None:
+        tasks = iter_tasks(args, lang_dict, fonts, start, stop, done, started)
+    else:
+        tasks = iter_leased_tasks(args, lang_dict, fonts, leases, started)
+        leases.start_renewing()
+    feed = TaskFeed(tasks, max_in_flight)
+
+    initargs = (
+        config,
+        args.font_cache_size,
+        args.metrics_index,
+        args.picture_cache_size,
+        args.stroke_library,
+        0 if tar_output or tensor_output else args.writer_threads,
+        args.writer_queue,
+        None if args.no_warm_up else fonts,
+        (args.output_dir, part, start) if tensor_output else None,
+    )
+    if not args.no_warm_up and multiprocessing.get_start_method() == "fork":
+        # Load the fonts, coverage, metrics and pictures once, the forked
+        # workers inherit them copy-on-write. The handwriting model is loaded
+        # by every worker, a TensorFlow session can't be forked.
+        init_worker(*initargs, handwriting=False)
+
+        def new_pool():
+            if config.is_handwritten:
+                return Pool(args.thread_count, initializer=init_forked_worker)
+            return Pool(args.thread_count)
+
+    else:
+
+        def new_pool():
+            return Pool(args.thread_count, initializer=init_worker, initargs=initargs)
+
+    p = new_pool()
+    if tar_output:
+        generate = FakeTextDataGenerator.encode_from_task
+    elif tensor_output:
+        generate = FakeTextDataGenerator.tensor_from_task
+    else:
+        generate = FakeTextDataGenerator.generate_from_task
+    shard_stage = None
+    if tar_output and args.writer_threads > 0:
+        shard_stage = SampleWriter(args.writer_threads, args.writer_queue)
+    # Samples waiting to be written, by worker
+    worker_writes = {}
+    try:
+        progress = tqdm(
+            total=None if leases is not None else stop - start,
+            initial=0 if done is None else done[start:stop].sum(),
+        )
+        i = 0
+        while True:
+            for result in p.imap_unordered(generate, feed, chunksize=args.chunksize):
+                if tensor_output:
+                    started.pop(result[0])
+                    writes = 0
+                elif tar_output:
+                    index, files = result
+                    started.pop(index)
+                    if files is not None and shard_stage is None:
+                        writer.write(sample_key(index), files)
+                    elif files is not None:
+                        shard_stage.submit(writer.write, sample_key(index), files)
+                    writes = 0 if shard_stage is None else shard_stage.pending
+                else:
+                    pid, pending, written, skipped = result
+                    worker_writes[pid] = pending
+                    writes = sum(worker_writes.values())
+                    for index in written:
+                        record(index)
+                    for index in skipped:
+                        started.pop(index)
+                        if leases is not None:
+                            leases.skipped(index)
+                feed.done()
+                progress.update()
+                if i % args.chunksize == 0:
+                    progress.set_postfix(rendering=feed.in_flight, writing=writes, refresh=False)
+                    if journal is not None:
+                        journal.flush()
+                i += 1
+            # Let the workers finish their writes
+            p.close()
+            p.join()
+            if shard_stage is not None:
+                shard_stage.close()
+            # The last writes of every worker were done after its last result
+            for index in sorted(started):
+                text = started[index][0]
+                image_name = sample_names(index, text, args.extension, args.name_format)[0]
+                path = sample_path(index, image_name, args.output_layout, args.files_per_dir)
+                if os.path.isfile(os.path.join(args.output_dir, path)):
+                    record(index)
+            # With --lease_dir, every chunk of this process is done now, the
+            # chunks of other processes are taken over if they expire
+            if leases is None or not leases.wait():
+                break
+            feed = TaskFeed(
+                iter_leased_tasks(args, lang_dict, fonts, leases, started), max_in_flight
+            )
+            p = new_pool()
+        progress.close()
+    finally:
+        feed.close()
+        p.terminate()
+        if writer is not None:
+            writer.close()
+        if journal is not None:
+            journal.close()
+        if labels is not None:
+            labels.close()
+        if leases is not None:
+            leases.close()
 
 
 if __name__ == "__main__":
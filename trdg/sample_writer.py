@@ -0,0 +1,149 @@
+"""
+Encoding and writing of the samples on a bounded pool of threads
+"""
+
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.util import Finalize
+
+DEFAULT_THREADS = 2
+
+
+class SampleWriter(object):
+    """
+        Runs the encoding and writing of samples on threads, so that the
+        thread rendering them goes on with the next sample. Image encoders
+        and file writes release the GIL, so they actually overlap the
+        rendering.
+
+        At most max_pending jobs are queued or running (threads * 4 by
+        default), submit blocks when that many are. An exception raised by
+        a job is raised again by the next submit or close. What jobs return,
+        when it isn't None, is kept until read with completed.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS, max_pending=None):
+        if threads < 1:
+            raise ValueError("A sample writer needs at least one thread")
+        self.threads = threads
+        self.max_pending = max_pending or threads * 4
+        self._executor = ThreadPoolExecutor(threads)
+        self._slots = threading.Semaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._error = None
+        self._completed = deque()
+
+    @property
+    def pending(self):
+        """
+            Number of jobs queued or running
+        """
+
+        return self._pending
+
+    def submit(self, fn, *args):
+        """
+            Run fn(*args) on the pool
+        """
+
+        self._raise()
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(fn, *args).add_done_callback(self._done)
+
+    def completed(self):
+        """
+            Return the results of the jobs done since the last call
+        """
+
+        results = []
+        while self._completed:
+            results.append(self._completed.popleft())
+        return results
+
+    def _done(self, future):
+        if future.exception() is not None:
+            if self._error is None:
+                self._error = future.exception()
+        elif future.result() is not None:
+            self._completed.append(future.result())
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def close(self):
+        """
+            Wait for every submitted job to be done
+        """
+
+        self._executor.shutdown(wait=True)
+        self._raise()
+
+
+_threads = 0
+_max_pending = None
+_writer = None
+_writer_pid = None
+
+
+def set_sample_writer(threads, max_pending=None):
+    """
+        Make generate hand the saving of its samples to a SampleWriter of
+        threads threads, 0 to save them synchronously (usable from a Pool
+        initializer). The current writer of this process, if any, is closed.
+    """
+
+    global _threads, _max_pending, _writer
+    if _writer is not None and _writer_pid == os.getpid():
+        _writer.close()
+    _writer = None
+    _threads = threads
+    _max_pending = max_pending
+
+
+def get_sample_writer():
+    """
+        Return the writer of this process, None if samples are saved
+        synchronously. It is created on first use, so that a process forked
+        after set_sample_writer gets its own threads, and it is closed when
+        the process exits.
+    """
+
+    global _writer, _writer_pid
+    if _threads == 0:
+        return None
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = SampleWriter(_threads, _max_pending)
+        _writer_pid = os.getpid()
+        Finalize(_writer, _writer.close, exitpriority=10)
+    return _writer
+
+
+def pending_writes():
+    """
+        Return the number of samples of this process waiting to be written
+    """
+
+    if _writer is None or _writer_pid != os.getpid():
+        return 0
+    return _writer.pending
+
+
+def completed_writes():
+    """
+        Return the results of the jobs of the writer of this process done
+        since the last call
+    """
+
+    if _writer is None or _writer_pid != os.getpid():
+        return []
+    return _writer.completed()
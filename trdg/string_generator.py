@@ -27,6 +27,20 @@ def create_strings_from_file(filename, count):
     return strings
 
 
+def iter_strings_from_file(filename, count):
+    """
+        Same strings as create_strings_from_file, yielded one at a time
+    """
+
+    with open(filename, "r", encoding="utf8") as f:
+        lines = [l[0:200] for l in f.read().splitlines() if len(l) > 0]
+    if len(lines) == 0:
+        raise Exception("No lines could be read in file")
+
+    for i in range(count):
+        yield lines[i % len(lines)]
+
+
 def create_strings_from_dict(length, allow_variable, count, lang_dict):
     """
         Create all strings by picking X random word in the dictionnary
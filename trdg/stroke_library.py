@@ -0,0 +1,195 @@
+"""
+On-disk library of handwriting strokes sampled ahead of time
+
+The library is a directory holding strokes.f32, every stroke sequence
+appended one after the other as float32 (dx, dy, end of stroke) rows,
+and an index.json giving the (first row, row count) of every sequence
+of every word. Sampling a word from the handwriting model costs one
+session run per pen position, drawing it from the library costs a
+slice of a memory-mapped file and a random affine jitter.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+INDEX_FILE = "index.json"
+DATA_FILE = "strokes.f32"
+
+
+def jitter(coords, scale=0.08, slant=0.15, rng=None):
+    """
+        Return a randomly distorted copy of a (N, 3) array of pen offsets:
+        the x and y axes are scaled by up to +/- scale and slanted by up to
+        +/- slant, so repeated words don't look alike
+    """
+
+    rng = np.random.default_rng(rng)
+    coords = np.array(coords, dtype=np.float64)
+    transform = np.array(
+        [
+            [1 + rng.uniform(-scale, scale), rng.uniform(-slant, slant)],
+            [0.0, 1 + rng.uniform(-scale, scale)],
+        ]
+    )
+    coords[:, :2] = coords[:, :2].dot(transform.T)
+    return coords
+
+
+class StrokeLibrary(object):
+    """
+        Stroke sequences keyed by word, read from and appended to library_dir
+    """
+
+    def __init__(self, library_dir):
+        self.library_dir = library_dir
+        self._index = {}
+        self._data = None
+        self._rows = 0
+        self._pending = []
+        index_path = os.path.join(library_dir, INDEX_FILE)
+        if os.path.isfile(index_path):
+            with open(index_path, "r", encoding="utf8") as f:
+                self._index = json.load(f)
+            self._rows = os.path.getsize(os.path.join(library_dir, DATA_FILE)) // 12
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, word):
+        return word in self._index
+
+    def count(self, word):
+        """
+            Return how many stroke sequences the library has for word
+        """
+
+        return len(self._index.get(word, []))
+
+    def _array(self):
+        if self._data is None or len(self._data) < self._rows:
+            self._data = np.memmap(
+                os.path.join(self.library_dir, DATA_FILE),
+                dtype=np.float32,
+                mode="r",
+                shape=(self._rows, 3),
+            )
+        return self._data
+
+    def get(self, word, variant):
+        """
+            Return the variant-th (N, 3) stroke sequence of word
+        """
+
+        start, length = self._index[word][variant]
+        if start < self._rows:
+            return np.asarray(self._array()[start : start + length])
+        # Added since the last flush
+        start -= self._rows
+        for coords in self._pending:
+            if start == 0:
+                return coords
+            start -= len(coords)
+        raise KeyError(word)
+
+    def sample(self, word, rng=None):
+        """
+            Return a random stroke sequence of word, None if it has none
+        """
+
+        count = self.count(word)
+        if count == 0:
+            return None
+        return self.get(word, np.random.default_rng(rng).integers(count))
+
+    def add(self, word, coords):
+        """
+            Add a stroke sequence of word, written to disk by flush
+        """
+
+        coords = np.asarray(coords, dtype=np.float32).reshape(-1, 3)
+        self._index.setdefault(word, []).append(
+            [self._rows + sum(len(c) for c in self._pending), len(coords)]
+        )
+        self._pending.append(coords)
+
+    def flush(self):
+        """
+            Append the added sequences to the data file and rewrite the index
+        """
+
+        if not os.path.isdir(self.library_dir):
+            os.makedirs(self.library_dir)
+        with open(os.path.join(self.library_dir, DATA_FILE), "ab") as f:
+            for coords in self._pending:
+                f.write(coords.tobytes())
+                self._rows += len(coords)
+        self._pending = []
+
+        # Readers never see an index pointing past the data
+        index_path = os.path.join(self.library_dir, INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+
+
+_stroke_library = None
+
+
+def load_stroke_library(library_dir):
+    """
+        Make the handwriting generator of this process draw words from the
+        library in library_dir first
+    """
+
+    global _stroke_library
+    _stroke_library = StrokeLibrary(library_dir) if library_dir else None
+
+
+def get_stroke_library():
+    return _stroke_library
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sample handwriting strokes of every word of a dictionary into a stroke library."
+    )
+    parser.add_argument(
+        "-d", "--dict", type=str, nargs="?", help="File with one word per line", required=True
+    )
+    parser.add_argument(
+        "-n",
+        "--variants",
+        type=int,
+        nargs="?",
+        help="How many stroke sequences to keep per word",
+        default=5,
+    )
+    parser.add_argument(
+        "-o", "--output_dir", type=str, nargs="?", help="Directory of the library", required=True
+    )
+    args = parser.parse_args()
+
+    from trdg.handwritten_text_generator import get_model
+    from tqdm import tqdm
+
+    with open(args.dict, "r", encoding="utf8", errors="ignore") as f:
+        words = [w for w in f.read().splitlines() if len(w) > 0 and " " not in w]
+
+    library = StrokeLibrary(args.output_dir)
+    model = get_model()
+    for i, word in enumerate(tqdm(words)):
+        for _ in range(args.variants - library.count(word)):
+            library.add(word, model.sample(word)[1])
+        if i % 100 == 99:
+            library.flush()
+    library.flush()
+
+
+if __name__ == "__main__":
+    main()
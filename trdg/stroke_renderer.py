@@ -0,0 +1,99 @@
+"""
+Rasterization of handwriting strokes
+"""
+
+import cv2
+import numpy as np
+
+from PIL import Image
+
+# Fractional bits of the coordinates given to cv2.polylines
+_SHIFT = 4
+
+DEFAULT_HEIGHT = 64
+DEFAULT_STROKE_WIDTH = 3
+
+
+def _split_strokes(points):
+    points = np.array(points)
+    strokes = []
+    b = 0
+    for e in range(len(points)):
+        if points[e, 2] == 1.0:
+            strokes += [points[b : e + 1, :2].copy()]
+            b = e + 1
+    return strokes
+
+
+def _cumsum(points):
+    sums = np.cumsum(points[:, :2], axis=0)
+    return np.concatenate([sums, points[:, 2:]], axis=1)
+
+
+def render_strokes(
+    words,
+    color,
+    height=DEFAULT_HEIGHT,
+    stroke_width=DEFAULT_STROKE_WIDTH,
+    word_spacing=0.25,
+):
+    """
+        Draw a line of handwritten words on a transparent RGBA image.
+
+        words: one (N, 3) array of (dx, dy, end of stroke) pen offsets per
+        word, as sampled by the handwriting model
+        color: (r, g, b) of the ink
+        height: height of the image, every word is drawn at the same scale
+        and keeps its position relative to the pen origin
+        word_spacing: space between words, as a fraction of height
+
+        The bounding box of the strokes (plus half the stroke width) is
+        exactly the image, with anti-aliased strokes in the alpha channel.
+    """
+
+    words = [_split_strokes(_cumsum(np.asarray(coords, dtype=np.float64))) for coords in words]
+    words = [strokes for strokes in words if len(strokes) > 0]
+    if len(words) == 0:
+        return Image.new("RGBA", (1, height), tuple(color) + (0,))
+
+    boxes = []
+    for strokes in words:
+        points = np.concatenate(strokes)
+        boxes.append((points.min(axis=0), points.max(axis=0)))
+    min_y = min(low[1] for low, _ in boxes)
+    max_y = max(high[1] for _, high in boxes)
+
+    margin = stroke_width / 2.0
+    scale = (height - 2 * margin) / max(max_y - min_y, 1e-6)
+    spacing = word_spacing * height
+
+    # Position of every word along x, in pixels
+    offsets = []
+    x = margin
+    for low, high in boxes:
+        offsets.append(x - low[0] * scale)
+        x += (high[0] - low[0]) * scale + spacing
+    width = int(np.ceil(x - spacing + margin))
+
+    alpha = np.zeros((height, width), dtype=np.uint8)
+    for strokes, offset in zip(words, offsets):
+        polylines = []
+        for stroke in strokes:
+            points = np.empty_like(stroke)
+            points[:, 0] = offset + stroke[:, 0] * scale
+            points[:, 1] = margin + (stroke[:, 1] - min_y) * scale
+            polylines.append(np.round(points * (1 << _SHIFT)).astype(np.int32))
+        cv2.polylines(
+            alpha,
+            polylines,
+            False,
+            255,
+            thickness=max(int(round(stroke_width)), 1),
+            lineType=cv2.LINE_AA,
+            shift=_SHIFT,
+        )
+
+    image = np.empty((height, width, 4), dtype=np.uint8)
+    image[:, :, :3] = color
+    image[:, :, 3] = alpha
+    return Image.fromarray(image, "RGBA")
@@ -0,0 +1,231 @@
+"""
+Output of the samples to tar shards, in the layout of WebDataset
+
+Every sample is stored as consecutive members sharing a key: KEY.EXT for
+the image, KEY.mask.png for the mask if any and KEY.json for the label.
+Next to every SHARD.tar, SHARD.idx maps every key to the (offset, size)
+of the data of its members, so that a sample can be read with one seek
+instead of a scan of the archive.
+"""
+
+import glob
+import io
+import json
+import os
+import tarfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+from trdg.image_encoder import DEFAULT_ENCODER, RAW_EXTENSIONS
+
+DEFAULT_SAMPLES_PER_SHARD = 10000
+DEFAULT_SHARD_MAX_SIZE = 1024 * 1024 * 1024
+
+INDEX_EXTENSION = ".idx"
+
+
+def sample_key(index):
+    return "{:09d}".format(index)
+
+
+def sample_files(index, text, image, mask=None, extension="jpg", metadata=None, encoder=None):
+    """
+        Return the {member extension: bytes} of a sample, encoded with
+        encoder (an ImageEncoder, the default one if None), metadata being
+        added to the index and label in its JSON
+    """
+
+    encoder = encoder or DEFAULT_ENCODER
+    files = {extension: encoder.encode(image, extension)}
+    if mask is not None:
+        files["mask.png"] = encoder.encode(mask, "png")
+    info = {"index": index, "label": text}
+    info.update(metadata or {})
+    files["json"] = json.dumps(info, ensure_ascii=False).encode("utf8")
+    return files
+
+
+class ShardWriter(object):
+    """
+        Appends samples to PREFIX-NNNNNN.tar files of out_dir, starting a new
+        shard when the current one holds samples_per_shard samples or
+        max_size bytes. write can be called from several threads.
+    """
+
+    def __init__(
+        self,
+        out_dir,
+        prefix="shard",
+        samples_per_shard=DEFAULT_SAMPLES_PER_SHARD,
+        max_size=DEFAULT_SHARD_MAX_SIZE,
+        first_shard=0,
+    ):
+        self.out_dir = out_dir
+        self.prefix = prefix
+        self.samples_per_shard = samples_per_shard
+        self.max_size = max_size
+        self.shard = first_shard
+        self.shards = []
+        self._tar = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _path(self, shard):
+        return os.path.join(self.out_dir, "{}-{:06d}.tar".format(self.prefix, shard))
+
+    def _open(self):
+        path = self._path(self.shard)
+        self._tar = tarfile.open(path, "w", format=tarfile.USTAR_FORMAT)
+        self._index = {}
+        self.shards.append(path)
+
+    def _close_shard(self):
+        self._tar.close()
+        with open(self._tar.name + INDEX_EXTENSION, "w", encoding="utf8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        self._tar = None
+        self._index = None
+        self.shard += 1
+
+    def write(self, key, files):
+        """
+            Append the {member extension: bytes} of the sample key
+        """
+
+        with self._lock:
+            self._write(key, files)
+
+    def _write(self, key, files):
+        if self._tar is not None and (
+            len(self._index) >= self.samples_per_shard or self._tar.offset >= self.max_size
+        ):
+            self._close_shard()
+        if self._tar is None:
+            self._open()
+
+        members = {}
+        for extension, data in files.items():
+            info = tarfile.TarInfo("{}.{}".format(key, extension))
+            info.size = len(data)
+            self._tar.addfile(info, io.BytesIO(data))
+            # The data is padded up to a whole number of blocks
+            blocks = (len(data) + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE
+            members[extension] = [self._tar.offset - blocks * tarfile.BLOCKSIZE, len(data)]
+        self._index[key] = members
+
+    def close(self):
+        with self._lock:
+            if self._tar is not None:
+                self._close_shard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_shards(samples, out_dir, extension="jpg", **kwargs):
+    """
+        Write the (image, label) or ((image, mask), label) items of a
+        generator to tar shards of out_dir, returns the paths of the shards.
+        kwargs are passed to ShardWriter.
+    """
+
+    with ShardWriter(out_dir, **kwargs) as writer:
+        for index, (image, label) in enumerate(samples):
+            mask = None
+            if isinstance(image, tuple):
+                image, mask = image
+            writer.write(sample_key(index), sample_files(index, label, image, mask, extension))
+    return writer.shards
+
+
+def _decode(files):
+    sample = {"image": None, "mask": None}
+    for extension, data in files.items():
+        if extension == "json":
+            sample.update(json.loads(data.decode("utf8")))
+        elif extension == "mask.png":
+            sample["mask"] = Image.open(io.BytesIO(data))
+        elif extension in RAW_EXTENSIONS:
+            sample["image"] = np.load(io.BytesIO(data))
+        else:
+            sample["image"] = Image.open(io.BytesIO(data))
+    return sample
+
+
+class ShardReader(object):
+    """
+        Reads the samples of the tar shards of a directory, either by key
+        (one seek per member) or sequentially (iteration, one pass over every
+        archive)
+
+        A sample is a dict with the image (an array for raw formats), the
+        mask (None without one), the label and the index of the sample.
+    """
+
+    def __init__(self, directory, prefix="shard"):
+        self.shards = sorted(glob.glob(os.path.join(directory, prefix + "-*.tar")))
+        self._index = {}
+        for shard, path in enumerate(self.shards):
+            with open(path + INDEX_EXTENSION, "r", encoding="utf8") as f:
+                for key, members in json.load(f).items():
+                    self._index[key] = (shard, members)
+        self._files = {}
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def read(self, key):
+        """
+            Return the {member extension: bytes} of a sample
+        """
+
+        shard, members = self._index[key]
+        f = self._files.get(shard)
+        if f is None:
+            f = self._files[shard] = open(self.shards[shard], "rb")
+        files = {}
+        for extension, (offset, size) in members.items():
+            f.seek(offset)
+            files[extension] = f.read(size)
+        return files
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            key = sample_key(key)
+        return _decode(self.read(key))
+
+    def __iter__(self):
+        for path in self.shards:
+            key, files = None, {}
+            with tarfile.open(path, "r|") as tar:
+                for member in tar:
+                    member_key, _, extension = member.name.partition(".")
+                    if member_key != key and files:
+                        yield _decode(files)
+                        files = {}
+                    key = member_key
+                    files[extension] = tar.extractfile(member).read()
+            if files:
+                yield _decode(files)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
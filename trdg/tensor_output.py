@@ -0,0 +1,190 @@
+"""
+Output of the samples to memory-mapped NumPy arrays, ready to be fed to a
+model reading fixed-height images padded to a maximum width
+
+images.npy: uint8 (N, H, Wmax, C), the image of sample i in row i, padded
+with zeros on the right
+widths.npy: int32 (N,), the width of every image before padding, 0 for a
+sample that was skipped or not written yet
+label_offsets.npy: int64 (N + 1,), the label of sample i being
+labels.bin[label_offsets[i]:label_offsets[i + 1]], encoded in UTF-8
+
+Workers write their rows in place, no image is encoded or decoded.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from PIL import Image
+
+from trdg.output_layout import part_name
+
+IMAGES_FILE = "images.npy"
+WIDTHS_FILE = "widths.npy"
+LABEL_OFFSETS_FILE = "label_offsets.npy"
+LABELS_FILE = "labels.bin"
+
+CHANNELS = {1: "L", 3: "RGB"}
+
+
+def tensor_path(out_dir, name, part=None):
+    return os.path.join(out_dir, part_name(name, part))
+
+
+def create_tensor_output(out_dir, count, height, max_width, channels=3, part=None):
+    """
+        Preallocate the images and widths arrays of count samples in out_dir
+        (the files of part if given, see output_layout.part_name). The
+        images file is sparse until written on most filesystems.
+    """
+
+    if channels not in CHANNELS:
+        raise ValueError("Tensor output has 1 or 3 channels, not {}".format(channels))
+    images = open_memmap(
+        tensor_path(out_dir, IMAGES_FILE, part),
+        mode="w+",
+        dtype=np.uint8,
+        shape=(count, height, max_width, channels),
+    )
+    widths = open_memmap(
+        tensor_path(out_dir, WIDTHS_FILE, part), mode="w+", dtype=np.int32, shape=(count,)
+    )
+    del images, widths
+
+
+class TensorWriter(object):
+    """
+        Writes images in place in the rows of the arrays of
+        create_tensor_output, sample first_index going to row 0. An image
+        of another height is scaled to the height of the array, keeping its
+        aspect ratio, then squeezed to the maximum width if wider.
+    """
+
+    def __init__(self, out_dir, part=None, first_index=0):
+        self.images = np.load(tensor_path(out_dir, IMAGES_FILE, part), mmap_mode="r+")
+        self.widths = np.load(tensor_path(out_dir, WIDTHS_FILE, part), mmap_mode="r+")
+        self.first_index = first_index
+        _, self.height, self.max_width, channels = self.images.shape
+        self.mode = CHANNELS[channels]
+
+    def write(self, index, image):
+        """
+            Write the image of sample index, returns its width
+        """
+
+        image = image.convert(self.mode)
+        width, height = image.size
+        if height != self.height:
+            width = max(1, round(width * self.height / height))
+        width = min(width, self.max_width)
+        if image.size != (width, self.height):
+            image = image.resize((width, self.height), Image.LANCZOS)
+
+        row = index - self.first_index
+        pixels = np.asarray(image)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, None]
+        self.images[row, :, :width] = pixels
+        self.images[row, :, width:] = 0
+        self.widths[row] = width
+        return width
+
+    def flush(self):
+        self.images.flush()
+        self.widths.flush()
+
+
+class LabelPacker(object):
+    """
+        Appends the labels of count consecutive samples to the packed label
+        buffer, in the order of the samples
+    """
+
+    def __init__(self, out_dir, count, part=None):
+        self._labels = open(tensor_path(out_dir, LABELS_FILE, part), "wb")
+        self.offsets = open_memmap(
+            tensor_path(out_dir, LABEL_OFFSETS_FILE, part),
+            mode="w+",
+            dtype=np.int64,
+            shape=(count + 1,),
+        )
+        self._row = 0
+
+    def add(self, row, text):
+        if row != self._row:
+            raise ValueError("Labels must be added in order, expected row {}".format(self._row))
+        data = text.encode("utf8")
+        self._labels.write(data)
+        self.offsets[row + 1] = self.offsets[row] + len(data)
+        self._row += 1
+
+    def close(self):
+        self._labels.close()
+        self.offsets.flush()
+
+
+class TensorDataset(object):
+    """
+        Read-only access to a tensor output: dataset[i] is the
+        (unpadded image array, label) of sample i. images, widths and
+        labels give the whole arrays, memory-mapped.
+    """
+
+    def __init__(self, out_dir, part=None):
+        self.images = np.load(tensor_path(out_dir, IMAGES_FILE, part), mmap_mode="r")
+        self.widths = np.load(tensor_path(out_dir, WIDTHS_FILE, part), mmap_mode="r")
+        self.label_offsets = np.load(
+            tensor_path(out_dir, LABEL_OFFSETS_FILE, part), mmap_mode="r"
+        )
+        labels = tensor_path(out_dir, LABELS_FILE, part)
+        if os.path.getsize(labels) == 0:
+            # An empty file can't be mapped
+            self.labels = np.zeros(0, dtype=np.uint8)
+        else:
+            self.labels = np.memmap(labels, mode="r")
+
+    def __len__(self):
+        return len(self.widths)
+
+    def label(self, index):
+        start, stop = self.label_offsets[index], self.label_offsets[index + 1]
+        return self.labels[start:stop].tobytes().decode("utf8")
+
+    def __getitem__(self, index):
+        return self.images[index, :, : self.widths[index]], self.label(index)
+
+
+_out_dir = None
+_part = None
+_first_index = 0
+_writer = None
+_writer_pid = None
+
+
+def set_tensor_output(out_dir, part=None, first_index=0):
+    """
+        Make get_tensor_writer write to the arrays of out_dir (None to
+        disable), usable from a Pool initializer
+    """
+
+    global _out_dir, _part, _first_index, _writer
+    _out_dir = out_dir
+    _part = part
+    _first_index = first_index
+    _writer = None
+
+
+def get_tensor_writer():
+    """
+        Return the TensorWriter of this process, opened on first use so that
+        every forked process maps the files itself
+    """
+
+    global _writer, _writer_pid
+    if _out_dir is None:
+        return None
+    if _writer is None or _writer_pid != os.getpid():
+        _writer = TensorWriter(_out_dir, _part, _first_index)
+        _writer_pid = os.getpid()
+    return _writer
@@ -0,0 +1,224 @@
+"""
+Single pass text layout shared by every renderer of computer_text_generator
+"""
+
+import string
+from collections import namedtuple
+
+from trdg.font_cache import get_font
+from trdg.font_index import get_metrics_index, get_font_coverage
+
+EN_CHARACTERS = frozenset(string.ascii_letters + string.digits + string.punctuation + " ")
+
+# fonts: font path used for every character
+# offsets: position of every character along the writing direction
+# advances: size of every character along the writing direction (kerning included)
+# width, height: size of the whole line
+TextLayout = namedtuple(
+    "TextLayout", ["text", "fonts", "offsets", "advances", "width", "height"]
+)
+
+
+class MissingGlyphError(ValueError):
+    """
+        Raised when a character is covered by none of the fonts of a sample,
+        which would render it as an empty box ("tofu")
+    """
+
+    def __init__(self, text, characters):
+        self.text = text
+        self.characters = characters
+        super(MissingGlyphError, self).__init__(
+            "No font can draw {} in {!r}".format(
+                ", ".join(repr(c) for c in characters), text
+            )
+        )
+
+
+class FontMetrics(object):
+    """
+        Per (font path, size) table of character sizes and kerning pairs.
+
+        Characters are read from the on-disk metrics index when one is loaded
+        (see font_index.load_metrics_index), otherwise they are measured once
+        with getsize. After that, all lookups are dict accesses.
+    """
+
+    def __init__(self, font_path, size):
+        self.font_path = font_path
+        self.size = size
+        self._sizes = {}
+        self._kerning = {}
+        index = get_metrics_index()
+        self._table = index.get(font_path, size) if index is not None else None
+
+    def getsize(self, c):
+        """
+            Return the (width, height) of a character
+        """
+
+        size = self._sizes.get(c)
+        if size is None:
+            if self._table is not None:
+                size = self._table.getsize(c)
+            if size is None:
+                size = get_font(self.font_path, self.size).getsize(c)
+            self._sizes[c] = size
+        return size
+
+    def width(self, c):
+        return self.getsize(c)[0]
+
+    def height(self, c):
+        return self.getsize(c)[1]
+
+    def kerning(self, left, right):
+        """
+            Return the horizontal adjustment between two consecutive characters
+        """
+
+        pair = left + right
+        k = self._kerning.get(pair)
+        if k is None:
+            k = (
+                get_font(self.font_path, self.size).getsize(pair)[0]
+                - self.width(left)
+                - self.width(right)
+            )
+            self._kerning[pair] = k
+        return k
+
+
+_font_metrics = {}
+
+
+def clear_font_metrics():
+    """
+        Forget every metrics table, e.g. after loading another metrics index
+    """
+
+    _font_metrics.clear()
+
+
+def get_font_metrics(font_path, size):
+    """
+        Return the metrics table of (font_path, size) for this process
+    """
+
+    key = (font_path, size)
+    metrics = _font_metrics.get(key)
+    if metrics is None:
+        metrics = FontMetrics(font_path, size)
+        _font_metrics[key] = metrics
+    return metrics
+
+
+def route(c, font_en, font_ch):
+    """
+        Return the font a character is drawn with, using the ASCII set only
+    """
+
+    return font_en if c in EN_CHARACTERS else font_ch
+
+
+def route_text(text, font_en, font_ch):
+    """
+        Return the font every character of text is drawn with.
+
+        Characters go to font_en if it covers them, then to font_ch. When the
+        coverage of the fonts can't be read, this falls back to sending the
+        printable ASCII characters to font_en and everything else to font_ch.
+        Raises MissingGlyphError if a character is covered by neither font.
+    """
+
+    coverage_en = get_font_coverage(font_en)
+    coverage_ch = get_font_coverage(font_ch)
+    if coverage_en is None or coverage_ch is None:
+        return [route(c, font_en, font_ch) for c in text]
+
+    fonts = []
+    missing = []
+    for c in text:
+        if c in coverage_en or c == " ":
+            fonts.append(font_en)
+        elif c in coverage_ch:
+            fonts.append(font_ch)
+        else:
+            missing.append(c)
+    if len(missing) > 0:
+        raise MissingGlyphError(text, missing)
+    return fonts
+
+
+def layout_horizontal(
+    text, font_en, font_ch, font_size, space_width, character_spacing, kerning=False
+):
+    """
+        Lay a line out from left to right
+    """
+
+    metrics_en = get_font_metrics(font_en, font_size)
+    metrics_ch = get_font_metrics(font_ch, font_size)
+    space_width_en = int(metrics_en.width(" ") * space_width)
+
+    fonts = route_text(text, font_en, font_ch)
+    offsets = []
+    advances = []
+    height = 0
+    x = 0
+    previous = None
+    for c, font in zip(text, fonts):
+        metrics = metrics_en if font == font_en else metrics_ch
+        if c.strip() != "":
+            advance = metrics.width(c)
+        else:
+            advance = space_width_en
+        if (
+            kerning
+            and previous is not None
+            and previous[1] is metrics
+            and previous[0].strip() != ""
+            and c.strip() != ""
+        ):
+            k = metrics.kerning(previous[0], c)
+            advances[-1] += k
+            x += k
+
+        offsets.append(x)
+        advances.append(advance)
+        height = max(height, metrics_en.height(c), metrics_ch.height(c))
+        x += advance + character_spacing
+        previous = (c, metrics)
+
+    width = x - character_spacing if len(text) > 0 else 0
+
+    return TextLayout(text, fonts, offsets, advances, width, height)
+
+
+def layout_vertical(text, font_en, font_ch, font_size, space_width, character_spacing):
+    """
+        Lay a line out from top to bottom
+    """
+
+    metrics_en = get_font_metrics(font_en, font_size)
+    metrics_ch = get_font_metrics(font_ch, font_size)
+    space_height_en = int(metrics_en.height(" ") * space_width)
+
+    fonts = route_text(text, font_en, font_ch)
+    offsets = []
+    advances = []
+    width = 0
+    y = 0
+    for c, font in zip(text, fonts):
+        metrics = metrics_en if font == font_en else metrics_ch
+        if c.strip() != "":
+            advance = metrics.height(c)
+        else:
+            advance = space_height_en
+
+        offsets.append(y)
+        advances.append(advance)
+        width = max(width, metrics_en.width(c), metrics_ch.width(c))
+        y += advance + character_spacing
+
+    return TextLayout(text, fonts, offsets, advances, width, y)
@@ -0,0 +1,75 @@
+"""
+Preloading of the per-process resources used to render samples
+"""
+
+import os
+import time
+
+from trdg.background_generator import pictures_directory
+from trdg.font_cache import get_font_cache
+from trdg.font_index import get_font_coverage
+from trdg.picture_cache import get_picture_cache
+from trdg.text_layout import get_font_metrics
+
+# Background type of background_generator.picture
+PICTURE_BACKGROUND = 3
+
+
+def warm_up(config, fonts, handwriting=True):
+    """
+        Load everything the samples of config will need in this process, so
+        that rendering them afterwards is only per-sample work:
+
+        - fonts (as many as the font cache holds) at config.size, with their
+          coverage and metrics table
+        - the picture backgrounds (as many as the picture cache holds)
+        - the handwriting model, unless handwriting is False: its
+          TensorFlow session can't be shared with forked processes, so a
+          process that forks its workers after warming up leaves it to them
+
+        Returns a dict describing what was loaded and how long it took.
+    """
+
+    start = time.time()
+
+    font_cache = get_font_cache()
+    loaded_fonts = []
+    for font in fonts:
+        if font in loaded_fonts:
+            continue
+        if len(loaded_fonts) == font_cache.capacity:
+            break
+        font_cache.get(font, config.size)
+        get_font_coverage(font)
+        get_font_metrics(font, config.size)
+        loaded_fonts.append(font)
+
+    pictures = 0
+    if config.background_type == PICTURE_BACKGROUND and os.path.isdir(pictures_directory()):
+        pictures = get_picture_cache().preload(pictures_directory())
+
+    handwriting = handwriting and bool(config.is_handwritten)
+    if handwriting:
+        from trdg import handwritten_text_generator
+
+        handwritten_text_generator.warm_up()
+
+    return {
+        "seconds": time.time() - start,
+        "fonts": len(loaded_fonts),
+        "pictures": pictures,
+        "handwritten": handwriting,
+    }
+
+
+def describe(summary):
+    """
+        Return a one line description of a warm_up summary
+    """
+
+    return "Warm-up: {:.2f}s ({} fonts, {} pictures{})".format(
+        summary["seconds"],
+        summary["fonts"],
+        summary["pictures"],
+        ", handwriting model" if summary["handwritten"] else "",
+    )